@@ -0,0 +1,120 @@
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.93"))
+ANSWER_CACHE_TTL_SECONDS = int(os.getenv("ANSWER_CACHE_TTL_SECONDS", str(24 * 3600)))
+ANSWER_CACHE_MAX_ITEMS = int(os.getenv("ANSWER_CACHE_MAX_ITEMS", "2000"))
+
+# Touched whenever SiteKnowledge changes; every worker compares its mtime before a lookup,
+# so an admin edit handled by one worker invalidates the caches of all of them.
+KNOWLEDGE_VERSION_PATH = os.getenv("KNOWLEDGE_VERSION_PATH", os.path.join("cache", "knowledge_version"))
+
+
+def invalidate_all():
+    if os.path.dirname(KNOWLEDGE_VERSION_PATH):
+        os.makedirs(os.path.dirname(KNOWLEDGE_VERSION_PATH), exist_ok=True)
+    with open(KNOWLEDGE_VERSION_PATH, "a"):
+        pass
+    os.utime(KNOWLEDGE_VERSION_PATH, None)
+
+
+def _knowledge_version():
+    try:
+        return os.stat(KNOWLEDGE_VERSION_PATH).st_mtime_ns
+    except FileNotFoundError:
+        return 0
+
+
+def replay_tokens(text: str):
+    # word-sized pieces so a cached answer streams like a live one
+    return re.findall(r"\S+\s*|\s+", text)
+
+#-------------------------------------------------------------------------------------------
+
+class SemanticAnswerCache:
+    """
+    Site-knowledge answers keyed by question embedding. A lookup returns the answer
+    of the most similar cached question when cosine similarity >= threshold.
+    Entries expire after ttl seconds and the least recently used are evicted past max_items.
+    """
+
+    def __init__(self, embed, threshold: float = ANSWER_CACHE_THRESHOLD,
+                 ttl: int = ANSWER_CACHE_TTL_SECONDS, max_items: int = ANSWER_CACHE_MAX_ITEMS):
+        self.embed = embed
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_items = max_items
+
+        self._entries = OrderedDict()   # question -> (unit vector, answer, created_at)
+        self._matrix = None
+        self._keys = []
+        self._version = _knowledge_version()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, question: str):
+        vector = self._unit(self.embed([question])[0])
+        now = time.time()
+
+        with self._lock:
+            self._check_version()
+            self._expire(now)
+            if self._entries:
+                if self._matrix is None:
+                    self._keys = list(self._entries.keys())
+                    self._matrix = np.stack([self._entries[k][0] for k in self._keys])
+                scores = self._matrix @ vector
+                best = int(np.argmax(scores))
+                if scores[best] >= self.threshold:
+                    key = self._keys[best]
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return self._entries[key][1], vector
+            self.misses += 1
+        return None, vector
+
+    def store(self, question: str, answer: str, vector=None):
+        if vector is None:
+            vector = self._unit(self.embed([question])[0])
+        with self._lock:
+            self._check_version()
+            self._entries[question] = (vector, answer, time.time())
+            self._entries.move_to_end(question)
+            while len(self._entries) > self.max_items:
+                self._entries.popitem(last=False)
+            self._matrix = None
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._matrix = None
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "items": len(self._entries)}
+
+    #---------------------------------------------------------------------------------------
+
+    def _unit(self, vector):
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _check_version(self):
+        version = _knowledge_version()
+        if version != self._version:
+            self._version = version
+            self._entries.clear()
+            self._matrix = None
+
+    def _expire(self, now):
+        stale = [k for k, (_, _, created) in self._entries.items() if now - created > self.ttl]
+        for key in stale:
+            del self._entries[key]
+        if stale:
+            self._matrix = None
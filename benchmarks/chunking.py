@@ -0,0 +1,109 @@
+"""
+Chunker benchmark: fixed 500-char slicer vs chunker.chunk_text.
+
+Builds a synthetic corpus of Arabic sale contracts where each clause carries one fact,
+asks one question per fact, and counts a hit when a top-k chunk contains the whole
+fact sentence. Retrieval uses a local hashed character-trigram embedder so the run is
+offline and deterministic. Ingest time adds a simulated per-API-call latency to the
+measured chunking time, comparing one embedding call per text (old) with pooled
+EMBED_BATCH_SIZE batches (new).
+
+Run from the repo root:
+    python -m benchmarks.chunking --contracts 200 --call-latency 0.3
+"""
+import argparse
+import random
+import time
+import zlib
+
+import numpy as np
+
+from chunker import chunk_text, slice_text
+
+_DIM = 2048
+
+CLAUSES = [
+    ("البند {n}: يقع العقار في حي {place} بمدينة حمص قرب جامعة البعث.", "أين يقع العقار في حي {place}"),
+    ("البند {n}: رقم السجل العقاري للشقة هو {reg} في منطقة {place}.", "ما رقم السجل العقاري {reg}"),
+    ("البند {n}: الثمن المتفق عليه {price} ليرة سورية يدفع على دفعتين.", "كم الثمن المتفق عليه {price}"),
+    ("البند {n}: تبلغ مساحة الشقة {area} متراً مربعاً وتتألف من {rooms} غرف.", "ما مساحة الشقة {area} متر"),
+    ("البند {n}: يلتزم البائع بتسليم العقار خلال {days} يوماً من تاريخ التوقيع.", "متى يتم تسليم العقار خلال {days} يوم"),
+]
+PLACES = ["الوعر", "الإنشاءات", "عكرمة", "الحمراء", "الغوطة", "الزهراء", "باب عمرو", "الخالدية"]
+FILLER = "ويقر الطرفان بأهليتهما القانونية للتعاقد وبأن هذا العقد ملزم لهما ولخلفائهما. "
+
+
+def embed(texts):
+    out = np.zeros((len(texts), _DIM), dtype=np.float32)
+    for row, text in enumerate(texts):
+        text = f"  {text}  "
+        for i in range(len(text) - 2):
+            out[row, zlib.crc32(text[i:i + 3].encode("utf-8")) % _DIM] += 1.0
+    norms = np.linalg.norm(out, axis=1, keepdims=True)
+    return out / np.maximum(norms, 1e-9)
+
+
+def build_corpus(contracts, rng):
+    docs, facts = [], []
+    for c in range(contracts):
+        lines = [f"عقد بيع عقار رقم {c}", ""]
+        for n, (clause, question) in enumerate(rng.sample(CLAUSES, len(CLAUSES)), start=1):
+            values = {
+                "n": n, "place": rng.choice(PLACES), "reg": f"{rng.randint(100, 9999)}/{rng.randint(1, 40)}",
+                "price": rng.randint(10, 900) * 1_000_000, "area": rng.randint(60, 250),
+                "rooms": rng.randint(1, 6), "days": rng.randint(10, 120),
+            }
+            sentence = clause.format(**values)
+            lines.append(sentence + " " + FILLER * rng.randint(1, 4))
+            lines.append("")
+            facts.append((c, sentence, question.format(**values)))
+        docs.append("\n".join(lines))
+    return docs, facts
+
+
+def evaluate(name, splitter, docs, facts, k, batch, call_latency, batched):
+    start = time.perf_counter()
+    chunks, owners = [], []
+    calls = 0
+    for d, doc in enumerate(docs):
+        parts = splitter(doc)
+        chunks.extend(parts)
+        owners.extend([d] * len(parts))
+        if not batched:
+            calls += 1
+    if batched:
+        calls = -(-len(chunks) // batch)
+    matrix = embed(chunks)
+    ingest = time.perf_counter() - start + calls * call_latency
+
+    hits = 0
+    start = time.perf_counter()
+    for doc_id, sentence, question in facts:
+        # same per-conversation filter as search_document_chunks
+        rows = [i for i, o in enumerate(owners) if o == doc_id]
+        scores = matrix[rows] @ embed([question])[0]
+        top = [rows[i] for i in np.argsort(-scores)[:k]]
+        if any(sentence in chunks[i] for i in top):
+            hits += 1
+    query_time = (time.perf_counter() - start) / len(facts)
+
+    print(f"{name:10} chunks={len(chunks):6} api_calls={calls:5} ingest={ingest:7.2f}s "
+          f"hit@{k}={hits / len(facts):.3f} query={query_time * 1000:.2f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--contracts", type=int, default=200)
+    parser.add_argument("--k", type=int, default=3)
+    parser.add_argument("--batch", type=int, default=128)
+    parser.add_argument("--call-latency", type=float, default=0.3, help="simulated seconds per embedding API call")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    docs, facts = build_corpus(args.contracts, random.Random(args.seed))
+    evaluate("slicer", slice_text, docs, facts, args.k, args.batch, args.call_latency, batched=False)
+    evaluate("chunker", chunk_text, docs, facts, args.k, args.batch, args.call_latency, batched=True)
+
+
+if __name__ == "__main__":
+    main()
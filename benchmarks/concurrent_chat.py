@@ -0,0 +1,169 @@
+"""
+Concurrency benchmark for the /chat/ask/ streaming path.
+
+Compares the old model (a sync generator drained through Starlette's threadpool,
+capped at 40 threads) with the async get_ai_answer pipeline. The upstream model is
+a fake stream with fixed per-token latency, so only the server side is measured.
+Every stream gets its own conversation and question, so single-flight and the answer
+cache cannot collapse them into one upstream call.
+
+Run from the repo root:
+    python -m benchmarks.concurrent_chat --streams 400 --tokens 50 --token-delay 0.02
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+_tmp_db = os.path.join(tempfile.mkdtemp(), "bench.db")
+# a fresh file per run; concurrent checkpoint commits wait for the write lock instead of failing
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{_tmp_db}?timeout=60")
+os.environ.setdefault("OPENAI_API_KEY", "bench")
+
+from starlette.concurrency import iterate_in_threadpool
+
+import models
+import services
+import upstream
+import vector_service
+from database import engine, AsyncSessionLocal
+
+
+class _Stats:
+    def __init__(self):
+        self.in_flight = 0
+        self.peak = 0
+
+    def enter(self):
+        self.in_flight += 1
+        self.peak = max(self.peak, self.in_flight)
+
+    def leave(self):
+        self.in_flight -= 1
+
+
+def _completion(text):
+    message = type("Message", (), {"content": text})()
+    choice = type("Choice", (), {"message": message})()
+    return type("Completion", (), {"choices": [choice], "usage": None})()
+
+
+def _chunk(token):
+    delta = type("Delta", (), {"content": token})()
+    choice = type("Choice", (), {"delta": delta})()
+    return type("Chunk", (), {"choices": [choice]})()
+
+
+class _FakeAsyncStream:
+    def __init__(self, stats, tokens, delay):
+        self.stats, self.tokens, self.delay = stats, tokens, delay
+
+    async def __aiter__(self):
+        self.stats.enter()
+        try:
+            for i in range(self.tokens):
+                await asyncio.sleep(self.delay)
+                yield _chunk(f"t{i} ")
+        finally:
+            self.stats.leave()
+
+
+class _FakeCompletions:
+    def __init__(self, stats, tokens, delay):
+        self.stats, self.tokens, self.delay = stats, tokens, delay
+
+    async def create(self, **kwargs):
+        if not kwargs.get("stream"):
+            # summaries and titles: a plain completion
+            return _completion("ملخص")
+        return _FakeAsyncStream(self.stats, self.tokens, self.delay)
+
+
+class _FakeClient:
+    def __init__(self, stats, tokens, delay):
+        self.chat = type("Chat", (), {"completions": _FakeCompletions(stats, tokens, delay)})()
+
+
+def _sync_stream(stats, tokens, delay):
+    # Old behaviour: the sync OpenAI stream blocks the thread between tokens
+    stats.enter()
+    try:
+        for i in range(tokens):
+            time.sleep(delay)
+            yield f"t{i} "
+    finally:
+        stats.leave()
+
+
+def _fake_embed(texts):
+    return [[1.0] + [0.0] * 7 for _ in texts]
+
+
+async def run_threadpool(streams, tokens, delay):
+    stats = _Stats()
+
+    async def one():
+        async for _ in iterate_in_threadpool(_sync_stream(stats, tokens, delay)):
+            pass
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(streams)))
+    return time.perf_counter() - start, stats.peak, 0
+
+
+async def run_async(streams, tokens, delay):
+    stats = _Stats()
+    services.client = _FakeClient(stats, tokens, delay)
+    vector_service.search_vector_db = lambda *a, **k: ""
+    vector_service.cached_ef = _fake_embed
+    services.answer_cache.embed = _fake_embed
+    services.answer_cache.threshold = 2.0   # never hit: measure the streaming path
+
+    async with AsyncSessionLocal() as db:
+        convs = [models.Conversation(title=f"bench {i}") for i in range(streams)]
+        db.add_all(convs)
+        await db.commit()
+        conv_ids = [c.id for c in convs]
+
+    shed = 0
+
+    async def one(i):
+        nonlocal shed
+        async with AsyncSessionLocal() as db:
+            conv = await db.get(models.Conversation, conv_ids[i])
+            try:
+                async for _ in services.get_ai_answer(db, f"سؤال رقم {i}", conv):
+                    pass
+            except upstream.Saturated:
+                # turned away by the upstream scheduler; the client would get a "busy" event
+                shed += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(streams)))
+    return time.perf_counter() - start, stats.peak, shed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--streams", type=int, default=400)
+    parser.add_argument("--tokens", type=int, default=50)
+    parser.add_argument("--token-delay", type=float, default=0.02)
+    args = parser.parse_args()
+
+    models.Base.metadata.create_all(bind=engine)
+    if engine.url.get_backend_name() == "sqlite":
+        # readers do not block the writer (and the other way round) while streams checkpoint
+        with engine.connect() as conn:
+            conn.exec_driver_sql("PRAGMA journal_mode=WAL")
+    ideal = args.tokens * args.token_delay
+
+    for name, runner in (("threadpool (sync)", run_threadpool), ("async", run_async)):
+        elapsed, peak, shed = asyncio.run(runner(args.streams, args.tokens, args.token_delay))
+        print(f"{name:18} streams={args.streams} wall={elapsed:.2f}s "
+              f"(single stream={ideal:.2f}s) peak concurrent streams={peak} shed={shed}")
+    print(f"async TTFT: {services.ttft_stats()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+"""
+Offline stand-in for the OpenAI endpoints this service calls, for load tests.
+
+Implements POST /v1/chat/completions (plain, JSON-mode and streaming, with the final
+usage chunk when stream_options.include_usage is set) and
+POST /v1/embeddings (float and base64 encodings). Answers are synthetic Arabic text
+streamed at a fixed rate after a configurable time-to-first-token; embeddings are
+deterministic hashed character-trigram vectors, so similar texts get similar vectors
+and retrieval / the semantic caches behave realistically.
+
+Both the openai client and chroma's OpenAIEmbeddingFunction read OPENAI_BASE_URL,
+so the API is pointed at the stand-in without code changes:
+
+    python -m benchmarks.fake_openai --port 9000 --ttft 0.4 --tokens-per-sec 60 --tokens 120
+    OPENAI_BASE_URL=http://127.0.0.1:9000/v1 OPENAI_API_KEY=offline uvicorn main:app --port 8000
+"""
+import argparse
+import asyncio
+import base64
+import json
+import random
+import time
+import uuid
+import zlib
+from array import array
+
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import StreamingResponse
+
+WORDS = ("العقار", "يقع", "في", "حي", "الوعر", "بمساحة", "متر", "مربع", "والسعر", "المطلوب", "ليرة",
+         "ويمكن", "التواصل", "مع", "المكتب", "لتحديد", "موعد", "المعاينة", "حسب", "دليل", "المنصة")
+
+settings = {
+    "ttft": 0.4,              # seconds before the first streamed token
+    "tokens_per_sec": 60.0,
+    "tokens": 120,            # tokens per answer
+    "embed_latency": 0.05,    # seconds per embeddings request
+    "dim": 1536,
+    "error_rate": 0.0,        # share of requests answered with a 500
+}
+counters = {"chat": 0, "chat_stream": 0, "embeddings": 0, "embedded_texts": 0, "errors": 0}
+
+app = FastAPI(title="fake-openai")
+
+
+def embed(text: str, dim: int):
+    vec = [0.0] * dim
+    text = f"  {text}  "
+    for i in range(len(text) - 2):
+        h = zlib.crc32(text[i:i + 3].encode("utf-8"))
+        vec[h % dim] += 1.0 if (h >> 16) & 1 else -1.0
+    norm = sum(v * v for v in vec) ** 0.5 or 1.0
+    return [v / norm for v in vec]
+
+
+def _maybe_fail():
+    if settings["error_rate"] and random.random() < settings["error_rate"]:
+        counters["errors"] += 1
+        raise HTTPException(status_code=500, detail={"error": {"message": "injected failure", "type": "server_error"}})
+
+
+def _answer_tokens(messages, n):
+    # deterministic per prompt, so coalescing and caching behave as with a temperature-0 model
+    rng = random.Random(zlib.crc32(json.dumps(messages, ensure_ascii=False).encode("utf-8")))
+    return [rng.choice(WORDS) + " " for _ in range(n)]
+
+
+def _prompt_tokens(messages):
+    # rough count (about 4 characters per token) for the usage block
+    return sum(len(str(m.get("content") or "")) for m in messages) // 4 + 1
+
+
+def _completion_id():
+    return f"chatcmpl-{uuid.uuid4().hex[:24]}"
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    _maybe_fail()
+    model = body.get("model", "gpt-4o-mini")
+    messages = body.get("messages", [])
+    n = min(settings["tokens"], body.get("max_tokens") or settings["tokens"])
+    created = int(time.time())
+    prompt = _prompt_tokens(messages)
+
+    if (body.get("response_format") or {}).get("type") == "json_object":
+        content = json.dumps({"intent": "technical", "reply": ""})
+    else:
+        content = None
+
+    if not body.get("stream"):
+        counters["chat"] += 1
+        await asyncio.sleep(settings["ttft"] + n / settings["tokens_per_sec"] if content is None else settings["ttft"])
+        content = content or "".join(_answer_tokens(messages, n)).strip()
+        return {
+            "id": _completion_id(), "object": "chat.completion", "created": created, "model": model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": prompt, "completion_tokens": n, "total_tokens": prompt + n},
+        }
+
+    counters["chat_stream"] += 1
+    completion_id = _completion_id()
+
+    def frame(delta, finish=None):
+        chunk = {"id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                 "choices": [{"index": 0, "delta": delta, "finish_reason": finish}]}
+        return f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+
+    async def events():
+        await asyncio.sleep(settings["ttft"])
+        yield frame({"role": "assistant", "content": ""})
+        interval = 1.0 / settings["tokens_per_sec"]
+        for token in _answer_tokens(messages, n):
+            yield frame({"content": token})
+            await asyncio.sleep(interval)
+        yield frame({}, "stop")
+        if (body.get("stream_options") or {}).get("include_usage"):
+            # like the real API: one last chunk with no choices carrying the usage of the call
+            usage = {"id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                     "choices": [], "usage": {"prompt_tokens": prompt, "completion_tokens": n,
+                                              "total_tokens": prompt + n}}
+            yield f"data: {json.dumps(usage)}\n\n"
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+
+@app.post("/v1/embeddings")
+async def embeddings(request: Request):
+    body = await request.json()
+    _maybe_fail()
+    texts = body["input"]
+    if isinstance(texts, str):
+        texts = [texts]
+    dim = body.get("dimensions") or settings["dim"]
+    counters["embeddings"] += 1
+    counters["embedded_texts"] += len(texts)
+    await asyncio.sleep(settings["embed_latency"])
+
+    data = []
+    for i, text in enumerate(texts):
+        vec = embed(text if isinstance(text, str) else " ".join(map(str, text)), dim)
+        if body.get("encoding_format") == "base64":
+            vec = base64.b64encode(array("f", vec).tobytes()).decode("ascii")
+        data.append({"object": "embedding", "index": i, "embedding": vec})
+    return {"object": "list", "data": data, "model": body.get("model"),
+            "usage": {"prompt_tokens": 0, "total_tokens": 0}}
+
+
+@app.get("/stats")
+def stats():
+    return {"settings": settings, "counters": counters}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument("--ttft", type=float, default=settings["ttft"])
+    parser.add_argument("--tokens-per-sec", type=float, default=settings["tokens_per_sec"])
+    parser.add_argument("--tokens", type=int, default=settings["tokens"])
+    parser.add_argument("--embed-latency", type=float, default=settings["embed_latency"])
+    parser.add_argument("--dim", type=int, default=settings["dim"])
+    parser.add_argument("--error-rate", type=float, default=settings["error_rate"])
+    args = parser.parse_args()
+    for key in settings:
+        settings[key] = getattr(args, key)
+
+    import uvicorn
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,194 @@
+"""
+Load test for a running API: concurrent virtual users over /chat/ask/, document upload
+and /admin/knowledge/.
+
+Point the API at the offline stand-in (see benchmarks.fake_openai) so runs are free and
+repeatable, then:
+
+    python -m benchmarks.load_test --base-url http://127.0.0.1:8000 --users 50 --duration 60 \
+        --mix chat=0.7,knowledge=0.2,upload=0.1
+
+Each user loops for --duration seconds picking a scenario by weight. Reported per
+scenario: requests, error rate, throughput, p50/p95/p99 of TTFT and full latency; for
+chat also tokens/sec per stream; for uploads the time until ingestion is done.
+"""
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import time
+
+import httpx
+
+from benchmarks.pdf_extraction import write_pdf
+
+QUESTIONS = [
+    "كيف أسجل عقاراً جديداً على المنصة؟",
+    "ما هي الأوراق المطلوبة لنقل الملكية؟",
+    "كم رسوم تسجيل عقد البيع؟",
+    "كيف أبحث عن شقة قرب جامعة حمص؟",
+    "هل يمكن تعديل إعلان عقاري بعد نشره؟",
+    "ما مدة معالجة طلب الفراغ العقاري؟",
+]
+SEARCH_TERMS = ["تسجيل", "عقد", "رسوم", "شقة", "الملكية", "إعلان"]
+
+
+class Recorder:
+
+    def __init__(self):
+        self.samples = {}
+
+    def add(self, scenario, ok, latency, ttft=None, tokens=0, extra=None):
+        self.samples.setdefault(scenario, []).append(
+            {"ok": ok, "latency": latency, "ttft": ttft, "tokens": tokens, "extra": extra}
+        )
+
+    def report(self, elapsed):
+        for scenario, rows in sorted(self.samples.items()):
+            ok = [r for r in rows if r["ok"]]
+            line = (f"{scenario:<10} n={len(rows):<6} errors={1 - len(ok) / len(rows):6.1%} "
+                    f"rps={len(rows) / elapsed:7.2f}  latency {_percentiles([r['latency'] for r in ok])}")
+            ttfts = [r["ttft"] for r in ok if r["ttft"] is not None]
+            if ttfts:
+                line += f"  ttft {_percentiles(ttfts)}"
+            rates = [r["tokens"] / (r["latency"] - r["ttft"]) for r in ok
+                     if r["tokens"] and r["ttft"] is not None and r["latency"] > r["ttft"]]
+            if rates:
+                line += f"  tokens/s p50={_pick(sorted(rates), 0.5):.1f}"
+            extras = [r["extra"] for r in ok if r["extra"] is not None]
+            if extras:
+                line += f"  ingest {_percentiles(extras)}"
+            print(line)
+
+
+def _pick(values, q):
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def _percentiles(values):
+    if not values:
+        return "-"
+    values = sorted(values)
+    return " ".join(f"p{int(q * 100)}={_pick(values, q) * 1000:.0f}ms" for q in (0.5, 0.95, 0.99))
+
+#-------------------------------------------------------------------------------------------
+
+async def chat(client, rec, state):
+    payload = {"question": random.choice(QUESTIONS)}
+    if state.get("conversation_id") and random.random() < 0.5:
+        payload["conversation_id"] = state["conversation_id"]
+    start = time.perf_counter()
+    ttft, tokens, event, ok = None, 0, None, False
+    try:
+        async with client.stream("POST", "/chat/ask/", json=payload) as response:
+            ok = response.status_code == 200
+            state["conversation_id"] = int(response.headers.get("X-Conversation-Id", 0)) or None
+            async for line in response.aiter_lines():
+                if line.startswith("event:"):
+                    event = line[6:].strip()
+                elif line.startswith("data:") and event == "token":
+                    if ttft is None:
+                        ttft = time.perf_counter() - start
+                    tokens += 1
+                elif line.startswith("data:") and event in ("error", "busy"):
+                    ok = False
+                elif not line:
+                    event = None
+    except httpx.HTTPError:
+        ok = False
+    rec.add("chat", ok, time.perf_counter() - start, ttft, tokens)
+
+
+async def knowledge(client, rec, state):
+    start = time.perf_counter()
+    params = {"q": random.choice(SEARCH_TERMS), "limit": 20, "total": "none"}
+    try:
+        response = await client.get("/admin/knowledge/", params=params)
+        ok = response.status_code == 200
+    except httpx.HTTPError:
+        ok = False
+    rec.add("knowledge", ok, time.perf_counter() - start)
+
+
+async def upload(client, rec, state, pdf_dir, pdf_pages, ingest_timeout):
+    # a fresh nonce per upload: identical bytes would be deduplicated by the upload store
+    # and identical text would be served from the embedding cache
+    nonce = random.randint(0, 10 ** 9)
+    pdf_path = os.path.join(pdf_dir, f"contract-{nonce}.pdf")
+    write_pdf(pdf_path, pdf_pages, 40, nonce)
+    start = time.perf_counter()
+    try:
+        with open(pdf_path, "rb") as f:
+            files = {"file": (f"contract-{nonce}.pdf", f.read(), "application/pdf")}
+        os.remove(pdf_path)
+        response = await client.post("/admin/conversations/documents", files=files)
+        ok = response.status_code == 200
+        uploaded = time.perf_counter() - start
+        ingest = None
+        if ok:
+            doc_id = response.json()["id"]
+            while time.perf_counter() - start < ingest_timeout:
+                status = (await client.get(f"/admin/documents/{doc_id}/status")).json().get("status")
+                if status in ("done", "failed"):
+                    ok = status == "done"
+                    ingest = time.perf_counter() - start
+                    break
+                await asyncio.sleep(0.5)
+            else:
+                ok = False
+    except httpx.HTTPError:
+        ok, uploaded, ingest = False, time.perf_counter() - start, None
+    rec.add("upload", ok, uploaded, extra=ingest)
+
+#-------------------------------------------------------------------------------------------
+
+async def run(args):
+    mix = dict((k, float(v)) for k, v in (part.split("=") for part in args.mix.split(",")))
+    pdf_dir = tempfile.mkdtemp()
+    scenarios = {
+        "chat": chat,
+        "knowledge": knowledge,
+        "upload": lambda c, r, s: upload(c, r, s, pdf_dir, args.pdf_pages, args.ingest_timeout),
+    }
+    names = [n for n in mix if mix[n] > 0]
+    weights = [mix[n] for n in names]
+    rec = Recorder()
+    deadline = time.perf_counter() + args.duration
+
+    async def user(index):
+        state = {}
+        await asyncio.sleep(index * args.ramp / max(1, args.users))
+        while time.perf_counter() < deadline:
+            await scenarios[random.choices(names, weights)[0]](client, rec, state)
+            if args.think:
+                await asyncio.sleep(random.expovariate(1 / args.think))
+
+    limits = httpx.Limits(max_connections=args.users * 2, max_keepalive_connections=args.users)
+    timeout = httpx.Timeout(args.timeout)
+    async with httpx.AsyncClient(base_url=args.base_url, limits=limits, timeout=timeout) as client:
+        start = time.perf_counter()
+        await asyncio.gather(*(user(i) for i in range(args.users)))
+        elapsed = time.perf_counter() - start
+
+    print(f"{args.users} users, {elapsed:.0f}s, mix {args.mix}")
+    rec.report(elapsed)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--duration", type=float, default=30)
+    parser.add_argument("--ramp", type=float, default=5, help="seconds over which users start")
+    parser.add_argument("--think", type=float, default=0.5, help="mean pause between a user's requests")
+    parser.add_argument("--mix", default="chat=0.7,knowledge=0.2,upload=0.1")
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--ingest-timeout", type=float, default=120)
+    parser.add_argument("--pdf-pages", type=int, default=5)
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
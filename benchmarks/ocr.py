@@ -0,0 +1,88 @@
+"""
+OCR benchmark: old single-call full-page OCR vs ocr_engine.ocr_image.
+
+Renders synthetic two-column contract "photos" (oversized, slightly rotated, with an
+uneven lighting gradient and noise), OCRs each one both ways and reports wall time,
+the share of expected words recovered, and ocr_engine's per-stage timings.
+Needs a tesseract binary (TESSERACT_CMD or PATH); tesserocr is used when installed.
+
+Run from the repo root:
+    python -m benchmarks.ocr --images 10 --width 4000
+"""
+import argparse
+import random
+import time
+
+import cv2
+import numpy as np
+import pytesseract
+
+import ocr_engine
+
+
+def make_photo(width, seed):
+    rng = random.Random(seed)
+    height = int(width * 1.41)
+    page = np.full((height, width), 255, np.uint8)
+    words = []
+    scale = width / 1600
+    for column in range(2):
+        x = int(width * (0.06 + 0.48 * column))
+        y = int(120 * scale)
+        while y < height - 120 * scale:
+            line = f"Clause {rng.randint(1, 99)} registry {rng.randint(1000, 9999)} area {rng.randint(60, 300)} m2"
+            words.extend(line.split())
+            cv2.putText(page, line, (x, y), cv2.FONT_HERSHEY_SIMPLEX, 0.75 * scale, 0, max(1, int(2 * scale)))
+            y += int(48 * scale)
+
+    matrix = cv2.getRotationMatrix2D((width / 2, height / 2), rng.uniform(-4, 4), 1.0)
+    page = cv2.warpAffine(page, matrix, (width, height), borderValue=255)
+    gradient = np.linspace(0.65, 1.0, width, dtype=np.float32)[None, :]
+    noise = np.random.default_rng(seed).normal(0, 12, page.shape)
+    photo = np.clip(page * gradient + noise, 0, 255).astype(np.uint8)
+    return cv2.cvtColor(photo, cv2.COLOR_GRAY2BGR), words
+
+
+def recall(text, words):
+    found = set(text.split())
+    return sum(w in found for w in words) / max(1, len(words))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--images", type=int, default=10)
+    parser.add_argument("--width", type=int, default=4000)
+    args = parser.parse_args()
+
+    photos = [make_photo(args.width, seed) for seed in range(args.images)]
+    backend = "tesserocr" if ocr_engine.tesserocr is not None else "pytesseract"
+    print(f"{args.images} images {args.width}px wide, backend={backend}, block workers={ocr_engine.OCR_BLOCK_WORKERS}")
+
+    start = time.perf_counter()
+    old_recall = 0.0
+    for img, words in photos:
+        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        old_recall += recall(pytesseract.image_to_string(gray, lang=ocr_engine.OCR_LANG), words)
+    old_time = time.perf_counter() - start
+
+    stages = {}
+    start = time.perf_counter()
+    new_recall = 0.0
+    for img, words in photos:
+        timings = {}
+        new_recall += recall(ocr_engine.ocr_image(img, timings), words)
+        for stage, value in timings.items():
+            stages[stage] = stages.get(stage, 0) + value
+    new_time = time.perf_counter() - start
+
+    n = len(photos)
+    print(f"{'mode':<10}{'s/image':>10}{'recall':>10}")
+    print(f"{'old':<10}{old_time / n:>10.2f}{old_recall / n:>10.1%}")
+    print(f"{'pipeline':<10}{new_time / n:>10.2f}{new_recall / n:>10.1%}")
+    print("pipeline stages per image: " + ", ".join(
+        f"{k}={v / n * 1000:.0f}ms" if k != "blocks" else f"blocks={v / n:.1f}" for k, v in stages.items()
+    ))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""
+PDF extraction benchmark: serial in-memory extractor vs pdf_extractor.iter_pdf_pages.
+
+Writes a synthetic text-layer PDF (no external PDF library needed), then runs each
+mode in a fresh subprocess so peak RSS is measured per mode. Reports total time,
+time to first page and peak RSS (parent process; for the streaming mode the page
+workers' peak is reported separately).
+
+Run from the repo root:
+    python -m benchmarks.pdf_extraction --pages 200 --lines 45
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+
+def write_pdf(path, pages, lines, nonce=7):
+    """Minimal PDF 1.4 writer: Helvetica text, one content stream per page. nonce varies the text."""
+    objects = []
+
+    def add(body):
+        objects.append(body)
+        return len(objects)
+
+    font = add(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+    pages_id = len(objects) + 1 + 2 * pages   # allocated after the page objects
+    page_ids = []
+    for p in range(pages):
+        rows = [f"Contract {p + 1} clause {i + 1}: registry number {p * 100 + i}/{nonce}, area {60 + i} m2, "
+                f"price {(p + 1) * (i + 3) * 1000} SYP." for i in range(lines)]
+        text = "BT /F1 9 Tf 40 800 Td 12 TL " + " ".join(f"({r}) '" for r in rows) + " ET"
+        stream = add(b"<< /Length %d >>\nstream\n" % len(text) + text.encode("latin-1") + b"\nendstream")
+        page_ids.append(add(
+            b"<< /Type /Page /Parent %d 0 R /MediaBox [0 0 595 842] "
+            b"/Resources << /Font << /F1 %d 0 R >> >> /Contents %d 0 R >>" % (pages_id, font, stream)
+        ))
+    kids = b" ".join(b"%d 0 R" % i for i in page_ids)
+    assert add(b"<< /Type /Pages /Kids [%s] /Count %d >>" % (kids, pages)) == pages_id
+    catalog = add(b"<< /Type /Catalog /Pages %d 0 R >>" % pages_id)
+
+    with open(path, "wb") as f:
+        f.write(b"%PDF-1.4\n")
+        offsets = []
+        for i, body in enumerate(objects, start=1):
+            offsets.append(f.tell())
+            f.write(b"%d 0 obj\n" % i + body + b"\nendobj\n")
+        xref = f.tell()
+        f.write(b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1))
+        for off in offsets:
+            f.write(b"%010d 00000 n \n" % off)
+        f.write(b"trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, catalog, xref))
+
+
+def run_mode(mode, path):
+    start = time.perf_counter()
+    first = None
+    chars = 0
+    if mode == "serial":
+        import extractors
+        with open(path, "rb") as f:
+            text = extractors.extract_text_from_pdf(f.read())
+        first = time.perf_counter() - start
+        chars = len(text)
+    else:
+        import pdf_extractor
+        for _, text in pdf_extractor.iter_pdf_pages(path, ocr=False):
+            if first is None:
+                first = time.perf_counter() - start
+            chars += len(text)
+    total = time.perf_counter() - start
+    print(json.dumps({
+        "mode": mode, "total_s": round(total, 2), "first_page_s": round(first or total, 2), "chars": chars,
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "workers_peak_rss_mb": round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024, 1),
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pages", type=int, default=200)
+    parser.add_argument("--lines", type=int, default=45)
+    parser.add_argument("--mode", choices=["serial", "streaming"])
+    parser.add_argument("--path")
+    args = parser.parse_args()
+
+    if args.mode:
+        run_mode(args.mode, args.path)
+        return
+
+    path = os.path.join(tempfile.mkdtemp(), "synthetic.pdf")
+    write_pdf(path, args.pages, args.lines)
+    print(f"synthetic PDF: {args.pages} pages, {os.path.getsize(path) / 1e6:.1f} MB")
+    for mode in ("serial", "streaming"):
+        out = subprocess.run(
+            [sys.executable, "-m", "benchmarks.pdf_extraction", "--mode", mode, "--path", path],
+            capture_output=True, text=True, check=True,
+        )
+        print(out.stdout.strip())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+Offline retrieval evaluation for vector_service.query_vector_db.
+
+Reads a JSONL file of labelled queries and reports recall@k and per-query latency
+for the dense, lexical and hybrid modes against the local chroma store:
+
+    {"query": "ما رقم السجل العقاري 1234/5", "expected": ["1234/5"]}
+    {"query": "المادة 12 من قانون الإيجار", "expected": ["المادة 12"], "conversation_id": 7}
+
+A query counts as recalled when any of the top-k chunks contains any expected string
+(compared after Arabic normalization). Queries with conversation_id search the docs
+collection filtered to that conversation, the rest search site knowledge.
+
+Run from the repo root:
+    python -m benchmarks.retrieval_eval queries.jsonl --k 3 5 10
+"""
+import argparse
+import json
+import statistics
+import time
+
+import vector_service
+from text_normalize import normalize_arabic
+
+MODES = ("dense", "lexical", "hybrid")
+
+
+def load_queries(path):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def evaluate(queries, mode, ks):
+    hits = {k: 0 for k in ks}
+    latencies = []
+    top_k = max(ks)
+
+    for item in queries:
+        conv_id = item.get("conversation_id")
+        collection_type = "docs" if conv_id else "site"
+        where = {"conversation_id": conv_id} if conv_id else None
+        expected = [normalize_arabic(e) for e in item["expected"]]
+
+        start = time.perf_counter()
+        results = vector_service.query_vector_db(item["query"], where, collection_type, top_k, mode=mode)
+        latencies.append((time.perf_counter() - start) * 1000)
+
+        texts = [normalize_arabic(r["text"]) for r in results]
+        for k in ks:
+            if any(e in t for t in texts[:k] for e in expected):
+                hits[k] += 1
+
+    latencies.sort()
+    return {
+        "recall": {k: hits[k] / len(queries) for k in ks},
+        "p50_ms": statistics.median(latencies),
+        "p95_ms": latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("queries")
+    parser.add_argument("--k", type=int, nargs="+", default=[3, 5, 10])
+    parser.add_argument("--modes", nargs="+", default=list(MODES), choices=MODES)
+    args = parser.parse_args()
+
+    queries = load_queries(args.queries)
+    # build the lexical indexes and warm the embedding cache outside the timed runs
+    for collection_type in ("site", "docs"):
+        vector_service._lexical_index(collection_type)
+    evaluate(queries, "dense", [1])
+
+    for mode in args.modes:
+        r = evaluate(queries, mode, args.k)
+        recall = " ".join(f"recall@{k}={v:.3f}" for k, v in r["recall"].items())
+        print(f"{mode:8} n={len(queries)} {recall} p50={r['p50_ms']:.1f}ms p95={r['p95_ms']:.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""
+Worker cold-start benchmark: import time and peak RSS of `main`, in a fresh interpreter
+per case.
+
+"lazy" imports main only (what a chat worker now pays before serving); each warm-up case
+then loads one group of heavy dependencies the way first use would, and "eager" loads all
+of them, which is roughly what every worker paid when they were imported at module level.
+Schema creation is not part of any case (it moved to the lifespan / `python -m migrations`).
+
+Run from the repo root:
+    python -m benchmarks.startup --repeat 3
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+CASES = {
+    "lazy": [],
+    "+chroma": ["chroma"],
+    "+openai": ["openai"],
+    "+tokenizer": ["tokenizer"],
+    "+extractors": ["extractors"],
+    "eager": ["chroma", "openai", "tokenizer", "extractors"],
+}
+
+_PROBE = """
+import json, resource, sys, time
+start = time.perf_counter()
+import main
+imported = time.perf_counter() - start
+main.warm_up(json.loads(sys.argv[1]))
+total = time.perf_counter() - start
+print(json.dumps({"import_s": imported, "total_s": total,
+                  "rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}))
+"""
+
+
+def run_case(parts, env):
+    out = subprocess.run(
+        [sys.executable, "-c", _PROBE, json.dumps(parts)],
+        capture_output=True, text=True, check=True, env=env,
+    )
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    env = {**os.environ,
+           "DATABASE_URL": os.environ.get("DATABASE_URL", f"sqlite:///{os.path.join(tmp, 'bench.db')}"),
+           "OPENAI_API_KEY": os.environ.get("OPENAI_API_KEY", "bench")}
+
+    print(f"{'case':<14}{'import s':>10}{'ready s':>10}{'peak RSS MB':>14}")
+    for name, parts in CASES.items():
+        runs = [run_case(parts, env) for _ in range(args.repeat)]
+        best = min(runs, key=lambda r: r["total_s"])
+        print(f"{name:<14}{best['import_s']:>10.2f}{best['total_s']:>10.2f}{best['rss_mb']:>14.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+import math
+import threading
+from collections import Counter
+
+from text_normalize import search_terms
+
+_ARTICLE_PREFIXES = ("وال", "بال", "كال", "فال", "لل", "ال")
+
+
+def tokenize(text: str):
+    # normalized words with the Arabic definite article dropped, so "الشقة" matches "شقة"
+    terms = []
+    for t in search_terms(text):
+        for prefix in _ARTICLE_PREFIXES:
+            if t.startswith(prefix) and len(t) - len(prefix) >= 2:
+                t = t[len(prefix):]
+                break
+        terms.append(t)
+    return terms
+
+
+def matches(metadata: dict, where: dict):
+    """Evaluates the subset of chroma where-filters this codebase uses: equality, $in, $and."""
+    if not where:
+        return True
+    for key, cond in where.items():
+        if key == "$and":
+            if not all(matches(metadata, c) for c in cond):
+                return False
+        elif isinstance(cond, dict):
+            if "$in" in cond and metadata.get(key) not in cond["$in"]:
+                return False
+            if "$eq" in cond and metadata.get(key) != cond["$eq"]:
+                return False
+        elif metadata.get(key) != cond:
+            return False
+    return True
+
+#-------------------------------------------------------------------------------------------
+
+class BM25Index:
+    """In-process inverted index over chunk texts, keyed by the same ids as the chroma collection."""
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self._docs = {}       # id -> (term counts, length, text, metadata)
+        self._postings = {}   # term -> {id: tf}
+        self._total_len = 0
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._docs)
+
+    def add(self, ids, documents, metadatas):
+        with self._lock:
+            for doc_id, text, meta in zip(ids, documents, metadatas):
+                if doc_id in self._docs:
+                    self._remove_one(doc_id)
+                counts = Counter(tokenize(text))
+                length = sum(counts.values())
+                self._docs[doc_id] = (counts, length, text, meta or {})
+                self._total_len += length
+                for term, tf in counts.items():
+                    self._postings.setdefault(term, {})[doc_id] = tf
+
+    def remove(self, ids):
+        with self._lock:
+            for doc_id in ids:
+                if doc_id in self._docs:
+                    self._remove_one(doc_id)
+
+    def remove_where(self, where: dict):
+        with self._lock:
+            self.remove([i for i, d in self._docs.items() if matches(d[3], where)])
+
+    def clear(self):
+        with self._lock:
+            self._docs.clear()
+            self._postings.clear()
+            self._total_len = 0
+
+    def get(self, doc_id):
+        doc = self._docs.get(doc_id)
+        return (doc[2], doc[3]) if doc else (None, None)
+
+    def search(self, query: str, n_results: int, where: dict = None):
+        with self._lock:
+            n = len(self._docs)
+            if not n:
+                return []
+            avg_len = self._total_len / n
+            scores = {}
+            for term in set(tokenize(query)):
+                posting = self._postings.get(term)
+                if not posting:
+                    continue
+                idf = math.log(1 + (n - len(posting) + 0.5) / (len(posting) + 0.5))
+                for doc_id, tf in posting.items():
+                    if where and not matches(self._docs[doc_id][3], where):
+                        continue
+                    length = self._docs[doc_id][1]
+                    norm = tf * (self.k1 + 1) / (tf + self.k1 * (1 - self.b + self.b * length / avg_len))
+                    scores[doc_id] = scores.get(doc_id, 0.0) + idf * norm
+            return sorted(scores.items(), key=lambda x: -x[1])[:n_results]
+
+    def _remove_one(self, doc_id):
+        counts, length, _, _ = self._docs.pop(doc_id)
+        self._total_len -= length
+        for term in counts:
+            posting = self._postings.get(term)
+            if posting is not None:
+                posting.pop(doc_id, None)
+                if not posting:
+                    del self._postings[term]
+
+
+def reciprocal_rank_fusion(rankings, weights, k: int = 60):
+    """rankings: lists of ids best-first; returns ids ordered by sum(weight / (k + rank))."""
+    fused = {}
+    for ranking, weight in zip(rankings, weights):
+        for rank, doc_id in enumerate(ranking, start=1):
+            fused[doc_id] = fused.get(doc_id, 0.0) + weight / (k + rank)
+    return sorted(fused, key=lambda d: -fused[d])
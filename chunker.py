@@ -0,0 +1,95 @@
+import os
+import re
+
+from embedding_cache import text_key
+from prompt_builder import count_tokens
+
+CHUNK_TARGET_TOKENS = int(os.getenv("CHUNK_TARGET_TOKENS", "300"))
+CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", "50"))
+
+_PARAGRAPH_RE = re.compile(r"\n\s*\n")
+# contract clauses / articles start a new unit: "البند الثالث", "المادة 5", "أولاً:", "3-", "Article 2"
+_CLAUSE_RE = re.compile(
+    r"^\s*(?:البند|بند|المادة|مادة|الفقرة|فقرة|أولاً|ثانياً|ثالثاً|رابعاً|خامساً|سادساً|سابعاً|ثامناً|تاسعاً|عاشراً"
+    r"|Article|Clause|Section|[0-9٠-٩]+\s*[\.\-\)]|[\-•\*]\s)",
+    re.IGNORECASE | re.MULTILINE,
+)
+_SENTENCE_RE = re.compile(r"(?<=[\.\!\?؟؛;:])\s+|\n+")
+
+
+def _split_long(sentence: str, target: int):
+    words = sentence.split()
+    piece, pieces = [], []
+    for w in words:
+        piece.append(w)
+        if count_tokens(" ".join(piece)) >= target:
+            pieces.append(" ".join(piece))
+            piece = []
+    if piece:
+        pieces.append(" ".join(piece))
+    return pieces
+
+
+def _units(text: str, target: int):
+    """Yields (sentence, starts_clause) in document order."""
+    for paragraph in _PARAGRAPH_RE.split(text):
+        if not paragraph.strip():
+            continue
+        starts = [m.start() for m in _CLAUSE_RE.finditer(paragraph)]
+        bounds = sorted(set([0] + starts)) + [len(paragraph)]
+        for i in range(len(bounds) - 1):
+            block = paragraph[bounds[i]:bounds[i + 1]]
+            first = True
+            for sentence in _SENTENCE_RE.split(block):
+                sentence = sentence.strip()
+                if not sentence:
+                    continue
+                for piece in (_split_long(sentence, target) if count_tokens(sentence) > target else [sentence]):
+                    # every paragraph and clause opens a boundary the packer prefers to cut at
+                    yield piece, first
+                    first = False
+
+
+def chunk_text(text: str, target_tokens: int = CHUNK_TARGET_TOKENS, overlap_tokens: int = CHUNK_OVERLAP_TOKENS):
+    """
+    Packs sentences into chunks of about target_tokens, cutting preferably at paragraph
+    and clause boundaries. Each chunk repeats up to overlap_tokens of trailing sentences
+    from the previous one. Identical chunks (after normalization) are returned once.
+    """
+    chunks, current, current_tokens = [], [], 0
+
+    def flush():
+        if current:
+            chunks.append(" ".join(s for s, _ in current))
+
+    for sentence, boundary in _units(text or "", target_tokens):
+        tokens = count_tokens(sentence)
+        over = current_tokens + tokens > target_tokens
+        # a new clause starts a new chunk once the current one is reasonably full
+        early_cut = boundary and current_tokens >= target_tokens // 2
+        if current and (over or early_cut):
+            flush()
+            tail, tail_tokens = [], 0
+            if not early_cut:
+                for s, t in reversed(current):
+                    if tail_tokens + t > overlap_tokens:
+                        break
+                    tail.insert(0, (s, t))
+                    tail_tokens += t
+            current, current_tokens = tail, tail_tokens
+        current.append((sentence, tokens))
+        current_tokens += tokens
+    flush()
+
+    seen, unique = set(), []
+    for chunk in chunks:
+        key = text_key(chunk)
+        if key not in seen:
+            seen.add(key)
+            unique.append(chunk)
+    return unique
+
+
+def slice_text(text: str, size: int = 500):
+    # the original fixed-width slicer, kept for benchmarks
+    return [text[i:i+size] for i in range(0, len(text), size)]
@@ -1,65 +1,74 @@
-from sqlalchemy.orm import Session
-from sqlalchemy.orm import Session
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
 from models import (
     Conversation,
     Message,
     UnansweredQuestion
 )
 
-import services
 
-
-def save_message(db: Session, conv_id: int, role: str, text: str):
+async def save_message(db: AsyncSession, conv_id: int, role: str, text: str):
     msg = Message(conversation_id=conv_id, role=role, text=text)
     db.add(msg)
-    db.commit()
-    db.refresh(msg) 
+    # the INSERT returns the generated id; defaults are set client-side, so no refresh() SELECT
+    await db.commit()
     return msg
 
-def get_chat_history(db: Session, conv_id: int, limit: int = 10):
-    return db.query(Message).filter(Message.conversation_id == conv_id)\
-             .order_by(Message.id.desc()).limit(limit).all()
+async def get_chat_history(db: AsyncSession, conv_id: int, limit: int = 10, after_id: int = 0):
+    """Newest first; after_id skips the messages already folded into the conversation summary."""
+    result = await db.execute(
+        select(Message).where(Message.conversation_id == conv_id, Message.id > (after_id or 0))
+                       .order_by(Message.id.desc()).limit(limit)
+    )
+    return result.scalars().all()
 
-def add_unanswered(db: Session, question: str):
+async def add_unanswered(db: AsyncSession, question: str):
     new_q = UnansweredQuestion(question=question)
     db.add(new_q)
-    db.commit()
+    await db.commit()
+
+async def get_conversation(db: AsyncSession, conv_id: int):
+    return await db.get(Conversation, conv_id)
 
-def get_or_create_conversation(db: Session, q_text: str, conv_id: int = None):
+async def get_or_create_conversation(db: AsyncSession, q_text: str, conv_id: int = None):
     if conv_id:
-        conv = db.query(Conversation).filter(Conversation.id == conv_id).first()
+        conv = await get_conversation(db, conv_id)
         if conv: return conv
-    
-    smart_title = services.generate_chat_title(q_text)
-    
-    new_conv = Conversation(title=smart_title)
+
+    # provisional title; services.get_ai_answer replaces it once the answer is streaming
+    new_conv = Conversation(title=q_text[:30])
     db.add(new_conv)
-    db.commit()
-    db.refresh(new_conv)
+    await db.commit()
     return new_conv
 
-def update_message_text(db: Session, message_id: int, new_text: str):
-    db_message = db.query(Message).filter(Message.id == message_id).first()
+async def update_message_text(db: AsyncSession, message_id: int, new_text: str):
+    db_message = await db.get(Message, message_id)
     if db_message:
         db_message.text = new_text
-        db.commit()
-        db.refresh(db_message)
+        await db.commit()
         return db_message
     return None
 
-def delete_conversation(db: Session, conv_id: int):
-    db_conv = db.query(Conversation).filter(Conversation.id == conv_id).first()
+async def delete_conversation(db: AsyncSession, conv_id: int):
+    db_conv = await get_conversation(db, conv_id)
     if db_conv:
-        db.delete(db_conv)
-        db.commit()
+        await db.delete(db_conv)
+        await db.commit()
         return True
     return False
 
-def rename_conversation(db: Session, conv_id: int, new_title: str):
-    db_conv = db.query(Conversation).filter(Conversation.id == conv_id).first()
+async def reset_summary(db: AsyncSession, conv_id: int, from_message_id: int):
+    """Drops the summary when it covers a message that was edited or removed."""
+    await db.execute(
+        update(Conversation)
+        .where(Conversation.id == conv_id, Conversation.summary_until_id >= from_message_id)
+        .values(summary=None, summary_until_id=0)
+    )
+
+async def rename_conversation(db: AsyncSession, conv_id: int, new_title: str):
+    db_conv = await get_conversation(db, conv_id)
     if db_conv:
         db_conv.title = new_title
-        db.commit()
-        db.refresh(db_conv)
+        await db.commit()
         return db_conv
-    return None
\ No newline at end of file
+    return None
@@ -1,37 +1,118 @@
-from sqlalchemy import create_engine, Column, Integer, Text, String, ForeignKey, DateTime
+from sqlalchemy import create_engine
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker, relationship
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+from sqlalchemy.orm import sessionmaker
 import os
 from dotenv import load_dotenv
-from datetime import datetime
 
 load_dotenv()
 
 DATABASE_URL = os.getenv("DATABASE_URL")
 
-is_local = "localhost" in DATABASE_URL or "127.0.0.1" in DATABASE_URL
+is_sqlite = DATABASE_URL.startswith("sqlite")
+is_local = is_sqlite or "localhost" in DATABASE_URL or "127.0.0.1" in DATABASE_URL
+
+# Pool tuning. pre_ping costs a round trip on every checkout, so it is opt-in; pool_recycle
+# already retires connections before typical server / load-balancer idle timeouts.
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "300"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "0") == "1"
+
+
+def _engine_kwargs(url: str, ssl_arg: dict):
+    kwargs = {"pool_pre_ping": DB_POOL_PRE_PING, "pool_recycle": DB_POOL_RECYCLE}
+    if not url.startswith("sqlite"):
+        # SQLite engines get NullPool / SingletonThreadPool (aiosqlite: NullPool), which take no sizing arguments
+        kwargs.update(pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW, pool_timeout=DB_POOL_TIMEOUT)
+    if not _is_local_url(url):
+        kwargs["connect_args"] = ssl_arg
+    return kwargs
 
-if is_local:
-    engine = create_engine(
-        DATABASE_URL,
-        pool_pre_ping=True,
-        pool_recycle=300,
-    )
-else:
-    engine = create_engine(
-        DATABASE_URL,
-        connect_args={"sslmode": "require"},
-        pool_pre_ping=True,
-        pool_recycle=300,
-    )
+
+def _is_local_url(url: str):
+    return url.startswith("sqlite") or "localhost" in url or "127.0.0.1" in url
+
+
+engine = create_engine(DATABASE_URL, **_engine_kwargs(DATABASE_URL, {"sslmode": "require"}))
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# request-scoped sessions end with the response, so objects need not be reloaded after commit
+# (the INSERT already returns generated keys; no refresh() round trip)
+RequestSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine, expire_on_commit=False)
 Base = declarative_base()
 
 
 def get_db():
-    db = SessionLocal()
+    db = RequestSessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+#-------------------------------------------------------------------------------------------
+# Async engine used by the streaming chat path, so a token stream never pins a threadpool thread.
+# Built on the first async session, so the async driver (aiosqlite / asyncpg, picked from the URL)
+# is only needed by processes that use it (not by migrations, ingestion workers or scripts).
+
+def _to_async_url(url: str):
+    if url.startswith("sqlite:"):
+        return url.replace("sqlite:", "sqlite+aiosqlite:", 1)
+    for prefix in ("postgresql+psycopg2://", "postgresql://", "postgres://"):
+        if url.startswith(prefix):
+            return "postgresql+asyncpg://" + url[len(prefix):]
+    return url
+
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL") or _to_async_url(DATABASE_URL)
+
+_async_sessionmakers = {}
+
+
+def _async_sessionmaker(url: str):
+    if url not in _async_sessionmakers:
+        async_engine = create_async_engine(url, **_engine_kwargs(url, {"ssl": "require"}))
+        # expire_on_commit=False: lazy reloads after commit are not allowed on an AsyncSession
+        _async_sessionmakers[url] = async_sessionmaker(async_engine, class_=AsyncSession, expire_on_commit=False, autoflush=False)
+    return _async_sessionmakers[url]
+
+
+def AsyncSessionLocal():
+    return _async_sessionmaker(ASYNC_DATABASE_URL)()
+
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+#-------------------------------------------------------------------------------------------
+# Optional read replica for read-only endpoints (conversation lists, message history, admin
+# lists). Without READ_DATABASE_URL they use the primary. A replica may lag by a moment, so
+# anything that reads its own writes must stay on get_db / get_async_db.
+
+READ_DATABASE_URL = os.getenv("READ_DATABASE_URL")
+
+if READ_DATABASE_URL:
+    read_engine = create_engine(READ_DATABASE_URL, **_engine_kwargs(READ_DATABASE_URL, {"sslmode": "require"}))
+    ReadSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=read_engine, expire_on_commit=False)
+    ASYNC_READ_DATABASE_URL = os.getenv("ASYNC_READ_DATABASE_URL") or _to_async_url(READ_DATABASE_URL)
+else:
+    ReadSessionLocal = RequestSessionLocal
+    ASYNC_READ_DATABASE_URL = ASYNC_DATABASE_URL
+
+
+def AsyncReadSessionLocal():
+    return _async_sessionmaker(ASYNC_READ_DATABASE_URL)()
+
+
+def get_read_db():
+    db = ReadSessionLocal()
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+
+async def get_async_read_db():
+    async with AsyncReadSessionLocal() as db:
+        yield db
@@ -0,0 +1,181 @@
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+import numpy as np
+
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", os.path.join("cache", "embeddings.sqlite3"))
+EMBEDDING_CACHE_MEMORY_ITEMS = int(os.getenv("EMBEDDING_CACHE_MEMORY_ITEMS", "5000"))
+EMBEDDING_CACHE_MAX_ROWS = int(os.getenv("EMBEDDING_CACHE_MAX_ROWS", "200000"))
+
+# SQLite caps the number of bound parameters per statement
+_SQL_BATCH = 500
+_TRIM_EVERY = 1000
+
+
+def normalize_text(text: str):
+    text = unicodedata.normalize("NFKC", text or "")
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def text_key(text: str):
+    return hashlib.sha256(normalize_text(text).encode("utf-8")).digest()
+
+#-------------------------------------------------------------------------------------------
+
+class CachedEmbeddingFunction:
+    """
+    Wraps a chroma embedding function with a two-tier cache keyed by
+    (model name, sha256 of the normalized text): an in-memory LRU in front of
+    a SQLite table of float32 blobs. Only texts missing from both tiers go to
+    the wrapped function, in a single batched call.
+    """
+
+    def __init__(self, embedding_function, model_name: str,
+                 path: str = EMBEDDING_CACHE_PATH,
+                 memory_items: int = EMBEDDING_CACHE_MEMORY_ITEMS,
+                 max_rows: int = EMBEDDING_CACHE_MAX_ROWS):
+        self.embedding_function = embedding_function
+        self.model_name = model_name
+        self.path = path
+        self.memory_items = memory_items
+        self.max_rows = max_rows
+
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._writes_since_trim = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._connection = None
+
+    @property
+    def _conn(self):
+        # opened on first use (always under self._lock), so importing the module creates no files
+        if self._connection is None:
+            if os.path.dirname(self.path):
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                " model TEXT NOT NULL,"
+                " text_hash BLOB NOT NULL,"
+                " vector BLOB NOT NULL,"
+                " last_used REAL NOT NULL,"
+                " PRIMARY KEY (model, text_hash))"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS ix_embeddings_last_used ON embeddings (last_used)")
+            conn.commit()
+            self._connection = conn
+        return self._connection
+
+    def __call__(self, input):
+        keys = [text_key(t) for t in input]
+        found = {}
+
+        with self._lock:
+            for key in set(keys):
+                vec = self._memory.get(key)
+                if vec is not None:
+                    self._memory.move_to_end(key)
+                    found[key] = vec
+            self.memory_hits += sum(1 for k in keys if k in found)
+
+            on_disk = self._load([k for k in set(keys) if k not in found])
+            found.update(on_disk)
+            self.disk_hits += sum(1 for k in keys if k in on_disk)
+            for key, vec in on_disk.items():
+                self._remember(key, vec)
+
+        # one upstream call for all distinct texts that missed both tiers
+        pending = OrderedDict()
+        for key, text in zip(keys, input):
+            if key not in found and key not in pending:
+                pending[key] = text
+
+        if pending:
+            fresh = self.embedding_function(list(pending.values()))
+            fresh = {k: np.asarray(v, dtype=np.float32) for k, v in zip(pending.keys(), fresh)}
+            found.update(fresh)
+            with self._lock:
+                self.misses += sum(1 for k in keys if k in fresh)
+                self._store(fresh)
+                for key, vec in fresh.items():
+                    self._remember(key, vec)
+
+        return [found[k] for k in keys]
+
+    def stats(self):
+        total = self.memory_hits + self.disk_hits + self.misses
+        with self._lock:
+            disk_rows = self._conn.execute(
+                "SELECT COUNT(*) FROM embeddings WHERE model = ?", (self.model_name,)
+            ).fetchone()[0]
+        return {
+            "model": self.model_name,
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": round((self.memory_hits + self.disk_hits) / total, 4) if total else 0.0,
+            "memory_items": len(self._memory),
+            "disk_rows": disk_rows,
+        }
+
+    #---------------------------------------------------------------------------------------
+
+    def _remember(self, key, vec):
+        self._memory[key] = vec
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_items:
+            self._memory.popitem(last=False)
+
+    def _load(self, keys):
+        found = {}
+        now = time.time()
+        for i in range(0, len(keys), _SQL_BATCH):
+            batch = keys[i:i + _SQL_BATCH]
+            marks = ",".join("?" * len(batch))
+            rows = self._conn.execute(
+                f"SELECT text_hash, vector FROM embeddings WHERE model = ? AND text_hash IN ({marks})",
+                (self.model_name, *batch),
+            ).fetchall()
+            for key, blob in rows:
+                found[bytes(key)] = np.frombuffer(blob, dtype=np.float32)
+            if rows:
+                self._conn.execute(
+                    f"UPDATE embeddings SET last_used = ? WHERE model = ? AND text_hash IN ({marks})",
+                    (now, self.model_name, *batch),
+                )
+        if found:
+            self._conn.commit()
+        return found
+
+    def _store(self, vectors):
+        now = time.time()
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO embeddings (model, text_hash, vector, last_used) VALUES (?, ?, ?, ?)",
+            [(self.model_name, k, v.tobytes(), now) for k, v in vectors.items()],
+        )
+        self._conn.commit()
+
+        self._writes_since_trim += len(vectors)
+        if self._writes_since_trim >= _TRIM_EVERY:
+            self._writes_since_trim = 0
+            self._trim()
+
+    def _trim(self):
+        count = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        if count <= self.max_rows:
+            return
+        self._conn.execute(
+            "DELETE FROM embeddings WHERE rowid IN "
+            "(SELECT rowid FROM embeddings ORDER BY last_used LIMIT ?)",
+            (count - self.max_rows,),
+        )
+        self._conn.commit()
@@ -0,0 +1,85 @@
+from io import BytesIO
+
+import spreadsheet
+
+# Blocking, CPU-bound text extraction. Runs inside the ingestion process pool (see ingestion.py),
+# so nothing here may touch the event loop, the database or the OpenAI clients.
+# The parsing libraries are imported on first use: chat-only workers import this module
+# (for IMAGE_EXTENSIONS) but never pay for openpyxl / OpenCV / pdfplumber / python-docx / pptx.
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+
+def extract_text_from_pdf(file_content: bytes):
+    import pdfplumber
+    try:
+        with pdfplumber.open(BytesIO(file_content)) as pdf:
+            texts = (page.extract_text() for page in pdf.pages)
+            return "\n".join(t for t in texts if t)
+    except Exception as e:
+        print(f"Error PDF: {e}")
+        return ""
+
+#-------------------------------------------------------------------------------------------
+
+def extract_text_general(content: bytes, filename: str):
+    filename = filename.lower()
+    try:
+        if filename.endswith('.pdf'):
+            return extract_text_from_pdf(content)
+        elif filename.endswith('.docx'):
+            import docx
+            doc = docx.Document(BytesIO(content))
+            return "\n".join([p.text for p in doc.paragraphs])
+        elif spreadsheet.is_spreadsheet(filename):
+            # rows are streamed and summarised; ingestion indexes the row groups (spreadsheet.extract)
+            reader = spreadsheet.SpreadsheetReader(BytesIO(content), filename)
+            for _ in reader.chunks():
+                pass
+            return reader.summary()
+        elif filename.endswith('.pptx'):
+            from pptx import Presentation
+            prs = Presentation(BytesIO(content))
+            return "\n".join([shape.text for slide in prs.slides for shape in slide.shapes if hasattr(shape, "text")])
+    except Exception as e:
+        print(f"Extraction Error for {filename}: {e}")
+    return ""
+
+#-------------------------------------------------------------------------------------------
+
+def ocr_image(img):
+    """img: BGR or grayscale numpy array. See ocr_engine for the pipeline and its settings."""
+    import ocr_engine
+    return ocr_engine.ocr_image(img)
+
+def extract_text_from_image(image_bytes: bytes):
+    import numpy as np
+    import cv2
+    try:
+        nparr = np.frombuffer(image_bytes, np.uint8)
+        img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+
+        text = ocr_image(img)
+
+        if not text.strip():
+            return "لم يتم العثور على نص واضح."
+
+        return text
+    except Exception as e:
+        return f"Tesseract Error: {str(e)}"
+
+#-------------------------------------------------------------------------------------------
+
+def extract_file(file_path: str, filename: str):
+    """Process-pool entry point: reads the file and returns its text."""
+    with open(file_path, "rb") as f:
+        content = f.read()
+
+    if filename.lower().endswith(IMAGE_EXTENSIONS):
+        return extract_text_from_image(content)
+    return extract_text_general(content, filename)
+
+
+def warm_up():
+    """Imports every parser up front (optional; see WARMUP in main.py)."""
+    import openpyxl, docx, pdfplumber, pptx, cv2, ocr_engine  # noqa: F401
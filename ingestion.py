@@ -0,0 +1,422 @@
+"""
+Document ingestion: a persistent job queue (the ingestion_jobs table) drained by a dispatcher
+running in each API process, with the CPU-bound extraction in a process pool so OCR and PDF
+parsing never block the event loop. No external broker: the database is the queue, and a
+conditional UPDATE claims a job so several uvicorn workers can share it.
+"""
+import asyncio
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, timedelta
+
+from sqlalchemy import select, update
+
+from database import SessionLocal
+from models import DocumentKnowledge, IngestionJob
+import extractors
+import spreadsheet
+import upload_store
+import vector_service
+import metrics
+from services import DOC_INLINE_MAX_CHARS
+
+_CPUS = os.cpu_count() or 2
+
+INGESTION_WORKERS = int(os.getenv("INGESTION_WORKERS", str(_CPUS)))
+INGESTION_CONCURRENCY = {
+    "ocr": int(os.getenv("INGESTION_OCR_CONCURRENCY", str(max(1, _CPUS // 2)))),
+    "pdf": int(os.getenv("INGESTION_PDF_CONCURRENCY", str(_CPUS))),
+    "sheet": int(os.getenv("INGESTION_SHEET_CONCURRENCY", str(max(1, _CPUS // 2)))),
+    "office": int(os.getenv("INGESTION_OFFICE_CONCURRENCY", str(_CPUS))),
+}
+INGESTION_TIMEOUTS = {
+    "ocr": int(os.getenv("INGESTION_OCR_TIMEOUT", "300")),
+    "pdf": int(os.getenv("INGESTION_PDF_TIMEOUT", "600")),
+    "sheet": int(os.getenv("INGESTION_SHEET_TIMEOUT", "600")),
+    "office": int(os.getenv("INGESTION_OFFICE_TIMEOUT", "120")),
+}
+INGESTION_MAX_ATTEMPTS = int(os.getenv("INGESTION_MAX_ATTEMPTS", "3"))
+INGESTION_POLL_SECONDS = float(os.getenv("INGESTION_POLL_SECONDS", "2"))
+# how often the dispatcher looks for jobs left "running" by a dead process (see _requeue_stale)
+INGESTION_REQUEUE_SECONDS = float(os.getenv("INGESTION_REQUEUE_SECONDS", "60"))
+# row-group batches a spreadsheet reader may run ahead of the indexer
+INGESTION_SHEET_QUEUE_BATCHES = int(os.getenv("INGESTION_SHEET_QUEUE_BATCHES", "4"))
+# streamed PDFs are indexed in parts of about this many characters while later pages are extracted
+PDF_INDEX_FLUSH_CHARS = int(os.getenv("PDF_INDEX_FLUSH_CHARS", "20000"))
+
+
+def job_kind(filename: str):
+    name = filename.lower()
+    if name.endswith(extractors.IMAGE_EXTENSIONS):
+        return "ocr"
+    if name.endswith(".pdf"):
+        return "pdf"
+    if spreadsheet.is_spreadsheet(name):
+        return "sheet"
+    return "office"
+
+
+def enqueue(db, doc: DocumentKnowledge):
+    job = IngestionJob(document_id=doc.id, kind=job_kind(doc.file_name), status="queued")
+    db.add(job)
+    db.commit()
+    dispatcher.notify()
+    return job
+
+
+def job_status(db, document_id: int):
+    return db.scalars(
+        select(IngestionJob).where(IngestionJob.document_id == document_id).order_by(IngestionJob.id.desc())
+    ).first()
+
+#-------------------------------------------------------------------------------------------
+# Queue operations (sync, called through asyncio.to_thread)
+
+def _claim(limit: int):
+    db = SessionLocal()
+    try:
+        now = datetime.utcnow()
+        candidates = db.scalars(
+            select(IngestionJob.id)
+            .where(IngestionJob.status == "queued", IngestionJob.run_after <= now)
+            .order_by(IngestionJob.id)
+            .limit(limit)
+        ).all()
+        claimed = []
+        for job_id in candidates:
+            result = db.execute(
+                update(IngestionJob)
+                .where(IngestionJob.id == job_id, IngestionJob.status == "queued")
+                .values(status="running", started_at=now, attempts=IngestionJob.attempts + 1)
+            )
+            if result.rowcount:
+                claimed.append(job_id)
+        db.commit()
+        jobs = []
+        for job_id in claimed:
+            job = db.get(IngestionJob, job_id)
+            doc = db.get(DocumentKnowledge, job.document_id)
+            jobs.append({
+                "id": job.id, "kind": job.kind, "attempts": job.attempts, "created_at": job.created_at,
+                "document_id": job.document_id,
+                "file_path": doc.file_path if doc else None,
+                "file_hash": doc.file_hash if doc else None,
+                "file_name": doc.file_name if doc else None,
+                "conversation_id": doc.conversation_id if doc else None,
+            })
+        return jobs
+    finally:
+        db.close()
+
+
+def _requeue_stale():
+    # jobs left "running" by a process that died; anything past the longest timeout is abandoned
+    cutoff = datetime.utcnow() - timedelta(seconds=max(INGESTION_TIMEOUTS.values()) * 2)
+    db = SessionLocal()
+    try:
+        db.execute(
+            update(IngestionJob)
+            .where(IngestionJob.status == "running", IngestionJob.started_at < cutoff)
+            .values(status="queued", run_after=datetime.utcnow())
+        )
+        db.commit()
+    finally:
+        db.close()
+
+
+def _current(job: dict):
+    # an attempt may only write while it still owns the job: a timed-out attempt that kept
+    # running must not overwrite the retry (or a failure that was already recorded)
+    return (IngestionJob.id == job["id"], IngestionJob.status == "running",
+            IngestionJob.attempts == job["attempts"])
+
+
+def _complete(job: dict, text: str, index: bool = True):
+    """Returns False (and writes nothing) when this attempt no longer owns the job."""
+    db = SessionLocal()
+    try:
+        result = db.execute(
+            update(IngestionJob).where(*_current(job))
+            .values(status="done", error=None, finished_at=datetime.utcnow())
+        )
+        if not result.rowcount:
+            db.rollback()
+            return False
+        doc = db.get(DocumentKnowledge, job["document_id"])
+        if doc:
+            doc.content = text or ""
+        if job.get("file_hash") and text:
+            # later uploads of the same bytes reuse this text instead of extracting again
+            upload_store.remember_text(db, job["file_hash"], text)
+        db.commit()
+    finally:
+        db.close()
+
+    if index and doc and text and len(text) > DOC_INLINE_MAX_CHARS:
+        try:
+            with metrics.span("index", metrics.ingest_seconds, kind=job["kind"], step="index"):
+                vector_service.index_document(job["document_id"], job["conversation_id"], job["file_name"], text)
+        except Exception as e:
+            # the text is saved; get_ai_answer indexes it lazily on first use
+            print(f"Indexing failed for document {job['document_id']}: {e}")
+    return True
+
+
+class Abandoned(Exception):
+    """The dispatcher gave up on this attempt (timeout); stop before writing anything else."""
+
+
+def _ingest_pdf(job: dict, abandoned=None):
+    """
+    Streams pages from the page-parallel extractor and indexes them in parts as they arrive.
+    abandoned: threading.Event set by the dispatcher on timeout.
+    """
+    import pdf_extractor   # pdfplumber only loads in workers that actually ingest PDFs
+    doc_id, conv_id, name = job["document_id"], job["conversation_id"], job["file_name"]
+    pages, pending = [], []
+    total_chars = pending_chars = 0
+    part = 0
+
+    def flush():
+        nonlocal part, pending, pending_chars
+        if abandoned is not None and abandoned.is_set():
+            raise Abandoned()
+        if part == 0:
+            vector_service.delete_document_vectors(doc_id)
+        with metrics.span("index", metrics.ingest_seconds, kind="pdf", step="index"):
+            vector_service.index_document_part(doc_id, conv_id, name, "\n".join(pending), part)
+        part += 1
+        pending, pending_chars = [], 0
+
+    pages_started = time.perf_counter()
+    for _, text in pdf_extractor.iter_pdf_pages(job["file_path"]):
+        if abandoned is not None and abandoned.is_set():
+            raise Abandoned()
+        if not text:
+            continue
+        pages.append(text)
+        pending.append(text)
+        total_chars += len(text)
+        pending_chars += len(text)
+        # small documents stay inline in the prompt, so only start indexing once past the threshold
+        if total_chars > DOC_INLINE_MAX_CHARS and pending_chars >= PDF_INDEX_FLUSH_CHARS:
+            flush()
+
+    if pending and total_chars > DOC_INLINE_MAX_CHARS:
+        flush()
+    # extraction and the indexing of earlier parts overlap; this is the whole streamed pass
+    metrics.ingest_seconds.observe(time.perf_counter() - pages_started, kind="pdf", step="extract")
+    if _complete(job, "\n".join(pages), index=False) and part:
+        vector_service.mark_document_indexed(doc_id)
+
+def _ingest_spreadsheet(job: dict, pool, manager, abandoned=None):
+    """
+    A pool worker reads the sheet (spreadsheet.read_batches) and streams row groups back through
+    a bounded managed queue; they are indexed one embedding batch at a time as they arrive.
+    The column summary comes last and becomes the document text.
+    """
+    doc_id, conv_id, name = job["document_id"], job["conversation_id"], job["file_name"]
+    rows, stop = manager.Queue(INGESTION_SHEET_QUEUE_BATCHES), manager.Event()
+    future = pool.submit(spreadsheet.read_batches, job["file_path"], name, vector_service.EMBED_BATCH_SIZE, rows, stop)
+    indexed = 0
+    started = time.perf_counter()
+    try:
+        while True:
+            if abandoned is not None and abandoned.is_set():
+                raise Abandoned()
+            try:
+                kind, payload = rows.get(timeout=1)
+            except queue.Empty:
+                if future.done():
+                    future.result()   # the worker's error (or BrokenProcessPool)
+                    raise RuntimeError("spreadsheet reader stopped without a summary")
+                continue
+            if kind == "summary":
+                break
+            with metrics.span("index", metrics.ingest_seconds, kind="sheet", step="index"):
+                vector_service.index_document_rows(doc_id, conv_id, name, payload, start=indexed)
+            indexed += len(payload)
+    finally:
+        # lets the worker return if we stopped early
+        stop.set()
+    # reading and the indexing of earlier batches overlap; this is the whole streamed pass
+    metrics.ingest_seconds.observe(time.perf_counter() - started, kind="sheet", step="extract")
+    if _complete(job, payload, index=False) and indexed:
+        vector_service.mark_document_indexed(doc_id)
+
+
+def _fail(job: dict, error: str, count_attempt: bool = True):
+    """count_attempt=False requeues right away without using up an attempt (worker recycled under it)."""
+    db = SessionLocal()
+    try:
+        if not count_attempt:
+            values = {"status": "queued", "error": error, "run_after": datetime.utcnow(),
+                      "attempts": IngestionJob.attempts - 1}
+        elif job["attempts"] < INGESTION_MAX_ATTEMPTS:
+            values = {"status": "queued", "error": error,
+                      "run_after": datetime.utcnow() + timedelta(seconds=5 * 2 ** job["attempts"])}
+        else:
+            values = {"status": "failed", "error": error, "finished_at": datetime.utcnow()}
+        result = db.execute(update(IngestionJob).where(*_current(job)).values(**values))
+        if result.rowcount and values["status"] == "failed":
+            doc = db.get(DocumentKnowledge, job["document_id"])
+            if doc and doc.content == "PROCESSING":
+                doc.content = ""
+        db.commit()
+    finally:
+        db.close()
+
+
+def _new_pool():
+    # spawn, not fork: the API process already runs threads (uvicorn, index rebuilds) and holds
+    # SQLite / chroma handles that a forked child would inherit mid-use
+    return ProcessPoolExecutor(max_workers=INGESTION_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+
+
+def _terminate_pool(pool):
+    """Kills the worker processes, so a timed-out extraction really stops."""
+    if pool is None:
+        return
+    # ProcessPoolExecutor has no public way to stop a running task before Python 3.14
+    terminate = getattr(pool, "terminate_workers", None)
+    if terminate is not None:
+        terminate()
+        return
+    for process in list((getattr(pool, "_processes", None) or {}).values()):
+        process.terminate()
+    pool.shutdown(wait=False, cancel_futures=True)
+
+#-------------------------------------------------------------------------------------------
+
+class IngestionDispatcher:
+
+    def __init__(self):
+        self._pool = None
+        self._task = None
+        self._wakeup = None
+        self._limits = {kind: asyncio.Semaphore(n) for kind, n in INGESTION_CONCURRENCY.items()}
+        self._running = set()
+        self._recycles = 0   # bumped whenever worker processes are killed on purpose
+        self._manager = None  # queues between spreadsheet readers in the pool and their indexers
+        self._manager_lock = threading.Lock()
+
+    def _sheet_manager(self):
+        with self._manager_lock:
+            if self._manager is None:
+                self._manager = multiprocessing.get_context("spawn").Manager()
+            return self._manager
+
+    def _recycle_pool(self):
+        # other jobs running in the old pool see BrokenProcessPool and are requeued for free
+        old, self._pool = self._pool, _new_pool()
+        self._recycles += 1
+        _terminate_pool(old)
+
+    async def start(self):
+        self._pool = _new_pool()
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+        for task in list(self._running):
+            task.cancel()
+        if self._pool:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+        if self._manager:
+            self._manager.shutdown()
+
+    def notify(self):
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _loop(self):
+        capacity = sum(INGESTION_CONCURRENCY.values())
+        requeued_at = 0.0
+        while True:
+            try:
+                if time.monotonic() - requeued_at >= INGESTION_REQUEUE_SECONDS:
+                    # at start and then periodically: a worker that crashed leaves its job "running"
+                    requeued_at = time.monotonic()
+                    await asyncio.to_thread(_requeue_stale)
+                free = capacity - len(self._running)
+                jobs = await asyncio.to_thread(_claim, free) if free > 0 else []
+                for job in jobs:
+                    task = asyncio.create_task(self._process(job))
+                    self._running.add(task)
+                    task.add_done_callback(self._running.discard)
+                if not jobs:
+                    self._wakeup.clear()
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), INGESTION_POLL_SECONDS)
+                    except asyncio.TimeoutError:
+                        pass
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Ingestion dispatcher error: {e}")
+                await asyncio.sleep(INGESTION_POLL_SECONDS)
+
+    async def _process(self, job: dict):
+        if not job["file_path"]:
+            await asyncio.to_thread(_fail, {**job, "attempts": INGESTION_MAX_ATTEMPTS}, "document deleted")
+            return
+
+        loop = asyncio.get_running_loop()
+        async with self._limits[job["kind"]]:
+            recycles = self._recycles
+            abandoned = threading.Event()
+            try:
+                if job["kind"] == "pdf":
+                    # pdf_extractor runs its own page-parallel pool; this thread only streams and indexes
+                    await asyncio.wait_for(asyncio.to_thread(_ingest_pdf, job, abandoned), INGESTION_TIMEOUTS["pdf"])
+                elif job["kind"] == "sheet":
+                    # parsing runs in the pool; this thread only indexes the row groups it sends back
+                    manager = await asyncio.to_thread(self._sheet_manager)
+                    await asyncio.wait_for(
+                        asyncio.to_thread(_ingest_spreadsheet, job, self._pool, manager, abandoned),
+                        INGESTION_TIMEOUTS["sheet"],
+                    )
+                else:
+                    with metrics.span("extract", metrics.ingest_seconds, kind=job["kind"], step="extract"):
+                        text = await asyncio.wait_for(
+                            loop.run_in_executor(self._pool, extractors.extract_file, job["file_path"], job["file_name"]),
+                            INGESTION_TIMEOUTS[job["kind"]],
+                        )
+                    await asyncio.to_thread(_complete, job, text)
+                metrics.ingest_jobs.inc(kind=job["kind"], result="done")
+                metrics.ingest_seconds.observe(
+                    (datetime.utcnow() - job["created_at"]).total_seconds(), kind=job["kind"], step="queue_to_done"
+                )
+                return
+            except asyncio.TimeoutError:
+                # wait_for only stops waiting; stop the work itself before the job can be retried
+                abandoned.set()
+                if job["kind"] == "pdf":
+                    import pdf_extractor
+                    self._recycles += 1
+                    _terminate_pool(pdf_extractor.detach_pool())
+                else:
+                    self._recycle_pool()
+                await asyncio.to_thread(_fail, job, f"timed out after {INGESTION_TIMEOUTS[job['kind']]}s")
+            except BrokenProcessPool as e:
+                if self._recycles != recycles:
+                    # killed because another job timed out, not because of this document
+                    await asyncio.to_thread(_fail, job, "worker recycled", False)
+                    return
+                if job["kind"] != "pdf":
+                    self._recycle_pool()
+                await asyncio.to_thread(_fail, job, f"worker crashed: {e}")
+            except Exception as e:
+                print(f"Ingestion job {job['id']} failed: {e}")
+                await asyncio.to_thread(_fail, job, str(e))
+            metrics.ingest_jobs.inc(kind=job["kind"], result="error")
+
+
+dispatcher = IngestionDispatcher()
@@ -0,0 +1,166 @@
+import codecs
+import csv
+import json
+import os
+from datetime import datetime
+
+from sqlalchemy import insert, select
+
+from database import SessionLocal
+from models import KnowledgeImportJob, SiteKnowledge, knowledge_columns
+import vector_service
+import answer_cache
+
+IMPORT_DIR = os.path.join("cache", "imports")
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", "500"))
+IMPORT_MAX_ERRORS = 1000
+
+SUPPORTED_FORMATS = (".jsonl", ".csv", ".xlsx")
+
+_SECTION_KEYS = ("section_name", "section", "title", "القسم")
+_CONTENT_KEYS = ("content", "text", "body", "المحتوى")
+
+
+def import_path(job_id: str, ext: str):
+    os.makedirs(IMPORT_DIR, exist_ok=True)
+    return os.path.join(IMPORT_DIR, f"{job_id}{ext}")
+
+#-------------------------------------------------------------------------------------------
+# Parsers: each yields (row_number, dict) one row at a time without loading the whole file
+
+def _iter_jsonl(path):
+    with open(path, "r", encoding="utf-8-sig") as f:
+        for n, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            try:
+                yield n, json.loads(line)
+            except json.JSONDecodeError as e:
+                yield n, {"__error__": f"invalid JSON: {e}"}
+
+
+def _iter_csv(path):
+    with open(path, "rb") as raw:
+        reader = csv.DictReader(codecs.iterdecode(raw, "utf-8-sig"))
+        for n, row in enumerate(reader, start=2):
+            yield n, row
+
+
+def _iter_xlsx(path):
+    from openpyxl import load_workbook
+    wb = load_workbook(path, read_only=True, data_only=True)
+    try:
+        ws = wb.worksheets[0]
+        rows = ws.iter_rows(values_only=True)
+        header = [str(h).strip() if h is not None else "" for h in next(rows, [])]
+        for n, values in enumerate(rows, start=2):
+            if all(v is None for v in values):
+                continue
+            yield n, dict(zip(header, values))
+    finally:
+        wb.close()
+
+
+_PARSERS = {".jsonl": _iter_jsonl, ".csv": _iter_csv, ".xlsx": _iter_xlsx}
+
+
+def _pick(row, keys):
+    for k in keys:
+        v = row.get(k)
+        if v is not None and str(v).strip():
+            return str(v).strip()
+    return None
+
+#-------------------------------------------------------------------------------------------
+
+def run_import(job_id: str, path: str, ext: str):
+    db = SessionLocal()
+    job = db.get(KnowledgeImportJob, job_id)
+    errors = []
+    job.status = "running"
+    db.commit()
+
+    def fail(row_number, message):
+        job.failed += 1
+        if len(errors) < IMPORT_MAX_ERRORS:
+            errors.append({"row": row_number, "error": message})
+
+    def flush(batch):
+        if not batch:
+            return
+        hashes = [r["content_hash"] for r in batch]
+        existing = set(db.scalars(
+            select(SiteKnowledge.content_hash).where(SiteKnowledge.content_hash.in_(hashes))
+        ))
+        fresh = [r for r in batch if r["content_hash"] not in existing]
+        job.skipped += len(batch) - len(fresh)
+
+        if fresh:
+            rows = [{k: v for k, v in r.items() if k != "row"} for r in fresh]
+            inserted = db.execute(
+                insert(SiteKnowledge).returning(SiteKnowledge.id, SiteKnowledge.content_hash),
+                rows,
+            ).all()
+            job.inserted += len(inserted)
+        job.processed += len(batch)
+        job.errors = json.dumps(errors, ensure_ascii=False)
+        db.commit()
+
+        if fresh:
+            ids = {h: i for i, h in inserted}
+            try:
+                vector_service.index_site_knowledge(
+                    (ids[r["content_hash"]], r["section_name"], r["content"], r["content_hash"]) for r in fresh
+                )
+            except Exception as e:
+                # the rows are committed and count as inserted; reconcile embeds them later
+                job.not_indexed += len(fresh)
+                for r in fresh:
+                    if len(errors) < IMPORT_MAX_ERRORS:
+                        errors.append({"row": r["row"], "error": f"inserted, not indexed: {e}"})
+                job.errors = json.dumps(errors, ensure_ascii=False)
+                db.commit()
+
+    try:
+        batch, seen = [], set()
+        for row_number, row in _PARSERS[ext](path):
+            if "__error__" in row:
+                job.processed += 1
+                fail(row_number, row["__error__"])
+                continue
+            section_name, content = _pick(row, _SECTION_KEYS), _pick(row, _CONTENT_KEYS)
+            if not section_name or not content:
+                job.processed += 1
+                fail(row_number, "missing section_name or content")
+                continue
+            section_name = section_name[:255]
+            derived = knowledge_columns(section_name, content)
+            h = derived["content_hash"]
+            if h in seen:
+                job.processed += 1
+                job.skipped += 1
+                continue
+            seen.add(h)
+            batch.append({"row": row_number, "section_name": section_name,
+                          "content": content, **derived})
+            if len(batch) >= IMPORT_BATCH_SIZE:
+                flush(batch)
+                batch = []
+        flush(batch)
+        job.status = "done"
+    except Exception as e:
+        db.rollback()
+        print(f"Knowledge import {job_id} failed: {e}")
+        job.status = "failed"
+        errors.append({"row": None, "error": str(e)})
+    finally:
+        job.errors = json.dumps(errors, ensure_ascii=False)
+        job.finished_at = datetime.utcnow()
+        db.commit()
+        if job.inserted:
+            answer_cache.invalidate_all()
+        db.close()
+        try:
+            os.remove(path)
+        except OSError:
+            pass
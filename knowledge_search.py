@@ -0,0 +1,137 @@
+"""
+Full-text search over SiteKnowledge.search_text (the Arabic-normalized section name + content).
+
+Postgres: GIN index on to_tsvector('simple', search_text), ranked with ts_rank.
+SQLite:   FTS5 external-content table kept in sync by triggers, ranked with bm25.
+Both use prefix matching on every term and keyset pagination on (score, id).
+Other backends fall back to a LIKE match on search_text (every term, unranked: newest first).
+"""
+from sqlalchemy import text
+
+import pagination
+from text_normalize import search_terms
+
+_TSVECTOR = "to_tsvector('simple'::regconfig, coalesce(search_text, ''))"
+
+_POSTGRES_DDL = [
+    f"CREATE INDEX IF NOT EXISTS ix_site_knowledge_search ON site_knowledge USING GIN ({_TSVECTOR})",
+]
+
+_SQLITE_DDL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS site_knowledge_fts USING fts5("
+    " search_text, content='site_knowledge', content_rowid='id', tokenize='unicode61 remove_diacritics 2')",
+    "CREATE TRIGGER IF NOT EXISTS site_knowledge_fts_ai AFTER INSERT ON site_knowledge BEGIN"
+    " INSERT INTO site_knowledge_fts(rowid, search_text) VALUES (new.id, new.search_text); END",
+    "CREATE TRIGGER IF NOT EXISTS site_knowledge_fts_ad AFTER DELETE ON site_knowledge BEGIN"
+    " INSERT INTO site_knowledge_fts(site_knowledge_fts, rowid, search_text) VALUES ('delete', old.id, old.search_text); END",
+    "CREATE TRIGGER IF NOT EXISTS site_knowledge_fts_au AFTER UPDATE ON site_knowledge BEGIN"
+    " INSERT INTO site_knowledge_fts(site_knowledge_fts, rowid, search_text) VALUES ('delete', old.id, old.search_text);"
+    " INSERT INTO site_knowledge_fts(rowid, search_text) VALUES (new.id, new.search_text); END",
+]
+
+
+def install(engine):
+    with engine.begin() as conn:
+        if engine.dialect.name == "postgresql":
+            for ddl in _POSTGRES_DDL:
+                conn.execute(text(ddl))
+        elif engine.dialect.name == "sqlite":
+            existed = conn.execute(
+                text("SELECT 1 FROM sqlite_master WHERE name = 'site_knowledge_fts'")
+            ).first()
+            for ddl in _SQLITE_DDL:
+                conn.execute(text(ddl))
+            if not existed:
+                conn.execute(text("INSERT INTO site_knowledge_fts(site_knowledge_fts) VALUES ('rebuild')"))
+
+
+def encode_cursor(score: float, row_id: int):
+    return f"{score!r}:{row_id}"
+
+
+def decode_cursor(cursor: str):
+    try:
+        score, row_id = cursor.rsplit(":", 1)
+        return float(score), int(row_id)
+    except (ValueError, TypeError):
+        raise pagination.invalid_cursor()
+
+def _like_filter(terms, params):
+    # fallback for backends without a full-text index; "_" is a word character but a LIKE wildcard
+    clauses = []
+    for i, term in enumerate(terms):
+        escaped = term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        params[f"term{i}"] = f"%{escaped}%"
+        clauses.append(f"search_text LIKE :term{i} ESCAPE '\\'")
+    return " AND ".join(clauses)
+
+#-------------------------------------------------------------------------------------------
+
+def search_ids(db, q: str, limit: int, cursor: str = None, offset: int = 0):
+    """Returns [(id, score)] best first, plus next_cursor (None on the last page)."""
+    terms = search_terms(q)
+    if not terms:
+        return [], None
+
+    params = {"limit": limit + 1, "offset": 0 if cursor else offset}
+    after = ""
+    if cursor:
+        params["score"], params["last_id"] = decode_cursor(cursor)
+        after = "AND (score < :score OR (score = :score AND id < :last_id))"
+
+    if db.bind.dialect.name == "postgresql":
+        params["tsq"] = " & ".join(f"{t}:*" for t in terms)
+        sql = f"""
+            SELECT id, score FROM (
+                SELECT id, ts_rank({_TSVECTOR}, to_tsquery('simple'::regconfig, :tsq)) AS score
+                FROM site_knowledge
+                WHERE {_TSVECTOR} @@ to_tsquery('simple'::regconfig, :tsq)
+            ) ranked
+            WHERE 1 = 1 {after}
+            ORDER BY score DESC, id DESC
+            LIMIT :limit OFFSET :offset
+        """
+    elif db.bind.dialect.name == "sqlite":
+        params["match"] = " ".join(f'"{t}"*' for t in terms)
+        # bm25 is lower-is-better; negate so both backends page on score DESC
+        sql = f"""
+            SELECT id, score FROM (
+                SELECT rowid AS id, -bm25(site_knowledge_fts) AS score
+                FROM site_knowledge_fts
+                WHERE site_knowledge_fts MATCH :match
+            ) ranked
+            WHERE 1 = 1 {after}
+            ORDER BY score DESC, id DESC
+            LIMIT :limit OFFSET :offset
+        """
+    else:
+        sql = f"""
+            SELECT id, score FROM (
+                SELECT id, 0.0 AS score FROM site_knowledge WHERE {_like_filter(terms, params)}
+            ) ranked
+            WHERE 1 = 1 {after}
+            ORDER BY score DESC, id DESC
+            LIMIT :limit OFFSET :offset
+        """
+
+    rows = db.execute(text(sql), params).all()
+    next_cursor = encode_cursor(rows[limit - 1].score, rows[limit - 1].id) if len(rows) > limit else None
+    return [(r.id, r.score) for r in rows[:limit]], next_cursor
+
+
+def count_matches(db, q: str):
+    terms = search_terms(q)
+    if not terms:
+        return 0
+    if db.bind.dialect.name == "postgresql":
+        return db.execute(
+            text(f"SELECT count(*) FROM site_knowledge WHERE {_TSVECTOR} @@ to_tsquery('simple'::regconfig, :tsq)"),
+            {"tsq": " & ".join(f"{t}:*" for t in terms)},
+        ).scalar()
+    if db.bind.dialect.name == "sqlite":
+        return db.execute(
+            text("SELECT count(*) FROM site_knowledge_fts WHERE site_knowledge_fts MATCH :match"),
+            {"match": " ".join(f'"{t}"*' for t in terms)},
+        ).scalar()
+    params = {}
+    return db.execute(text(f"SELECT count(*) FROM site_knowledge WHERE {_like_filter(terms, params)}"), params).scalar()
@@ -1,10 +1,47 @@
-from fastapi import FastAPI
+import asyncio
+import os
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Response
 from fastapi.middleware.cors import CORSMiddleware
-import models
 from routers import chat, admin
 from database import engine
+from ingestion import dispatcher
+import metrics
 
-app = FastAPI(title="Real Estate Assistant API v2")
+# Schema changes belong to the deploy step (`python -m migrations`, see README). Set this to 1
+# only for local development; several workers would otherwise all race through create_all on boot.
+MIGRATE_ON_STARTUP = os.getenv("MIGRATE_ON_STARTUP", "0") == "1"
+# Heavy clients load on first use. List the ones to load at startup instead, so the first
+# request does not pay for them: chroma, openai, tokenizer, extractors
+WARMUP = [part.strip() for part in os.getenv("WARMUP", "").split(",") if part.strip()]
+
+
+def warm_up(parts):
+    import services, vector_service, extractors, prompt_builder
+    hooks = {
+        "chroma": vector_service.warm_up,
+        "openai": services.warm_up,
+        "tokenizer": prompt_builder.warm_up,
+        "extractors": extractors.warm_up,
+    }
+    for part in parts:
+        try:
+            hooks[part]()
+        except Exception as e:
+            print(f"Warm-up of {part} failed: {e}")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if MIGRATE_ON_STARTUP:
+        from migrations import run_migrations
+        await asyncio.to_thread(run_migrations, engine)
+    if WARMUP:
+        await asyncio.to_thread(warm_up, WARMUP)
+    await dispatcher.start()
+    yield
+    await dispatcher.stop()
+
+app = FastAPI(title="Real Estate Assistant API v2", lifespan=lifespan)
 
 origins = ["*"]
 
@@ -31,4 +68,9 @@ app.include_router(admin.router)
 def health_check():
     return {"status": "GPT Agent is running"}
 
-models.Base.metadata.create_all(bind=engine)
\ No newline at end of file
+@app.get("/metrics", include_in_schema=False)
+def prometheus_metrics():
+    # per process: with several uvicorn workers each one is scraped (or summed) separately
+    if not metrics.METRICS_ENABLED:
+        return Response(status_code=404)
+    return Response(metrics.render(), media_type="text/plain; version=0.0.4")
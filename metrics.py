@@ -0,0 +1,151 @@
+"""
+Minimal Prometheus-format metrics: labelled counters and histograms, rendered as text
+exposition by GET /metrics (main.py). No client library needed.
+
+With METRICS_ENABLED=0 `span` returns one shared no-op context manager and `observe` /
+`inc` return immediately, so instrumented code pays a function call and a flag check.
+"""
+import bisect
+import os
+import threading
+import time
+from contextlib import nullcontext
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") == "1"
+
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+TOKEN_BUCKETS = (64, 128, 256, 512, 1024, 2048, 4096, 8192, 16384)
+
+_NOOP = nullcontext()
+
+
+def _label_text(labelnames, values, extra=""):
+    parts = [f'{k}="{v}"' for k, v in zip(labelnames, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Counter:
+
+    def __init__(self, name: str, help: str, labelnames=()):
+        self.name, self.help, self.labelnames = name, help, tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        if not METRICS_ENABLED:
+            return
+        key = tuple(str(labels.get(k, "")) for k in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_label_text(self.labelnames, key)} {value}")
+        return lines
+
+
+class Histogram:
+
+    def __init__(self, name: str, help: str, labelnames=(), buckets=SECONDS_BUCKETS):
+        self.name, self.help, self.labelnames = name, help, tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}   # labels -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        if not METRICS_ENABLED:
+            return
+        key = tuple(str(labels.get(k, "")) for k in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 2)
+            if index < len(self.buckets):
+                series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                cumulative = 0
+                labels = _label_text(self.labelnames, key)
+                for bound, n in zip(self.buckets, series):
+                    cumulative += n
+                    le = 'le="%s"' % bound
+                    lines.append(f"{self.name}_bucket{_label_text(self.labelnames, key, le)} {cumulative}")
+                le = 'le="+Inf"'
+                lines.append(f"{self.name}_bucket{_label_text(self.labelnames, key, le)} {series[-1]}")
+                lines.append(f"{self.name}_sum{labels} {series[-2]}")
+                lines.append(f"{self.name}_count{labels} {series[-1]}")
+        return lines
+
+
+class Gauge:
+    """Value read at scrape time from a callback returning {label values tuple: value}."""
+
+    def __init__(self, name: str, help: str, labelnames=(), read=None):
+        self.name, self.help, self.labelnames = name, help, tuple(labelnames)
+        self.read = read
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        if self.read is not None:
+            for key, value in sorted(self.read().items()):
+                lines.append(f"{self.name}{_label_text(self.labelnames, key)} {value}")
+        return lines
+
+
+class _Span:
+    __slots__ = ("histogram", "labels", "start")
+
+    def __init__(self, histogram, labels):
+        self.histogram, self.labels = histogram, labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.histogram.observe(time.perf_counter() - self.start, **self.labels)
+        return False
+
+#-------------------------------------------------------------------------------------------
+
+stage_seconds = Histogram("rag_stage_seconds", "Duration of each answer pipeline stage.", ["stage"])
+ttft_seconds = Histogram("rag_time_to_first_token_seconds", "Request arrival to first streamed token.", ["source"])
+stream_seconds = Histogram("rag_stream_seconds", "First to last token of a model answer.")
+prompt_tokens = Histogram("rag_prompt_tokens", "Prompt size after budgeting.", ["part"], TOKEN_BUCKETS)
+llm_tokens = Counter("llm_tokens_total", "Tokens reported by the model API.", ["kind"])
+answers = Counter("rag_answers_total", "Answers by outcome.", ["outcome"])
+ingest_seconds = Histogram("ingest_stage_seconds", "Duration of document ingestion steps.", ["kind", "step"])
+ingest_jobs = Counter("ingest_jobs_total", "Ingestion jobs by kind and result.", ["kind", "result"])
+upstream_wait_seconds = Histogram("upstream_wait_seconds", "Time a model API call waited for admission.", ["priority"])
+upstream_shed = Counter("upstream_shed_total", "Model API calls rejected because the scheduler was saturated.", ["priority"])
+upstream_rate_limited = Counter("upstream_rate_limited_total", "429 responses from the model API.")
+upstream_queue = Gauge("upstream_queue_depth", "Model API calls waiting for admission.", ["priority"])   # read set by upstream.py
+upstream_in_flight = Gauge("upstream_in_flight", "Model API calls currently admitted.")
+upstream_open_streams = Gauge("upstream_open_streams", "Streamed answers open after admission.")
+
+REGISTRY = [stage_seconds, ttft_seconds, stream_seconds, prompt_tokens, llm_tokens, answers, ingest_seconds, ingest_jobs,
+            upstream_wait_seconds, upstream_shed, upstream_rate_limited, upstream_queue, upstream_in_flight, upstream_open_streams]
+
+
+def span(stage: str, histogram: Histogram = stage_seconds, **labels):
+    """with metrics.span("site_search"): ...  (labels default to stage=<stage>)"""
+    if not METRICS_ENABLED:
+        return _NOOP
+    return _Span(histogram, labels or {"stage": stage})
+
+
+def render():
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,77 @@
+from sqlalchemy import inspect, text, select, update
+
+import models
+from models import SiteKnowledge, knowledge_columns
+import knowledge_search
+
+# create_all only creates missing tables; columns and indexes added to existing
+# tables after the first deploy are listed here and applied idempotently.
+ADDED_COLUMNS = [
+    ("site_knowledge", "content_hash", "VARCHAR(64)"),
+    ("site_knowledge", "search_text", "TEXT"),
+    ("document_knowledge", "file_hash", "VARCHAR(64)"),
+    ("conversations", "summary", "TEXT"),
+    ("conversations", "summary_until_id", "INTEGER DEFAULT 0"),
+    ("knowledge_import_jobs", "not_indexed", "INTEGER DEFAULT 0"),
+]
+
+ADDED_INDEXES = [
+    ("ix_site_knowledge_content_hash", "site_knowledge", "content_hash"),
+    ("ix_document_knowledge_file_hash", "document_knowledge", "file_hash"),
+    ("ix_messages_conversation_id_id", "messages", "conversation_id, id"),
+    ("ix_messages_conversation_id_created_at", "messages", "conversation_id, created_at"),
+    ("ix_document_knowledge_conversation_id_id", "document_knowledge", "conversation_id, id"),
+    ("ix_document_knowledge_conversation_id_created_at", "document_knowledge", "conversation_id, created_at"),
+    ("ix_conversations_updated_at", "conversations", "updated_at"),
+]
+
+_BACKFILL_BATCH = 1000
+
+
+def run_migrations(engine):
+    models.Base.metadata.create_all(bind=engine)
+
+    inspector = inspect(engine)
+    had_updated_at_index = any(i["name"] == "ix_conversations_updated_at" for i in inspector.get_indexes("conversations"))
+    with engine.begin() as conn:
+        for table, column, ddl_type in ADDED_COLUMNS:
+            existing = {c["name"] for c in inspector.get_columns(table)}
+            if column not in existing:
+                conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl_type}"))
+        for name, table, columns in ADDED_INDEXES:
+            conn.execute(text(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({columns})"))
+        if not had_updated_at_index:
+            # updated_at used to stay at creation time; set it once from the last message
+            conn.execute(text(
+                "UPDATE conversations SET updated_at = "
+                "(SELECT MAX(m.created_at) FROM messages m WHERE m.conversation_id = conversations.id) "
+                "WHERE EXISTS (SELECT 1 FROM messages m WHERE m.conversation_id = conversations.id)"
+            ))
+
+    # before the backfill, so the FTS triggers see the backfilled search_text
+    knowledge_search.install(engine)
+    _backfill_knowledge_columns(engine)
+
+
+def _backfill_knowledge_columns(engine):
+    while True:
+        with engine.begin() as conn:
+            rows = conn.execute(
+                select(SiteKnowledge.id, SiteKnowledge.section_name, SiteKnowledge.content)
+                .where(SiteKnowledge.content_hash.is_(None) | SiteKnowledge.search_text.is_(None))
+                .limit(_BACKFILL_BATCH)
+            ).all()
+            if not rows:
+                return
+            for row in rows:
+                conn.execute(
+                    update(SiteKnowledge)
+                    .where(SiteKnowledge.id == row.id)
+                    .values(**knowledge_columns(row.section_name, row.content))
+                )
+
+
+if __name__ == "__main__":
+    from database import engine
+    run_migrations(engine)
+    print("migrations applied")
@@ -1,14 +1,32 @@
-from sqlalchemy import Column, Integer, String, Text, ForeignKey, DateTime
+from sqlalchemy import Column, Integer, String, Text, ForeignKey, DateTime, Index, event, update
 from sqlalchemy.orm import relationship
 from datetime import datetime
+import hashlib
 from database import Base
+from text_normalize import normalize_arabic
+
+
+def knowledge_hash(section_name: str, content: str):
+    return hashlib.sha256(f"{section_name.strip()}\n{content.strip()}".encode("utf-8")).hexdigest()
+
+
+def knowledge_columns(section_name: str, content: str):
+    """Derived SiteKnowledge columns; set them wherever section_name/content are written."""
+    return {
+        "content_hash": knowledge_hash(section_name, content),
+        "search_text": normalize_arabic(f"{section_name}\n{content}"),
+    }
+
 
 class Conversation(Base):
     __tablename__ = "conversations"
     id = Column(Integer, primary_key=True, index=True)
     title = Column(String(255), nullable=True)
     created_at = Column(DateTime, default=datetime.utcnow)
-    updated_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, index=True)   # last message, see _touch_conversation
+    # rolling memory: messages with id <= summary_until_id are folded into summary (services.summarize_conversation)
+    summary = Column(Text, nullable=True)
+    summary_until_id = Column(Integer, default=0)
 
     messages = relationship("Message", back_populates="conversation", cascade="all, delete-orphan")
     documents = relationship("DocumentKnowledge", back_populates="conversation", cascade="all, delete-orphan")
@@ -25,12 +43,29 @@ class Message(Base):
 
     conversation = relationship("Conversation", back_populates="messages")
 
+    __table_args__ = (
+        Index("ix_messages_conversation_id_id", "conversation_id", "id"),
+        Index("ix_messages_conversation_id_created_at", "conversation_id", "created_at"),
+    )
+
+
+@event.listens_for(Message, "after_insert")
+def _touch_conversation(mapper, connection, target):
+    # every code path that adds a message keeps the conversation list order current
+    connection.execute(
+        update(Conversation.__table__)
+        .where(Conversation.__table__.c.id == target.conversation_id)
+        .values(updated_at=datetime.utcnow())
+    )
+
 
 class SiteKnowledge(Base):
     __tablename__ = "site_knowledge"
     id = Column(Integer, primary_key=True, index=True)
     section_name = Column(String(255), nullable=False)
     content = Column(Text, nullable=False)
+    content_hash = Column(String(64), index=True)
+    search_text = Column(Text)   # normalized copy indexed by FTS5 / tsvector, see knowledge_search
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
@@ -47,7 +82,52 @@ class DocumentKnowledge(Base):
     id = Column(Integer, primary_key=True, index=True)
     file_name = Column(String(255))
     file_path = Column(String(500))
+    file_hash = Column(String(64), index=True)   # StoredFile.sha256; NULL for uploads before the store
     content = Column(Text)
     created_at = Column(DateTime, default=datetime.utcnow)
     conversation_id = Column(Integer, ForeignKey("conversations.id"))
     conversation = relationship("Conversation", back_populates="documents")
+
+    __table_args__ = (
+        Index("ix_document_knowledge_conversation_id_id", "conversation_id", "id"),
+        Index("ix_document_knowledge_conversation_id_created_at", "conversation_id", "created_at"),
+    )
+
+
+class KnowledgeImportJob(Base):
+    __tablename__ = "knowledge_import_jobs"
+    id = Column(String(36), primary_key=True)
+    file_name = Column(String(255))
+    status = Column(String(20), default="queued")   # queued | running | done | failed
+    processed = Column(Integer, default=0)
+    inserted = Column(Integer, default=0)
+    skipped = Column(Integer, default=0)
+    failed = Column(Integer, default=0)
+    not_indexed = Column(Integer, default=0)         # inserted, but embedding failed; reconcile indexes them
+    errors = Column(Text, default="[]")              # JSON list of {"row", "error"}
+    created_at = Column(DateTime, default=datetime.utcnow)
+    finished_at = Column(DateTime, nullable=True)
+
+
+class IngestionJob(Base):
+    __tablename__ = "ingestion_jobs"
+    id = Column(Integer, primary_key=True, index=True)
+    document_id = Column(Integer, ForeignKey("document_knowledge.id", ondelete="CASCADE"), index=True)
+    kind = Column(String(20))                        # pdf | ocr | sheet | office, see ingestion.job_kind
+    status = Column(String(20), default="queued", index=True)   # queued | running | done | failed
+    attempts = Column(Integer, default=0)
+    error = Column(Text, nullable=True)
+    run_after = Column(DateTime, default=datetime.utcnow)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+
+
+class StoredFile(Base):
+    __tablename__ = "stored_files"
+    sha256 = Column(String(64), primary_key=True)
+    path = Column(String(500), nullable=False)
+    size = Column(Integer)
+    ref_count = Column(Integer, default=0, nullable=False)
+    extracted_text = Column(Text, nullable=True)   # filled by the first successful ingestion
+    created_at = Column(DateTime, default=datetime.utcnow)
@@ -0,0 +1,178 @@
+"""
+OCR for uploaded images and scanned PDF pages.
+
+Pipeline: grayscale -> downscale oversized photos -> deskew -> binarize -> split the page
+into text blocks -> OCR the blocks in parallel threads -> join them in reading order.
+When tesserocr is installed each thread keeps one TessBaseAPI handle loaded with the
+language models (no process spawn and no model reload per image). Without it, pytesseract
+runs the binary found through TESSERACT_CMD / PATH once per page (automatic page
+segmentation) instead of per block, since every call is a process spawn plus model load.
+"""
+import os
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+OCR_LANG = os.getenv("OCR_LANG", "ara+eng")
+TESSERACT_CMD = os.getenv("TESSERACT_CMD") or shutil.which("tesseract")
+TESSDATA_PREFIX = os.getenv("TESSDATA_PREFIX")
+# phone photos are often 4000px+; Tesseract gains nothing above ~300 dpi A4
+OCR_MAX_SIDE = int(os.getenv("OCR_MAX_SIDE", "3000"))
+OCR_BLOCK_WORKERS = int(os.getenv("OCR_BLOCK_WORKERS", "2"))
+OCR_MIN_BLOCK_AREA = int(os.getenv("OCR_MIN_BLOCK_AREA", "400"))
+OCR_MAX_DESKEW_DEGREES = float(os.getenv("OCR_MAX_DESKEW_DEGREES", "15"))
+OCR_LOG_TIMINGS = os.getenv("OCR_LOG_TIMINGS", "0") == "1"
+
+# Tesseract's own OpenMP threads fight with our block threads and the process pool
+os.environ.setdefault("OMP_THREAD_LIMIT", "1")
+
+try:
+    import tesserocr
+except ImportError:
+    tesserocr = None
+
+import pytesseract
+if TESSERACT_CMD:
+    pytesseract.pytesseract.tesseract_cmd = TESSERACT_CMD
+
+_local = threading.local()
+_executor = None
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=OCR_BLOCK_WORKERS, thread_name_prefix="ocr")
+    return _executor
+
+
+def _api():
+    # TessBaseAPI is not thread-safe: one handle per thread, created once and reused
+    api = getattr(_local, "api", None)
+    if api is None:
+        kwargs = {"lang": OCR_LANG, "psm": tesserocr.PSM.SINGLE_BLOCK}
+        if TESSDATA_PREFIX:
+            kwargs["path"] = TESSDATA_PREFIX
+        api = tesserocr.PyTessBaseAPI(**kwargs)
+        _local.api = api
+    return api
+
+
+def _recognize(block: np.ndarray, psm: int = 6):
+    if tesserocr is not None:
+        api = _api()
+        api.SetPageSegMode(psm)
+        height, width = block.shape
+        api.SetImageBytes(np.ascontiguousarray(block).tobytes(), width, height, 1, width)
+        api.SetSourceResolution(300)
+        return api.GetUTF8Text()
+    return pytesseract.image_to_string(block, lang=OCR_LANG, config=f"--psm {psm}")
+
+#-------------------------------------------------------------------------------------------
+# Preprocessing
+
+def _downscale(gray: np.ndarray):
+    height, width = gray.shape
+    scale = OCR_MAX_SIDE / max(height, width)
+    if scale >= 1:
+        return gray
+    return cv2.resize(gray, (int(width * scale), int(height * scale)), interpolation=cv2.INTER_AREA)
+
+
+def _deskew(gray: np.ndarray):
+    inverted = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV | cv2.THRESH_OTSU)[1]
+    coords = cv2.findNonZero(inverted)
+    if coords is None:
+        return gray
+    angle = cv2.minAreaRect(coords)[-1]
+    # OpenCV >= 4.5 reports (0, 90]; fold it into (-45, 45]
+    if angle > 45:
+        angle -= 90
+    if abs(angle) < 0.3 or abs(angle) > OCR_MAX_DESKEW_DEGREES:
+        return gray
+    height, width = gray.shape
+    matrix = cv2.getRotationMatrix2D((width / 2, height / 2), angle, 1.0)
+    return cv2.warpAffine(gray, matrix, (width, height), flags=cv2.INTER_CUBIC, borderMode=cv2.BORDER_REPLICATE)
+
+
+def _binarize(gray: np.ndarray):
+    # adaptive threshold copes with the uneven lighting of phone photos better than a global one
+    blurred = cv2.medianBlur(gray, 3)
+    return cv2.adaptiveThreshold(blurred, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, 31, 15)
+
+
+def preprocess(img: np.ndarray):
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY) if img.ndim == 3 else img
+    return _binarize(_deskew(_downscale(gray)))
+
+#-------------------------------------------------------------------------------------------
+# Layout
+
+def layout_blocks(binary: np.ndarray):
+    """Bounding boxes (x, y, w, h) of text blocks, top-to-bottom and right-to-left within a row."""
+    height, width = binary.shape
+    inverted = 255 - binary
+    # merge characters into words and words into paragraphs, but keep columns apart
+    kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (max(15, width // 60), max(5, height // 150)))
+    merged = cv2.dilate(inverted, kernel, iterations=2)
+    contours, _ = cv2.findContours(merged, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+
+    boxes = [cv2.boundingRect(c) for c in contours]
+    boxes = [b for b in boxes if b[2] * b[3] >= OCR_MIN_BLOCK_AREA]
+    row = max(1, height // 40)
+    boxes.sort(key=lambda b: (b[1] // row, -(b[0] + b[2])))
+    return boxes
+
+
+def _crop(binary: np.ndarray, box, pad: int = 6):
+    x, y, w, h = box
+    height, width = binary.shape
+    return binary[max(0, y - pad):min(height, y + h + pad), max(0, x - pad):min(width, x + w + pad)]
+
+#-------------------------------------------------------------------------------------------
+
+def ocr_image(img: np.ndarray, timings: dict = None):
+    """img: BGR or grayscale numpy array. Fills timings (seconds per stage) when given."""
+    timings = {} if timings is None else timings
+    start = time.perf_counter()
+    binary = preprocess(img)
+    timings["preprocess"] = time.perf_counter() - start
+
+    if tesserocr is None:
+        # one tesseract process for the page; its own layout analysis keeps blocks in order
+        mark = time.perf_counter()
+        text = _recognize(binary, psm=3).strip()
+        timings["recognize"] = time.perf_counter() - mark
+        timings["blocks"] = 1
+        timings["total"] = time.perf_counter() - start
+        _log(timings)
+        return text
+
+    mark = time.perf_counter()
+    boxes = layout_blocks(binary)
+    timings["layout"] = time.perf_counter() - mark
+    timings["blocks"] = len(boxes)
+
+    mark = time.perf_counter()
+    if len(boxes) <= 1:
+        # nothing to split (or one big block): let Tesseract segment the page itself
+        text = _recognize(binary, psm=3)
+    else:
+        crops = [_crop(binary, box) for box in boxes]
+        texts = list(_get_executor().map(_recognize, crops))
+        text = "\n".join(t.strip() for t in texts if t and t.strip())
+    timings["recognize"] = time.perf_counter() - mark
+    timings["total"] = time.perf_counter() - start
+    _log(timings)
+    return text
+
+
+def _log(timings: dict):
+    if OCR_LOG_TIMINGS:
+        print("OCR timings: " + ", ".join(
+            f"{k}={v * 1000:.0f}ms" if isinstance(v, float) else f"{k}={v}" for k, v in timings.items()
+        ))
@@ -0,0 +1,92 @@
+"""
+Keyset (cursor) pagination helpers shared by the list endpoints.
+
+A cursor is the sort key of the last row of the previous page, so every page is an index
+range scan no matter how deep it is. `page` is still accepted (as an OFFSET) for clients
+that have not moved to cursors. Totals are optional: "exact" runs COUNT(*), "estimated"
+reads planner statistics on Postgres (MAX(rowid) on SQLite), "none" skips them.
+"""
+from datetime import datetime
+
+from fastapi import HTTPException
+from sqlalchemy import and_, func, or_, select, text
+
+from database import is_sqlite
+
+TOTAL_MODES = "^(exact|estimated|none)$"
+
+
+def invalid_cursor():
+    # cursors come back from clients; a mangled one is their error, not a 500
+    return HTTPException(status_code=400, detail="قيمة cursor غير صالحة")
+
+
+def encode_time_cursor(value: datetime, row_id: int):
+    return f"{value.isoformat()}|{row_id}"
+
+
+def decode_time_cursor(cursor: str):
+    try:
+        value, row_id = cursor.rsplit("|", 1)
+        return datetime.fromisoformat(value), int(row_id)
+    except (ValueError, TypeError):
+        raise invalid_cursor()
+
+
+def decode_id_cursor(cursor: str):
+    try:
+        return int(cursor)
+    except (ValueError, TypeError):
+        raise invalid_cursor()
+
+
+def before_time_cursor(time_column, id_column, cursor: str):
+    """Rows after `cursor` in (time desc, id desc) order."""
+    value, row_id = decode_time_cursor(cursor)
+    return or_(time_column < value, and_(time_column == value, id_column < row_id))
+
+
+def page_of(rows, limit: int, cursor_of):
+    """rows were fetched with limit + 1; returns (items, next_cursor)."""
+    if len(rows) > limit:
+        return rows[:limit], cursor_of(rows[limit - 1])
+    return rows, None
+
+
+def _estimate_statement(table: str):
+    if is_sqlite:
+        return text(f"SELECT MAX(rowid) FROM {table}")
+    return text("SELECT CAST(reltuples AS BIGINT) FROM pg_class WHERE relname = :table").bindparams(table=table)
+
+
+def _statements(model, mode: str, criteria):
+    # an estimate only exists for the whole table; filtered counts are exact (and index-only)
+    estimate = _estimate_statement(model.__tablename__) if mode == "estimated" and not criteria else None
+    return estimate, select(func.count()).select_from(model).where(*criteria)
+
+
+def _usable(estimate):
+    # reltuples is -1 on Postgres tables that were never analyzed
+    return estimate is not None and estimate >= 0
+
+
+def total_of(db, model, mode: str, *criteria):
+    if mode == "none":
+        return None
+    estimate_stmt, count_stmt = _statements(model, mode, criteria)
+    if estimate_stmt is not None:
+        estimate = db.scalar(estimate_stmt)
+        if _usable(estimate):
+            return int(estimate)
+    return db.scalar(count_stmt)
+
+
+async def async_total_of(db, model, mode: str, *criteria):
+    if mode == "none":
+        return None
+    estimate_stmt, count_stmt = _statements(model, mode, criteria)
+    if estimate_stmt is not None:
+        estimate = await db.scalar(estimate_stmt)
+        if _usable(estimate):
+            return int(estimate)
+    return await db.scalar(count_stmt)
@@ -0,0 +1,111 @@
+"""
+Streaming, page-parallel PDF text extraction.
+
+The file is memory-mapped instead of read into RAM, page ranges are extracted in a
+process pool (each worker maps the file itself), and page texts are yielded in page
+order as soon as their range is done, so chunking/indexing can start before the last
+page. Pages without a usable text layer are rendered and OCR'd.
+"""
+import mmap
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+import pdfplumber
+
+PDF_PAGE_WORKERS = int(os.getenv("PDF_PAGE_WORKERS", str(os.cpu_count() or 2)))
+PDF_PAGES_PER_TASK = int(os.getenv("PDF_PAGES_PER_TASK", "8"))
+# a page with fewer extractable characters than this is treated as scanned
+PDF_OCR_MIN_CHARS = int(os.getenv("PDF_OCR_MIN_CHARS", "20"))
+PDF_OCR_RESOLUTION = int(os.getenv("PDF_OCR_RESOLUTION", "300"))
+
+_pool = None
+
+
+def _get_pool():
+    global _pool
+    if _pool is None:
+        # spawn: started from a thread of the API process, which a forked child would copy mid-use
+        _pool = ProcessPoolExecutor(max_workers=PDF_PAGE_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return _pool
+
+
+def detach_pool():
+    """Hands over the current pool (for the caller to kill); the next extraction starts a fresh one."""
+    global _pool
+    pool, _pool = _pool, None
+    return pool
+
+
+def _open_mapped(path: str):
+    f = open(path, "rb")
+    mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    f.close()
+    return mapped
+
+
+def page_count(path: str):
+    mapped = _open_mapped(path)
+    try:
+        with pdfplumber.open(mapped) as pdf:
+            return len(pdf.pages)
+    finally:
+        mapped.close()
+
+
+def _ocr_page(path: str, index: int):
+    # pdfium opens the file by path (lazily read by the C library), not from our mmap
+    import pypdfium2
+    import extractors
+    pdf = pypdfium2.PdfDocument(path)
+    try:
+        image = pdf[index].render(scale=PDF_OCR_RESOLUTION / 72).to_pil().convert("L")
+        return extractors.ocr_image(np.asarray(image))
+    finally:
+        pdf.close()
+
+
+def extract_page_range(path: str, start: int, end: int, ocr: bool = True):
+    """Worker entry point: texts of pages [start, end), OCR'ing pages with no text layer."""
+    mapped = _open_mapped(path)
+    try:
+        with pdfplumber.open(mapped, pages=list(range(start + 1, end + 1))) as pdf:
+            texts = []
+            for index, page in zip(range(start, end), pdf.pages):
+                text = page.extract_text() or ""
+                if ocr and len(text.strip()) < PDF_OCR_MIN_CHARS:
+                    text = _ocr_page(path, index) or text
+                texts.append(text)
+                # pdfplumber caches layout objects per page; drop them as we go
+                page.flush_cache()
+            return texts
+    finally:
+        mapped.close()
+
+
+def iter_pdf_pages(path: str, ocr: bool = True, pages_per_task: int = PDF_PAGES_PER_TASK):
+    """Yields (page_number, text) in order while later ranges are still being extracted."""
+    total = page_count(path)
+    pool = _get_pool()
+    futures = [
+        (start, pool.submit(extract_page_range, path, start, min(start + pages_per_task, total), ocr))
+        for start in range(0, total, pages_per_task)
+    ]
+    global _pool
+    try:
+        for start, future in futures:
+            for offset, text in enumerate(future.result()):
+                yield start + offset + 1, text
+    except BrokenProcessPool:
+        if _pool is pool:
+            _pool = None
+        raise
+    finally:
+        for _, future in futures:
+            future.cancel()
+
+
+def extract_pdf_text(path: str, ocr: bool = True):
+    return "\n".join(text for _, text in iter_pdf_pages(path, ocr) if text)
@@ -0,0 +1,134 @@
+import os
+
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "12000"))
+PROMPT_ENCODING = os.getenv("PROMPT_ENCODING", "o200k_base")   # gpt-4o / gpt-4o-mini
+
+# chat format adds a few tokens of framing per message
+_MESSAGE_OVERHEAD = 4
+# rough chars-per-token for Arabic/English mix when tiktoken is unavailable
+_CHARS_PER_TOKEN = 3
+
+SUMMARY_HEADER = "ملخص ما سبق من هذه المحادثة:\n"
+
+_UNLOADED = object()
+_encoding = _UNLOADED
+
+
+def _get_encoding():
+    # loaded on first use: the BPE file may have to be read (or downloaded) on first call
+    global _encoding
+    if _encoding is _UNLOADED:
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding(PROMPT_ENCODING)
+        except Exception:
+            _encoding = None
+    return _encoding
+
+
+def warm_up():
+    _get_encoding()
+
+
+def count_tokens(text: str):
+    if not text:
+        return 0
+    encoding = _get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    return len(text) // _CHARS_PER_TOKEN + 1
+
+
+def truncate_to_tokens(text: str, max_tokens: int):
+    if max_tokens <= 0:
+        return ""
+    encoding = _get_encoding()
+    if encoding is not None:
+        tokens = encoding.encode(text, disallowed_special=())
+        if len(tokens) <= max_tokens:
+            return text
+        return encoding.decode(tokens[:max_tokens])
+    return text[:max_tokens * _CHARS_PER_TOKEN]
+
+#-------------------------------------------------------------------------------------------
+
+class PromptBuilder:
+    """
+    Fills a token budget by priority: question, conversation summary, recent history,
+    document chunks, manual text.
+    The system template (with its {docs_text} and {manual_text} slots) is always kept.
+    A section that does not fit is truncated at its last item, and lower-priority
+    sections are dropped once the budget is spent.
+    """
+
+    def __init__(self, system_template: str, budget: int = PROMPT_TOKEN_BUDGET):
+        self.system_template = system_template
+        self.budget = budget
+
+    def build(self, question: str, history: list, doc_sections: list, manual_text: str,
+              empty_docs_text: str = "", summary: str = ""):
+        report = {"budget": self.budget}
+
+        fixed = count_tokens(self.system_template.format(docs_text="", manual_text="")) + _MESSAGE_OVERHEAD
+        report["system"] = {"tokens": fixed}
+        remaining = self.budget - fixed
+
+        # 1. question: always sent, cut only if it alone overflows the budget
+        question_text = truncate_to_tokens(question, max(remaining - _MESSAGE_OVERHEAD, 0))
+        used = count_tokens(question_text) + _MESSAGE_OVERHEAD
+        report["question"] = {"tokens": used, "truncated": question_text != question}
+        remaining -= used
+
+        # 2. running summary of the turns older than `history` (bounded when it is written)
+        kept_summary, remaining, report["summary"] = self._fill(
+            [SUMMARY_HEADER + summary] if summary else [], remaining, _MESSAGE_OVERHEAD
+        )
+
+        # 3. history, newest first so the latest turns survive
+        kept_history, remaining, report["history"] = self._fill(
+            [m["content"] for m in reversed(history)], remaining, _MESSAGE_OVERHEAD
+        )
+        roles = [m["role"] for m in reversed(history)]
+        chat_context = [
+            {"role": role, "content": text} for role, text in zip(roles, kept_history)
+        ][::-1]
+
+        # 4. document chunks, already ordered by relevance
+        kept_docs, remaining, report["documents"] = self._fill(doc_sections, remaining, 2)
+
+        # 5. site manual
+        kept_manual, remaining, report["manual"] = self._fill([manual_text] if manual_text else [], remaining, 0)
+
+        docs_text = "\n\n".join(kept_docs) or empty_docs_text
+        system_prompt = self.system_template.format(
+            docs_text=docs_text,
+            manual_text="".join(kept_manual),
+        ).strip()
+
+        messages = [{"role": "system", "content": system_prompt}]
+        messages.extend({"role": "system", "content": text} for text in kept_summary)
+        messages.extend(chat_context)
+        messages.append({"role": "user", "content": question_text})
+
+        report["total"] = self.budget - remaining
+        return messages, report
+
+    def _fill(self, items, remaining, overhead):
+        kept, tokens, truncated = [], 0, False
+        for text in items:
+            cost = count_tokens(text) + overhead
+            if cost <= remaining:
+                kept.append(text)
+                tokens += cost
+                remaining -= cost
+                continue
+            cut = truncate_to_tokens(text, remaining - overhead)
+            if cut:
+                kept.append(cut)
+                cost = count_tokens(cut) + overhead
+                tokens += cost
+                remaining -= cost
+                truncated = True
+            break
+        section = {"tokens": tokens, "kept": len(kept), "dropped": len(items) - len(kept), "truncated": truncated}
+        return kept, remaining, section
@@ -0,0 +1,131 @@
+"""
+SiteKnowledge <-> site_collection reconciliation.
+
+Pass 1 walks the SQL table in id order (keyset pages), recomputes each row's content hash
+and compares it with the content_hash stored on that row's chunks; missing or stale rows
+are re-embedded. Pass 2 walks the collection in pages and deletes chunks whose row is gone
+or whose hash no longer matches. Memory is bounded by the page size in both passes.
+
+    python reconcile.py [--dry-run] [--page-size 500]
+"""
+import argparse
+import threading
+import time
+
+from sqlalchemy import select, update
+
+from database import SessionLocal
+from models import SiteKnowledge, knowledge_columns
+import vector_service
+import answer_cache
+
+RECONCILE_PAGE_SIZE = 500
+
+_lock = threading.Lock()
+last_report = {"status": "never_run"}
+
+
+def _sync_rows(db, report, page_size, dry_run):
+    last_id = 0
+    while True:
+        rows = db.execute(
+            select(SiteKnowledge.id, SiteKnowledge.section_name, SiteKnowledge.content, SiteKnowledge.content_hash)
+            .where(SiteKnowledge.id > last_id)
+            .order_by(SiteKnowledge.id)
+            .limit(page_size)
+        ).all()
+        if not rows:
+            return
+        last_id = rows[-1].id
+        report["rows_scanned"] += len(rows)
+
+        indexed = vector_service.get_collection("site").get(
+            where={"id": {"$in": [r.id for r in rows]}}, include=["metadatas"]
+        )
+        vector_hashes = {}
+        for meta in indexed["metadatas"]:
+            meta = meta or {}
+            vector_hashes.setdefault(meta.get("id"), set()).add(meta.get("content_hash"))
+
+        stale = []
+        for r in rows:
+            derived = knowledge_columns(r.section_name, r.content)
+            current = derived["content_hash"]
+            if current != r.content_hash:
+                report["hashes_updated"] += 1
+                if not dry_run:
+                    db.execute(update(SiteKnowledge).where(SiteKnowledge.id == r.id).values(**derived))
+            if vector_hashes.get(r.id) != {current}:
+                stale.append((r.id, r.section_name, r.content, current))
+        if not dry_run:
+            db.commit()
+
+        report["rows_reindexed"] += len(stale)
+        if stale and not dry_run:
+            try:
+                vector_service.index_site_knowledge(stale)
+            except Exception as e:
+                report["errors"].append({"ids": [s[0] for s in stale], "error": str(e)})
+
+
+def _delete_orphans(db, report, page_size, dry_run):
+    offset = 0
+    while True:
+        page = vector_service.get_collection("site").get(limit=page_size, offset=offset, include=["metadatas"])
+        if not page["ids"]:
+            return
+        report["vectors_scanned"] += len(page["ids"])
+        metadatas = [m or {} for m in page["metadatas"]]
+
+        row_ids = {m.get("id") for m in metadatas if isinstance(m.get("id"), int)}
+        current = dict(db.execute(
+            select(SiteKnowledge.id, SiteKnowledge.content_hash).where(SiteKnowledge.id.in_(row_ids))
+        ).all()) if row_ids else {}
+
+        orphans = [
+            vid for vid, meta in zip(page["ids"], metadatas)
+            if current.get(meta.get("id")) is None or current[meta.get("id")] != meta.get("content_hash")
+        ]
+        report["vectors_deleted"] += len(orphans)
+        if orphans and not dry_run:
+            vector_service.delete_vectors(orphans, "site")
+            offset += len(page["ids"]) - len(orphans)
+        else:
+            offset += len(page["ids"])
+
+
+def reconcile_site_knowledge(page_size: int = RECONCILE_PAGE_SIZE, dry_run: bool = False):
+    global last_report
+    if not _lock.acquire(blocking=False):
+        return {"status": "already_running"}
+
+    report = {
+        "status": "running", "dry_run": dry_run, "started_at": time.time(),
+        "rows_scanned": 0, "hashes_updated": 0, "rows_reindexed": 0,
+        "vectors_scanned": 0, "vectors_deleted": 0, "errors": [],
+    }
+    last_report = report
+    db = SessionLocal()
+    try:
+        _sync_rows(db, report, page_size, dry_run)
+        _delete_orphans(db, report, page_size, dry_run)
+        report["status"] = "done"
+        if not dry_run and (report["rows_reindexed"] or report["vectors_deleted"]):
+            answer_cache.invalidate_all()
+    except Exception as e:
+        db.rollback()
+        report["status"] = "failed"
+        report["errors"].append({"error": str(e)})
+    finally:
+        report["elapsed_seconds"] = round(time.time() - report["started_at"], 2)
+        db.close()
+        _lock.release()
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Reconcile SiteKnowledge rows with the site_knowledge vector collection")
+    parser.add_argument("--dry-run", action="store_true")
+    parser.add_argument("--page-size", type=int, default=RECONCILE_PAGE_SIZE)
+    args = parser.parse_args()
+    print(reconcile_site_knowledge(args.page_size, args.dry_run))
@@ -1,62 +1,181 @@
+import asyncio
 import os
 import shutil
 import uuid
 from fastapi import APIRouter, Depends, Form, HTTPException, Query, File, UploadFile
 from sqlalchemy.orm import Session
-from database import get_db
-from models import Conversation, DocumentKnowledge, SiteKnowledge, UnansweredQuestion
+from database import get_db, get_read_db
+from models import Conversation, DocumentKnowledge, SiteKnowledge, UnansweredQuestion, KnowledgeImportJob, knowledge_columns
 import schemas
 import services
 import vector_service
+import answer_cache
+import knowledge_import
+import reconcile
+import knowledge_search
+import ingestion
+import upload_store
+import pagination
+import single_flight
+import upstream
+import spreadsheet
+import json
 from fastapi import BackgroundTasks 
 
 router = APIRouter(prefix="/admin", tags=["Admin Knowledge"])
 
 @router.get("/knowledge/")
 def list_knowledge(
-    q: str = Query(None), 
-    page: int = Query(1, ge=1), 
-    limit: int = Query(20, ge=1), 
-    db: Session = Depends(get_db)
+    q: str = Query(None),
+    page: int = Query(1, ge=1),
+    limit: int = Query(20, ge=1, le=100),
+    cursor: str = Query(None),
+    total: str = Query("exact", pattern=pagination.TOTAL_MODES),
+    db: Session = Depends(get_read_db)
 ):
-    query = db.query(SiteKnowledge)
-    if q:
-        query = query.filter(
-            (SiteKnowledge.section_name.ilike(f"%{q}%")) | 
-            (SiteKnowledge.content.ilike(f"%{q}%"))
-        )
-    
+    # cursor (keyset) paging stays flat as the table grows; page is kept for older clients
     offset = (page - 1) * limit
-    total = query.count()
-    items = query.offset(offset).limit(limit).all()
-    return {"total": total, "page": page, "limit": limit, "items": items}
+    if q:
+        ranked, next_cursor = knowledge_search.search_ids(db, q, limit, cursor, offset)
+        by_id = {k.id: k for k in db.query(SiteKnowledge).filter(SiteKnowledge.id.in_([i for i, _ in ranked]))}
+        items = [by_id[i] for i, _ in ranked if i in by_id]
+        count = knowledge_search.count_matches(db, q) if total != "none" else None
+    else:
+        # legacy Query refuses order_by() once an offset is set, so order first
+        query = db.query(SiteKnowledge).order_by(SiteKnowledge.id.desc())
+        if cursor:
+            query = query.filter(SiteKnowledge.id < pagination.decode_id_cursor(cursor))
+        else:
+            query = query.offset(offset)
+        rows = query.limit(limit + 1).all()
+        items, next_cursor = pagination.page_of(rows, limit, lambda k: str(k.id))
+        count = pagination.total_of(db, SiteKnowledge, total)
+
+    items = [schemas.KnowledgeItem.model_validate(k, from_attributes=True) for k in items]
+    return {"total": count, "page": page, "limit": limit, "next_cursor": next_cursor, "items": items}
 
 #----------------------------------------------------------------------------
 
 @router.post("/knowledge/", response_model=schemas.KnowledgeOut)
 def add_knowledge(data: schemas.KnowledgeCreate, db: Session = Depends(get_db)):
-    item = SiteKnowledge(section_name=data.section_name, content=data.content)
+    item = SiteKnowledge(section_name=data.section_name, content=data.content,
+                         **knowledge_columns(data.section_name, data.content))
     db.add(item)
     db.commit()
-    db.refresh(item)
     try:
-        vector_service.add_to_vector_db(
-            text=data.content,
-            metadata={"section_name": data.section_name, "id": item.id},
-            collection_type="site"
-        )
-    except:
-        pass 
+        vector_service.index_site_knowledge([(item.id, item.section_name, item.content, item.content_hash)])
+    except Exception as e:
+        # the row is saved; the reconcile job re-embeds it
+        print(f"Indexing failed for knowledge {item.id}: {e}")
+    answer_cache.invalidate_all()
     return item
 
 #----------------------------------------------------------------------------
 
+@router.post("/knowledge/import")
+def import_knowledge(
+    file: UploadFile = File(...),
+    background_tasks: BackgroundTasks = BackgroundTasks(),
+    db: Session = Depends(get_db)
+):
+    ext = os.path.splitext(file.filename.lower())[1]
+    if ext not in knowledge_import.SUPPORTED_FORMATS:
+        raise HTTPException(status_code=400, detail="Unsupported file type, use JSONL, CSV or XLSX")
+
+    job_id = str(uuid.uuid4())
+    path = knowledge_import.import_path(job_id, ext)
+    with open(path, "wb") as f:
+        shutil.copyfileobj(file.file, f)
+
+    job = KnowledgeImportJob(id=job_id, file_name=file.filename, status="queued")
+    db.add(job)
+    db.commit()
+
+    background_tasks.add_task(knowledge_import.run_import, job_id, path, ext)
+    return {"job_id": job_id, "status": "queued"}
+
+#----------------------------------------------------------------------------
+
+@router.get("/knowledge/import/{job_id}")
+def get_import_job(job_id: str, db: Session = Depends(get_db)):
+    job = db.get(KnowledgeImportJob, job_id)
+    if not job: raise HTTPException(status_code=404)
+    return {
+        "job_id": job.id,
+        "file_name": job.file_name,
+        "status": job.status,
+        "processed": job.processed,
+        "inserted": job.inserted,
+        "skipped": job.skipped,
+        "failed": job.failed,
+        "not_indexed": job.not_indexed,
+        "errors": json.loads(job.errors or "[]"),
+        "created_at": job.created_at,
+        "finished_at": job.finished_at,
+    }
+
+#----------------------------------------------------------------------------
+
+@router.post("/knowledge/reconcile")
+def reconcile_knowledge(dry_run: bool = Query(False), background_tasks: BackgroundTasks = BackgroundTasks()):
+    if reconcile.last_report.get("status") == "running":
+        return reconcile.last_report
+    background_tasks.add_task(reconcile.reconcile_site_knowledge, reconcile.RECONCILE_PAGE_SIZE, dry_run)
+    return {"status": "scheduled", "dry_run": dry_run}
+
+@router.get("/knowledge/reconcile")
+def reconcile_status():
+    return reconcile.last_report
+
+#----------------------------------------------------------------------------
+
+@router.get("/embedding-cache/stats")
+def embedding_cache_stats():
+    return vector_service.embedding_cache_stats()
+
+#----------------------------------------------------------------------------
+
+@router.get("/answer-cache/stats")
+def answer_cache_stats():
+    return services.answer_cache.stats()
+
+#----------------------------------------------------------------------------
+
+@router.get("/latency/ttft")
+def ttft_stats():
+    return services.ttft_stats()
+
+#----------------------------------------------------------------------------
+
+@router.get("/single-flight/stats")
+def single_flight_stats():
+    return single_flight.stats()
+
+
+@router.get("/upstream/stats")
+def upstream_stats():
+    # queue depth per priority class, admission wait p50/p95, shed and 429 counts
+    return upstream.scheduler.stats()
+
+#----------------------------------------------------------------------------
+
 @router.get("/unanswered/")
-def list_unanswered(page: int = Query(1, ge=1), limit: int = Query(20, ge=1), db: Session = Depends(get_db)):
-    offset = (page - 1) * limit
-    total = db.query(UnansweredQuestion).count()
-    items = db.query(UnansweredQuestion).offset(offset).limit(limit).all()
-    return {"total": total, "page": page, "limit": limit, "items": items}
+def list_unanswered(
+    page: int = Query(1, ge=1),
+    limit: int = Query(20, ge=1, le=100),
+    cursor: int = Query(None),
+    total: str = Query("exact", pattern=pagination.TOTAL_MODES),
+    db: Session = Depends(get_read_db)
+):
+    query = db.query(UnansweredQuestion).order_by(UnansweredQuestion.id)
+    if cursor is not None:
+        query = query.filter(UnansweredQuestion.id > cursor)
+    else:
+        query = query.offset((page - 1) * limit)
+    rows = query.limit(limit + 1).all()
+    items, next_cursor = pagination.page_of(rows, limit, lambda u: u.id)
+    count = pagination.total_of(db, UnansweredQuestion, total)
+    return {"total": count, "page": page, "limit": limit, "next_cursor": next_cursor, "items": items}
 
 #----------------------------------------------------------------------------
 
@@ -71,13 +190,19 @@ def delete_unanswered(qid: int, db: Session = Depends(get_db)):
 #----------------------------------------------------------------------------
 
 @router.post("/knowledge/resolve-unanswered/{qid}")
-async def resolve_unanswered(qid: int, data: schemas.KnowledgeCreate, db: Session = Depends(get_db)):
+def resolve_unanswered(qid: int, data: schemas.KnowledgeCreate, db: Session = Depends(get_db)):
     un_item = db.query(UnansweredQuestion).filter(UnansweredQuestion.id == qid).first()
     if not un_item: raise HTTPException(status_code=404)
-    new_k = SiteKnowledge(section_name=data.section_name, content=data.content)
+    new_k = SiteKnowledge(section_name=data.section_name, content=data.content,
+                          **knowledge_columns(data.section_name, data.content))
     db.add(new_k)
     db.delete(un_item)
     db.commit()
+    try:
+        vector_service.index_site_knowledge([(new_k.id, new_k.section_name, new_k.content, new_k.content_hash)])
+    except Exception as e:
+        print(f"Indexing failed for knowledge {new_k.id}: {e}")
+    answer_cache.invalidate_all()
     return {"status": "resolved"}
 
 #----------------------------------------------------------------------------
@@ -138,7 +263,6 @@ async def resolve_unanswered(qid: int, data: schemas.KnowledgeCreate, db: Sessio
 async def upload_chat_document(
     file: UploadFile = File(...),
     conversation_id: int = Form(None),  # اختياري
-    background_tasks: BackgroundTasks = BackgroundTasks(),
     db: Session = Depends(get_db)
 ):
     actual_conv_id = conversation_id
@@ -148,7 +272,6 @@ async def upload_chat_document(
         new_conv = Conversation(title=f"محادثة ملف: {file.filename}")
         db.add(new_conv)
         db.commit()
-        db.refresh(new_conv)
         actual_conv_id = new_conv.id
 
     # تحقق من وجود المحادثة
@@ -156,74 +279,99 @@ async def upload_chat_document(
     if not conv:
         raise HTTPException(status_code=404, detail="Conversation not found")
 
-    allowed = ('.pdf', '.docx', '.jpg', '.jpeg', '.png')
+    allowed = ('.pdf', '.docx', '.jpg', '.jpeg', '.png') + spreadsheet.EXTENSIONS
     if not file.filename.lower().endswith(allowed):
         raise HTTPException(status_code=400, detail="Unsupported file type")
 
-    upload_dir = "static/uploads"
-    os.makedirs(upload_dir, exist_ok=True)
-
-    safe_name = f"{uuid.uuid4()}_{file.filename}"
-    file_path = os.path.join(upload_dir, safe_name)
-
-    with open(file_path, "wb") as f:
-        shutil.copyfileobj(file.file, f)
+    # identical bytes are stored once; the hash also keys the cached extraction.
+    # copying and hashing a large file would stall every stream on the event loop
+    stored = await asyncio.to_thread(upload_store.save_upload, db, file.file, file.filename)
+    cached_text = stored.extracted_text
+    if spreadsheet.is_spreadsheet(file.filename):
+        # the cached text is only the summary; the row chunks have to be indexed for this document too
+        cached_text = None
 
     doc = DocumentKnowledge(
         conversation_id=actual_conv_id,
         file_name=file.filename,
-        file_path=file_path.replace(os.sep, "/"),
-        content="PROCESSING"
+        file_path=stored.path,
+        file_hash=stored.sha256,
+        content=cached_text if cached_text is not None else "PROCESSING"
     )
     db.add(doc)
     db.commit()
-    db.refresh(doc)
-
-    background_tasks.add_task(
-        services.process_file_task,
-        doc.id,
-        file_path,
-        file.filename,
-        actual_conv_id
-    )
+
+    if cached_text is None:
+        ingestion.enqueue(db, doc)
 
     return {
         "id": doc.id,
         "type": "file",
         "file_name": doc.file_name,
         "file_url": f"/{doc.file_path}",
-        "status": "processing",
+        "status": "processing" if cached_text is None else "done",
         "conversation_id": actual_conv_id
     }
 
 
 #----------------------------------------------------------------------------
 
+@router.get("/documents/{doc_id}/status")
+def document_status(doc_id: int, db: Session = Depends(get_db)):
+    doc = db.get(DocumentKnowledge, doc_id)
+    if not doc: raise HTTPException(status_code=404)
+    job = ingestion.job_status(db, doc_id)
+    if not job:
+        # uploaded before the job queue existed
+        status = "processing" if doc.content == "PROCESSING" else "done"
+        return {"document_id": doc_id, "status": status}
+    return {
+        "document_id": doc_id,
+        "status": job.status,
+        "kind": job.kind,
+        "attempts": job.attempts,
+        "error": job.error,
+        "queued_at": job.created_at,
+        "started_at": job.started_at,
+        "finished_at": job.finished_at,
+    }
+
+#----------------------------------------------------------------------------
+
 @router.get("/conversations/{conv_id}/documents")
 def list_conversation_documents(
     conv_id: int, 
     page: int = Query(1, ge=1), 
-    limit: int = Query(20, ge=1), 
-    db: Session = Depends(get_db)
+    limit: int = Query(20, ge=1, le=100), 
+    cursor: int = Query(None),
+    total: str = Query("exact", pattern=pagination.TOTAL_MODES),
+    db: Session = Depends(get_read_db)
 ):
-    offset = (page - 1) * limit
-    items = db.query(DocumentKnowledge).filter(
-        DocumentKnowledge.conversation_id == conv_id
-    ).order_by(DocumentKnowledge.created_at.desc()).offset(offset).limit(limit).all()
+    # newest first by id (same order as created_at), served by (conversation_id, id)
+    query = (
+        db.query(DocumentKnowledge)
+        .filter(DocumentKnowledge.conversation_id == conv_id)
+        .order_by(DocumentKnowledge.id.desc())
+    )
+    if cursor is not None:
+        query = query.filter(DocumentKnowledge.id < cursor)
+    else:
+        query = query.offset((page - 1) * limit)
+    rows = query.limit(limit + 1).all()
+    items, next_cursor = pagination.page_of(rows, limit, lambda d: d.id)
     
     for item in items:
         if item.file_path:
             item.file_url = f"http://127.0.0.1:8000/{item.file_path.replace(os.sep, '/')}"
 
-    total = db.query(DocumentKnowledge).filter(
-        DocumentKnowledge.conversation_id == conv_id
-    ).count()
+    count = pagination.total_of(db, DocumentKnowledge, total, DocumentKnowledge.conversation_id == conv_id)
 
     return {
         "conversation_id": conv_id,
-        "total": total,
+        "total": count,
         "page": page,
         "limit": limit,
+        "next_cursor": next_cursor,
         "items": items
     }
 
@@ -235,14 +383,28 @@ def delete_conv(conv_id: int, db: Session = Depends(get_db)):
     if not conv:
         raise HTTPException(status_code=404, detail="المحادثة غير موجودة")
 
+    released = []
     for doc in conv.documents:
-        if doc.file_path and os.path.exists(doc.file_path):
+        if doc.file_hash:
+            # shared with other conversations; the store removes the file at the last reference
+            path = upload_store.release(db, doc.file_hash)
+            if path:
+                released.append((doc.file_hash, path))
+        elif doc.file_path and os.path.exists(doc.file_path):
             try:
                 os.remove(doc.file_path) 
             except Exception as e:
                 print(f"فشل حذف الملف {doc.file_path}: {e}")
 
+    try:
+        vector_service.delete_conversation_vectors(conv_id)
+    except Exception as e:
+        print(f"فشل حذف مقاطع المحادثة {conv_id} من قاعدة المتجهات: {e}")
+
     db.delete(conv)
     db.commit()
+    # files go only once the reference counts are committed
+    for sha256, path in released:
+        upload_store.discard(db, sha256, path)
     
     return {"status": "deleted", "message": "تم حذف المحادثة وكل ملفاتها وصورها بنجاح"}
\ No newline at end of file
@@ -1,62 +1,121 @@
-from fastapi import APIRouter, Depends, HTTPException, Query
-from sqlalchemy.orm import Session
-from models import Conversation
+import time
+from fastapi import APIRouter, Depends, Header, HTTPException, Query
+from sqlalchemy import select, delete
+from sqlalchemy.ext.asyncio import AsyncSession
+from models import Conversation, Message
 import schemas
 import crud, services
-from database import get_db
+import pagination
+import stream_relay
+import upstream
+from database import get_async_db, get_async_read_db
 from fastapi.responses import StreamingResponse
 
 router = APIRouter(prefix="/chat", tags=["Chat & Conversations"])
 
 @router.post("/ask/")
-async def ask_real_estate_agent(q: schemas.Question, db: Session = Depends(get_db)):
-    conv = crud.get_or_create_conversation(db, q.question, q.conversation_id)
-    
-    crud.save_message(db, conv.id, "user", q.question)
+async def ask_real_estate_agent(q: schemas.Question, db: AsyncSession = Depends(get_async_db)):
+    started_at = time.perf_counter()
+    _reject_if_saturated()
+    conv = await crud.get_or_create_conversation(db, q.question, q.conversation_id)
 
+    # the user message is saved together with the assistant placeholder inside get_ai_answer;
+    # generation runs in the background so a dropped client can resume (see stream_relay)
+    stream = stream_relay.start(services.answer_in_background(
+        q.question, conv, save_question=True,
+        new_conversation=conv.id != q.conversation_id, started_at=started_at
+    ))
+    return _sse_response(stream, conv.id)
+
+
+def _reject_if_saturated():
+    # refuse before anything is written when the answer queue is already full
+    retry_after = upstream.scheduler.saturated(upstream.INTERACTIVE)
+    if retry_after is not None:
+        raise HTTPException(status_code=503, detail=upstream.BUSY_MESSAGE,
+                            headers={"Retry-After": str(int(retry_after + 0.5))})
+
+
+def _sse_response(stream, conv_id: int, after: int = 0):
     return StreamingResponse(
-        services.get_ai_answer(db, q.question, conv),
-        media_type="text/event-stream", 
+        stream.read(after),
+        media_type="text/event-stream",
         headers={
-            "X-Conversation-Id": str(conv.id),
-            "Access-Control-Expose-Headers": "X-Conversation-Id",
-            "X-Accel-Buffering": "no",  
-            "Cache-Control": "no-cache",
-            "Connection": "keep-alive",
+            "X-Conversation-Id": str(conv_id),
+            "X-Stream-Id": stream.id,
+            "Access-Control-Expose-Headers": "X-Conversation-Id, X-Stream-Id",
+            **stream_relay.SSE_HEADERS,
         }
     )
 
 #----------------------------------------------------------------------------
 
+@router.get("/streams/resume")
+async def resume_stream(
+    last_event_id: str = Header(None),
+    event_id: str = Query(None),
+    conversation_id: int = Query(None),
+):
+    # EventSource sends Last-Event-ID on reconnect; fetch-based clients may pass ?event_id=
+    stream, seq = stream_relay.parse_event_id(last_event_id or event_id)
+    if not stream:
+        # expired or served by another worker: the checkpointed text is in the conversation messages
+        raise HTTPException(status_code=404, detail="انتهت صلاحية البث، يرجى تحديث الرسائل")
+    return _sse_response(stream, conversation_id or 0, after=seq)
+
+#----------------------------------------------------------------------------
+
 @router.get("/conversations/")
-def list_conversations(page: int = Query(1, ge=1), limit: int = Query(20, ge=1, le=100), db: Session = Depends(get_db)):
-    offset = (page - 1) * limit
-    total = db.query(Conversation).count()
-    items = db.query(Conversation).order_by(Conversation.updated_at.desc()).offset(offset).limit(limit).all()
-    return {"total": total, "page": page, "limit": limit, "items": items}
+async def list_conversations(
+    page: int = Query(1, ge=1),
+    limit: int = Query(20, ge=1, le=100),
+    cursor: str = Query(None),
+    total: str = Query("exact", pattern=pagination.TOTAL_MODES),
+    db: AsyncSession = Depends(get_async_read_db)
+):
+    # most recently active first; updated_at moves on every new message (see models._touch_conversation)
+    query = select(Conversation)
+    if cursor:
+        query = query.where(pagination.before_time_cursor(Conversation.updated_at, Conversation.id, cursor))
+    else:
+        query = query.offset((page - 1) * limit)
+    result = await db.execute(query.order_by(Conversation.updated_at.desc(), Conversation.id.desc()).limit(limit + 1))
+    items, next_cursor = pagination.page_of(
+        result.scalars().all(), limit, lambda c: pagination.encode_time_cursor(c.updated_at, c.id)
+    )
+    count = await pagination.async_total_of(db, Conversation, total)
+    return {"total": count, "page": page, "limit": limit, "next_cursor": next_cursor, "items": items}
 
 #----------------------------------------------------------------------------
 
 @router.get("/conversations/{conv_id}/messages")
-def get_messages(conv_id: int, cursor: int = Query(None), limit: int = 30, db: Session = Depends(get_db)):
-    from database import Message
-    query = db.query(Message).filter(Message.conversation_id == conv_id)
-    if cursor: query = query.filter(Message.id < cursor)
-    
-    messages = query.order_by(Message.id.desc()).limit(limit).all()
-    next_cursor = messages[-1].id if messages else None
-    
+async def get_messages(
+    conv_id: int,
+    cursor: int = Query(None),
+    limit: int = Query(30, ge=1, le=100),
+    total: str = Query("none", pattern=pagination.TOTAL_MODES),
+    db: AsyncSession = Depends(get_async_read_db)
+):
+    # newest page first, walking back by id on (conversation_id, id)
+    query = select(Message).where(Message.conversation_id == conv_id)
+    if cursor: query = query.where(Message.id < cursor)
+
+    result = await db.execute(query.order_by(Message.id.desc()).limit(limit + 1))
+    messages, next_cursor = pagination.page_of(result.scalars().all(), limit, lambda m: m.id)
+    count = await pagination.async_total_of(db, Message, total, Message.conversation_id == conv_id)
+
     return {
-        "items": list(reversed(messages)), 
+        "items": list(reversed(messages)),
         "next_cursor": next_cursor,
-        "limit": limit
+        "limit": limit,
+        "total": count
     }
 
 #----------------------------------------------------------------------------
 
 @router.patch("/conversations/{conv_id}/rename")
-def rename_conv(conv_id: int, data: schemas.ConversationRename, db: Session = Depends(get_db)):
-    success = crud.rename_conversation(db, conv_id, data.title) 
+async def rename_conv(conv_id: int, data: schemas.ConversationRename, db: AsyncSession = Depends(get_async_db)):
+    success = await crud.rename_conversation(db, conv_id, data.title)
     if not success: raise HTTPException(status_code=404)
     return {"status": "updated"}
 
@@ -64,34 +123,33 @@ def rename_conv(conv_id: int, data: schemas.ConversationRename, db: Session = De
 
 # @router.delete("/conversations/{conv_id}/delete")
 # def delete_conv(conv_id: int, db: Session = Depends(get_db)):
-#     success = crud.delete_conversation(db, conv_id) 
+#     success = crud.delete_conversation(db, conv_id)
 #     if not success: raise HTTPException(status_code=404)
 #     return {"status": "deleted"}
 
 #----------------------------------------------------------------------------
 
 @router.patch("/messages/{message_id}/edit")
-async def edit_message(message_id: int, data: schemas.MessageUpdate, db: Session = Depends(get_db)):
-    updated_msg = crud.update_message_text(db, message_id, data.text)
+async def edit_message(message_id: int, data: schemas.MessageUpdate, db: AsyncSession = Depends(get_async_db)):
+    _reject_if_saturated()
+    updated_msg = await crud.update_message_text(db, message_id, data.text)
     if not updated_msg:
         raise HTTPException(status_code=404, detail="الرسالة غير موجودة")
-    
+
+    # a summary that already covers this message no longer matches the conversation
+    await crud.reset_summary(db, updated_msg.conversation_id, message_id)
+    await db.commit()
+
     if updated_msg.role == "user":
-        db.query(crud.Message).filter(
-            crud.Message.conversation_id == updated_msg.conversation_id,
-            crud.Message.id > message_id
-        ).delete()
-        db.commit()
-
-        conv = db.query(crud.Conversation).filter(crud.Conversation.id == updated_msg.conversation_id).first()
-
-        return StreamingResponse(
-    services.get_ai_answer(db, data.text, conv),
-    media_type="text/plain",
-    headers={
-        "X-Conversation-Id": str(conv.id),
-        "Access-Control-Expose-Headers": "X-Conversation-Id"
-    }
-)
-    
-    return {"status": "success", "updated_text": updated_msg.text}
\ No newline at end of file
+        await db.execute(delete(Message).where(
+            Message.conversation_id == updated_msg.conversation_id,
+            Message.id > message_id
+        ))
+        await db.commit()
+
+        conv = await crud.get_conversation(db, updated_msg.conversation_id)
+
+        stream = stream_relay.start(services.answer_in_background(data.text, conv))
+        return _sse_response(stream, conv.id)
+
+    return {"status": "success", "updated_text": updated_msg.text}
@@ -22,4 +22,8 @@ class KnowledgeOut(BaseModel):
     content: str
     created_at: datetime
     class Config:
-        orm_mode = True
\ No newline at end of file
+        orm_mode = True
+
+class KnowledgeItem(KnowledgeOut):
+    # list rows; the derived search_text / content_hash columns stay internal
+    updated_at: Optional[datetime] = None
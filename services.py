@@ -1,26 +1,48 @@
 import os
 import json
-import pandas as pd  
-import docx
-import pdfplumber
-from openai import OpenAI
-from pptx import Presentation
-from sqlalchemy.orm import Session
-from io import BytesIO
-import numpy as np
-import cv2
-from io import BytesIO
-import pytesseract
+import time
+import asyncio
+from collections import deque
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
 
 import crud
-from models import DocumentKnowledge, Message
+from database import AsyncSessionLocal
+from models import Conversation, DocumentKnowledge, Message
 import vector_service
+import single_flight
+import metrics
+import upstream
+import spreadsheet
+from answer_cache import SemanticAnswerCache, replay_tokens
+from prompt_builder import PromptBuilder, count_tokens
 
 
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+client = None   # AsyncOpenAI, created on first use (see _openai)
 
 
-def classify_intent(user_text):
+def _openai():
+    global client
+    if client is None:
+        from openai import AsyncOpenAI
+        client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+    return client
+
+
+def warm_up():
+    _openai()
+
+# answers for conversations without uploaded documents (site-manual questions only)
+answer_cache = SemanticAnswerCache(vector_service.cached_ef)
+
+
+def _count_usage(response):
+    if getattr(response, "usage", None):
+        metrics.llm_tokens.inc(response.usage.prompt_tokens, kind="prompt")
+        metrics.llm_tokens.inc(response.usage.completion_tokens, kind="completion")
+
+
+async def classify_intent(user_text):
     prompt = f"""تصنف رسالة المستخدم لـ 'greeting' أو 'technical' أو 'out_of_scope'.
     - 'greeting': سلام أو ترحيب.
     - 'technical': سؤال عن العقارات، المنصة، الملفات المرفوعة، بنود العقود، أو الإجراءات القانونية العقارية.
@@ -33,92 +55,246 @@ def classify_intent(user_text):
     }}
     
     الرسالة: {user_text}"""
-    response = client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=[{"role": "user", "content": prompt}],
-        response_format={ "type": "json_object" },
-        temperature=0
-    )
-    return json.loads(response.choices[0].message.content)
+    async def classify():
+        # gates an answer the user is waiting for, so it is admitted as interactive
+        response = await upstream.call(upstream.INTERACTIVE, upstream.estimate_tokens(prompt) + 60,
+            lambda: _openai().chat.completions.create(
+                model="gpt-4o-mini",
+                messages=[{"role": "user", "content": prompt}],
+                response_format={ "type": "json_object" },
+                temperature=0
+            ))
+        _count_usage(response)
+        return response.choices[0].message.content
+
+    # identical messages arriving together share one call; each caller gets its own dict
+    content = await single_flight.intents.call(single_flight.make_key(user_text), classify)
+    return json.loads(content)
 
 #-------------------------------------------------------------------------------------------
 
-def extract_text_from_pdf(file_content: bytes):
+SYSTEM_PROMPT_TEMPLATE = """
+أنت خبير عقاري ذكي للمنصة الوطنية للعقارات.
+لديك وثائق مرفوعة من قبل المستخدم، وقد تحتوي على أخطاء بسيطة بسبب OCR.
+مهمتك هي تحليل الوثائق والإجابة على الأسئلة بدقة ومهنية.
+
+[نصوص الوثائق المرفوعة في المحادثة]:
+{docs_text}
+
+[دليل المنصة العام]:
+{manual_text}
+
+تعليمات:
+1. إذا ذُكر "هذا العقد" أو "الصورة"، ارجع أولاً لنصوص الوثائق.
+2. صحح الأخطاء الإملائية الشائعة إن وُجدت.
+3. إذا بدا المستند عقداً رسمياً، وضّح ذلك للمستخدم.
+4. فقط إذا لم تجد أي معلومة مفيدة إطلاقاً، اكتب NOT_FOUND.
+"""
+
+prompt_builder = PromptBuilder(SYSTEM_PROMPT_TEMPLATE)
+LOG_PROMPT_SIZE = os.getenv("LOG_PROMPT_SIZE", "0") == "1"
+STREAM_CHECKPOINT_TOKENS = int(os.getenv("STREAM_CHECKPOINT_TOKENS", "40"))
+# completion size assumed when admitting an answer against the tokens-per-minute budget
+ANSWER_TOKENS_ESTIMATE = int(os.getenv("ANSWER_TOKENS_ESTIMATE", "500"))
+# messages after the summary boundary sent as history; prompt_builder trims further by budget
+HISTORY_MAX_MESSAGES = int(os.getenv("HISTORY_MAX_MESSAGES", "12"))
+
+DOC_INLINE_MAX_CHARS = int(os.getenv("DOC_INLINE_MAX_CHARS", "4000"))
+DOC_CHUNKS_TOP_K = int(os.getenv("DOC_CHUNKS_TOP_K", "6"))
+
+def _retrieve_document_chunks(question: str, conv_id: int, docs):
     try:
-        with pdfplumber.open(BytesIO(file_content)) as pdf:
-            return "\n".join([page.extract_text() for page in pdf.pages if page.extract_text()])
+        for d in docs:
+            vector_service.ensure_document_indexed(d.id, conv_id, d.file_name, d.content)
+        return vector_service.search_document_chunks(
+            question, conv_id, [d.id for d in docs], n_results=DOC_CHUNKS_TOP_K
+        )
     except Exception as e:
-        print(f"Error PDF: {e}")
-        return ""
-    
+        # retrieval is an optimisation; never answer blind because chroma failed
+        print(f"Document retrieval error: {e}")
+        return [
+            {"text": d.content[:DOC_INLINE_MAX_CHARS], "metadata": {"file_name": d.file_name}}
+            for d in docs
+        ]
+
+async def _conversation_context(db: AsyncSession, conv_id: int, summary_until_id: int = 0):
+    with metrics.span("documents_fetch"):
+        result = await db.execute(
+            select(DocumentKnowledge)
+            .where(DocumentKnowledge.conversation_id == conv_id)
+        )
+        db_docs = result.scalars().all()
+    with metrics.span("history_fetch"):
+        history = await crud.get_chat_history(db, conv_id, limit=HISTORY_MAX_MESSAGES, after_id=summary_until_id)
+    return db_docs, history
+
 #-------------------------------------------------------------------------------------------
+# Time to first token, measured from request arrival (router) to the first yielded token
 
-def extract_text_general(content: bytes, filename: str):
-    filename = filename.lower()
-    try:
-        if filename.endswith('.pdf'):
-            return extract_text_from_pdf(content)
-        elif filename.endswith('.docx'):
-            doc = docx.Document(BytesIO(content))
-            return "\n".join([p.text for p in doc.paragraphs])
-        elif filename.endswith(('.xlsx', '.xls')):
-            df = pd.read_excel(BytesIO(content))
-            return "بيانات الجدول المستخرجة:\n" + df.to_string()
-        elif filename.endswith('.pptx'):
-            prs = Presentation(BytesIO(content))
-            return "\n".join([shape.text for slide in prs.slides for shape in slide.shapes if hasattr(shape, "text")])
-    except Exception as e:
-        print(f"Extraction Error for {filename}: {e}")
-    return ""
+LOG_TTFT = os.getenv("LOG_TTFT", "0") == "1"
+_ttft_samples = deque(maxlen=int(os.getenv("TTFT_SAMPLES", "1000")))
+
+
+def _record_ttft(started_at: float, conv_id: int, source: str):
+    ttft = time.perf_counter() - started_at
+    _ttft_samples.append(ttft)
+    metrics.ttft_seconds.observe(ttft, source=source)
+    if LOG_TTFT:
+        print(f"TTFT conversation {conv_id} ({source}): {ttft * 1000:.0f}ms")
+
+
+def ttft_stats():
+    samples = sorted(_ttft_samples)
+    if not samples:
+        return {"count": 0}
+    pick = lambda q: round(samples[min(len(samples) - 1, int(q * len(samples)))] * 1000, 1)
+    return {"count": len(samples), "p50_ms": pick(0.5), "p95_ms": pick(0.95), "p99_ms": pick(0.99),
+            "mean_ms": round(sum(samples) / len(samples) * 1000, 1)}
 
 #-------------------------------------------------------------------------------------------
 
-pytesseract.pytesseract.tesseract_cmd = r'C:\Program Files\Tesseract-OCR\tesseract.exe'
+_background_tasks = set()
+
+
+def _spawn(coro):
+    # keep a reference so the task is not garbage-collected mid-flight
+    task = asyncio.create_task(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    return task
+
+
+async def _title_conversation(conv_id: int, question: str, provisional: str):
+    title = await generate_chat_title(question)
+    async with AsyncSessionLocal() as session:
+        # keep a title the user set in the meantime
+        await session.execute(
+            update(Conversation)
+            .where(Conversation.id == conv_id, Conversation.title == provisional)
+            .values(title=title)
+        )
+        await session.commit()
+
 
-async def extract_text_from_image(image_bytes: bytes):
+async def _save_user_message(conv_id: int, question: str):
+    # own session: the request's session may be unusable after the error that got us here
     try:
-        nparr = np.frombuffer(image_bytes, np.uint8)
-        img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-        
-        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-        
-        text = pytesseract.image_to_string(gray, lang='ara+eng')
-        
-        if not text.strip():
-            return "لم يتم العثور على نص واضح."
-            
-        return text
+        async with AsyncSessionLocal() as session:
+            session.add(Message(conversation_id=conv_id, role="user", text=question))
+            await session.commit()
     except Exception as e:
-        return f"Tesseract Error: {str(e)}"
-    
-#-------------------------------------------------------------------------------------------
+        print(f"Could not save the question for conversation {conv_id}: {e}")
 
-def get_ai_answer(db: Session, question: str, conv):
 
-    # ----------- Vector search (site knowledge)
-    manual_text = vector_service.search_vector_db(
-        question,
-        collection_type="site"
-    )
+async def _model_tokens(messages, estimated_tokens: int):
+    response = upstream.stream(upstream.INTERACTIVE, estimated_tokens,
+        lambda: _openai().chat.completions.create(
+            model="gpt-4o-mini",
+            messages=messages,
+            temperature=0,
+            stream=True,
+            stream_options={"include_usage": True}
+        ))
+    async for chunk in response:
+        if chunk.choices and chunk.choices[0].delta.content:
+            yield chunk.choices[0].delta.content
+        # the final chunk (no choices) carries the token usage of the whole call
+        _count_usage(chunk)
+
+
+async def get_ai_answer(db: AsyncSession, question: str, conv, save_question: bool = False,
+                        new_conversation: bool = False, started_at: float = None):
+    """
+    save_question: the user message is written in the same transaction as the assistant placeholder.
+    new_conversation: the real title is generated in the background once the answer is streaming.
+    """
+    started_at = started_at or time.perf_counter()
+    title_pending = new_conversation
+    # upstream calls made for this request (incl. the embeddings below) jump the upload backlog
+    upstream.priority.set(upstream.INTERACTIVE)
+    provisional_title = conv.title
+
+    # ----------- Context, fetched concurrently
+    # The question embedding is the slow part of both the cache lookup and the site search;
+    # start it first (it lands in the embedding cache) while the DB reads run.
+    embed_task = asyncio.create_task(asyncio.to_thread(vector_service.cached_ef, [question]))
+
+    async def embedded(stage, fn, *args, **kwargs):
+        try:
+            await embed_task
+        except Exception:
+            pass   # fn embeds again and reports the error itself
+
+        def timed():
+            with metrics.span(stage):
+                return fn(*args, **kwargs)
+        return await asyncio.to_thread(timed)
+
+    # chromadb is sync-only; keep its embedding + query off the event loop
+    site_task = asyncio.create_task(embedded("site_search", vector_service.search_vector_db, question, collection_type="site"))
 
-    # ----------- Conversation documents
-    db_docs = db.query(DocumentKnowledge)\
-        .filter(DocumentKnowledge.conversation_id == conv.id)\
-        .all()
+    try:
+        db_docs, history = await _conversation_context(db, conv.id, conv.summary_until_id)
+
+        # small documents go into the prompt whole; large ones contribute only their top-k chunks
+        ready_docs = [d for d in db_docs if d.content and len(d.content) > 20 and d.content != "PROCESSING"]
+        # a spreadsheet's content is its columnar summary, always inline; matching rows come from retrieval
+        sheets = {d.id for d in ready_docs if spreadsheet.is_spreadsheet(d.file_name)}
+        small_docs = [d for d in ready_docs if len(d.content) <= DOC_INLINE_MAX_CHARS or d.id in sheets]
+        large_docs = [d for d in ready_docs if len(d.content) > DOC_INLINE_MAX_CHARS or d.id in sheets]
+        chunks_task = asyncio.create_task(
+            embedded("document_chunks", _retrieve_document_chunks, question, conv.id, large_docs)
+        ) if large_docs else None
+
+        # ----------- Semantic answer cache: only when the prompt depends on nothing but the
+        # question (no uploaded documents, no earlier turns, no rolling summary)
+        cacheable = not db_docs and not any(m.text for m in history) and not conv.summary
+        question_vector = None
+        if cacheable:
+            try:
+                cached_answer, question_vector = await embedded("answer_cache_lookup", answer_cache.lookup, question)
+            except Exception as e:
+                print(f"Answer cache error: {e}")
+                cached_answer = None
+            if cached_answer:
+                site_task.cancel()
+                if save_question:
+                    db.add(Message(conversation_id=conv.id, role="user", text=question))
+                db.add(Message(conversation_id=conv.id, role="assistant", type="text", text=cached_answer))
+                await db.commit()
+                _record_ttft(started_at, conv.id, "cache")
+                metrics.answers.inc(outcome="cache")
+                if title_pending:
+                    title_pending = False
+                    _spawn(_title_conversation(conv.id, question, provisional_title))
+                for token in replay_tokens(cached_answer):
+                    yield token
+                return
+
+        manual_text = await site_task
+        chunks = await chunks_task if chunks_task else []
+    except BaseException:
+        site_task.cancel()
+        if save_question:
+            # the question would otherwise only be written with the placeholder below
+            await asyncio.shield(_save_user_message(conv.id, question))
+        if title_pending:
+            _spawn(_title_conversation(conv.id, question, provisional_title))
+        raise
 
     docs_list = []
-    for d in db_docs:
-        if d.content and len(d.content) > 20 and d.content != "PROCESSING":
-            docs_list.append(
-                f"--- بداية المستند ({d.file_name}) ---\n"
-                f"{d.content}\n"
-                f"--- نهاية المستند ---"
-            )
-
-    docs_text = "\n\n".join(docs_list)
-
-    # ----------- Chat history
-    history = crud.get_chat_history(db, conv.id, limit=5)
+    for d in small_docs:
+        docs_list.append(
+            f"--- بداية المستند ({d.file_name}) ---\n"
+            f"{d.content}\n"
+            f"--- نهاية المستند ---"
+        )
+    for c in chunks:
+        docs_list.append(
+            f"--- مقتطف من المستند ({c['metadata'].get('file_name', '')}) ---\n"
+            f"{c['text']}\n"
+            f"--- نهاية المقتطف ---"
+        )
 
     chat_context = [
         {"role": m.role, "content": m.text}
@@ -126,30 +302,23 @@ def get_ai_answer(db: Session, question: str, conv):
         if m.text
     ]
 
-    # ----------- System prompt
-    system_prompt = f"""
-أنت خبير عقاري ذكي للمنصة الوطنية للعقارات.
-لديك وثائق مرفوعة من قبل المستخدم، وقد تحتوي على أخطاء بسيطة بسبب OCR.
-مهمتك هي تحليل الوثائق والإجابة على الأسئلة بدقة ومهنية.
-
-[نصوص الوثائق المرفوعة في المحادثة]:
-{docs_text if docs_text else "لا توجد وثائق مرفوعة حالياً."}
-
-[دليل المنصة العام]:
-{manual_text}
-
-تعليمات:
-1. إذا ذُكر "هذا العقد" أو "الصورة"، ارجع أولاً لنصوص الوثائق.
-2. صحح الأخطاء الإملائية الشائعة إن وُجدت.
-3. إذا بدا المستند عقداً رسمياً، وضّح ذلك للمستخدم.
-4. فقط إذا لم تجد أي معلومة مفيدة إطلاقاً، اكتب NOT_FOUND.
-""".strip()
-
-    messages = [{"role": "system", "content": system_prompt}]
-    messages.extend(chat_context)
-    messages.append({"role": "user", "content": question})
-
-    # ----------- Placeholder message (IMPORTANT)
+    # ----------- Prompt assembly (token budget)
+    with metrics.span("prompt_assembly"):
+        messages, prompt_report = prompt_builder.build(
+            question, chat_context, docs_list, manual_text,
+            empty_docs_text="لا توجد وثائق مرفوعة حالياً.",
+            summary=conv.summary or ""
+        )
+    if metrics.METRICS_ENABLED:
+        metrics.prompt_tokens.observe(prompt_report["total"], part="total")
+        for part in ("summary", "history", "documents", "manual"):
+            metrics.prompt_tokens.observe(prompt_report[part]["tokens"], part=part)
+    if LOG_PROMPT_SIZE:
+        print(f"Prompt tokens for conversation {conv.id}: {prompt_report}")
+
+    # ----------- Placeholder message (IMPORTANT), one transaction with the user message
+    if save_question:
+        db.add(Message(conversation_id=conv.id, role="user", text=question))
     assistant_msg = Message(
         conversation_id=conv.id,
         role="assistant",
@@ -157,75 +326,170 @@ def get_ai_answer(db: Session, question: str, conv):
         text=""
     )
     db.add(assistant_msg)
-    db.commit()
-    db.refresh(assistant_msg)
+    await db.commit()
 
     full_response = ""
-
-    try:
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=messages,
-            temperature=0,
-            stream=True
+    tokens_since_checkpoint = 0
+
+    # Site-only questions with no documents and no history have a prompt that depends on
+    # nothing but the question, so identical ones in flight together share one upstream stream.
+    estimated_tokens = prompt_report["total"] + ANSWER_TOKENS_ESTIMATE
+    if cacheable:
+        tokens = single_flight.answers.stream(
+            single_flight.make_key(question, manual_text), lambda: _model_tokens(messages, estimated_tokens)
         )
+    else:
+        tokens = _model_tokens(messages, estimated_tokens)
 
-        for chunk in response:
-            if chunk.choices and chunk.choices[0].delta.content:
-                token = chunk.choices[0].delta.content
-                full_response += token
-                yield token
+    try:
+        async for token in tokens:
+            if not full_response:
+                _record_ttft(started_at, conv.id, "model")
+                first_token_at = time.perf_counter()
+                if title_pending:
+                    title_pending = False
+                    _spawn(_title_conversation(conv.id, question, provisional_title))
+            full_response += token
+            tokens_since_checkpoint += 1
+            yield token
+
+            if tokens_since_checkpoint >= STREAM_CHECKPOINT_TOKENS:
+                # a dropped client (or a crashed worker) still leaves the partial answer in the DB
+                assistant_msg.text = full_response
+                await db.commit()
+                tokens_since_checkpoint = 0
+
+        if full_response:
+            metrics.stream_seconds.observe(time.perf_counter() - first_token_at)
 
         # ----------- Finalize message
         if "NOT_FOUND" in full_response:
-            crud.add_unanswered(db, question)
+            metrics.answers.inc(outcome="not_found")
+            await crud.add_unanswered(db, question)
             full_response += "\n\n(ملاحظة: عذراً، لم أجد هذه التفاصيل، يرجى التواصل مع الدعم)."
+        elif cacheable and full_response:
+            answer_cache.store(question, full_response, question_vector)
+        if "NOT_FOUND" not in full_response:
+            metrics.answers.inc(outcome="model")
 
         assistant_msg.text = full_response
-        db.commit()
+        await db.commit()
+        # fold older turns into the running summary off the request path
+        _spawn(summarize_conversation(conv.id))
+
+    except upstream.Saturated:
+        # shed by the upstream scheduler: stream_relay tells the client to retry shortly
+        metrics.answers.inc(outcome="shed")
+        assistant_msg.text = full_response or upstream.BUSY_MESSAGE
+        await db.commit()
+        raise
 
     except Exception as e:
         print(f"Error in AI Response: {e}")
+        metrics.answers.inc(outcome="error")
         assistant_msg.text = "عذراً، حدث خطأ أثناء الاتصال بالذكاء الاصطناعي."
-        db.commit()
+        await db.commit()
         yield assistant_msg.text
 
+    finally:
+        if title_pending:
+            _spawn(_title_conversation(conv.id, question, provisional_title))
+
+
+async def answer_in_background(question: str, conv, **kwargs):
+    """get_ai_answer on its own session, for stream_relay: it may outlive the HTTP request."""
+    async with AsyncSessionLocal() as db:
+        async for token in get_ai_answer(db, question, conv, **kwargs):
+            yield token
 
 #-------------------------------------------------------------------------------------------
+# Rolling conversation memory. Once the turns after the summary boundary exceed
+# SUMMARY_TRIGGER_TOKENS, all but the last SUMMARY_KEEP_MESSAGES are folded into
+# Conversation.summary, so the prompt carries summary + recent turns at any length.
 
-def generate_chat_title(first_question: str):
-    prompt = f"صغ عنواناً جذاباً وقصيراً جداً (3 كلمات) لهذا السؤال: {first_question}"
+SUMMARY_TRIGGER_TOKENS = int(os.getenv("SUMMARY_TRIGGER_TOKENS", "1500"))
+SUMMARY_KEEP_MESSAGES = int(os.getenv("SUMMARY_KEEP_MESSAGES", "4"))
+SUMMARY_MAX_TOKENS = int(os.getenv("SUMMARY_MAX_TOKENS", "400"))
+SUMMARY_FOLD_MAX_MESSAGES = int(os.getenv("SUMMARY_FOLD_MAX_MESSAGES", "40"))
+
+_summarizing = set()
+
+
+async def summarize_conversation(conv_id: int):
+    if conv_id in _summarizing:
+        return
+    _summarizing.add(conv_id)
     try:
-        response = client.chat.completions.create(
+        async with AsyncSessionLocal() as session:
+            conv = await session.get(Conversation, conv_id)
+            if conv is None:
+                return
+            boundary = conv.summary_until_id or 0
+            result = await session.execute(
+                select(Message)
+                .where(Message.conversation_id == conv_id, Message.id > boundary)
+                .order_by(Message.id)
+            )
+            pending = [m for m in result.scalars().all() if m.text]
+            if len(pending) <= SUMMARY_KEEP_MESSAGES:
+                return
+            if sum(count_tokens(m.text) for m in pending) < SUMMARY_TRIGGER_TOKENS:
+                return
+
+            # long pre-existing chats are caught up over several turns
+            folded = pending[:-SUMMARY_KEEP_MESSAGES][:SUMMARY_FOLD_MAX_MESSAGES]
+            summary = await _fold_summary(conv.summary, folded)
+            # another worker may have moved the boundary meanwhile; only the first write wins
+            await session.execute(
+                update(Conversation)
+                .where(Conversation.id == conv_id, Conversation.summary_until_id == conv.summary_until_id)
+                .values(summary=summary, summary_until_id=folded[-1].id)
+            )
+            await session.commit()
+    except Exception as e:
+        print(f"Summary update failed for conversation {conv_id}: {e}")
+    finally:
+        _summarizing.discard(conv_id)
+
+
+async def _fold_summary(previous: str, messages):
+    roles = {"user": "المستخدم", "assistant": "المساعد"}
+    transcript = "\n".join(f"{roles.get(m.role, m.role)}: {m.text}" for m in messages)
+    prompt = f"""حدّث ملخص محادثة بين مستخدم ومساعد عقاري بإضافة الرسائل الجديدة إليه.
+احتفظ بكل ما يلزم لمتابعة المحادثة: العقارات المذكورة، المواقع، المساحات، الأسعار، الأطراف،
+ما تم الاتفاق عليه، والأسئلة التي لم تُحسم بعد. اكتب الملخص بالعربية وبإيجاز.
+
+[الملخص السابق]:
+{previous or "لا يوجد"}
+
+[الرسائل الجديدة]:
+{transcript}"""
+    response = await upstream.call(upstream.BACKGROUND, upstream.estimate_tokens(prompt) + SUMMARY_MAX_TOKENS,
+        lambda: _openai().chat.completions.create(
             model="gpt-4o-mini",
             messages=[{"role": "user", "content": prompt}],
-            max_tokens=20
-        )
+            max_tokens=SUMMARY_MAX_TOKENS,
+            temperature=0
+        ))
+    _count_usage(response)
+    return response.choices[0].message.content.strip()
+
+#-------------------------------------------------------------------------------------------
+
+async def generate_chat_title(first_question: str):
+    prompt = f"صغ عنواناً جذاباً وقصيراً جداً (3 كلمات) لهذا السؤال: {first_question}"
+    async def title():
+        response = await upstream.call(upstream.BACKGROUND, upstream.estimate_tokens(prompt) + 20,
+            lambda: _openai().chat.completions.create(
+                model="gpt-4o-mini",
+                messages=[{"role": "user", "content": prompt}],
+                max_tokens=20
+            ))
+        _count_usage(response)
         return response.choices[0].message.content.strip()
+
+    try:
+        return await single_flight.titles.call(single_flight.make_key(first_question), title)
     except:
         return first_question[:30]
     
-#-------------------------------------------------------------------------------------------
-    
-async def process_file_task(doc_id: int, file_path: str, filename: str, conv_id: int):
-    from database import SessionLocal 
-    import database 
-    db = SessionLocal()
-    try:
-        with open(file_path, "rb") as f:
-            content = f.read()
-
-        if filename.lower().endswith(('.jpg', '.jpeg', '.png')):
-            text = await extract_text_from_image(content)
-        else:
-            text = extract_text_general(content, filename)
-        
-        if text:
-            doc = db.query(database.DocumentKnowledge).filter(database.DocumentKnowledge.id == doc_id).first()
-            if doc:
-                doc.content = text
-                db.commit()
-    except Exception as e:
-        print(f"Error in background task: {e}")
-    finally:
-        db.close()
\ No newline at end of file
@@ -0,0 +1,115 @@
+"""
+Single-flight coalescing of identical concurrent upstream calls.
+
+While a call for a key is in flight, later callers with the same key wait for it instead
+of making their own request: `call` shares one awaited result, `stream` shares one token
+stream and fans every token out to all subscribers (late joiners first get the tokens
+already produced). Keys are only coalesced while in flight; completed results are the
+answer cache's job. Counters report how many upstream calls were saved.
+"""
+import asyncio
+import hashlib
+import json
+
+from embedding_cache import normalize_text
+
+
+def make_key(*parts):
+    raw = json.dumps([normalize_text(p) if isinstance(p, str) else p for p in parts], ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class _SharedStream:
+
+    def __init__(self):
+        self.tokens = []
+        self.done = False
+        self.error = None
+        self.changed = asyncio.Condition()
+
+    async def publish(self, token=None, done=False, error=None):
+        if token is not None:
+            self.tokens.append(token)
+        if done:
+            self.done, self.error = True, error
+        async with self.changed:
+            self.changed.notify_all()
+
+
+class SingleFlight:
+
+    def __init__(self, name: str):
+        self.name = name
+        self._calls = {}
+        self._streams = {}
+        self._tasks = set()
+        self.requests = 0
+        self.upstream = 0
+
+    # -------- awaited results (classification, titles)
+
+    async def call(self, key: str, factory):
+        self.requests += 1
+        future = self._calls.get(key)
+        if future is None:
+            self.upstream += 1
+            future = asyncio.ensure_future(factory())
+            self._calls[key] = future
+            future.add_done_callback(lambda _: self._calls.pop(key, None))
+        # shield: one caller being cancelled must not cancel the shared call
+        return await asyncio.shield(future)
+
+    # -------- token streams (chat answers)
+
+    async def stream(self, key: str, factory):
+        self.requests += 1
+        shared = self._streams.get(key)
+        if shared is None:
+            self.upstream += 1
+            shared = _SharedStream()
+            self._streams[key] = shared
+            task = asyncio.create_task(self._pump(key, shared, factory))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+        index = 0
+        while True:
+            while index < len(shared.tokens):
+                yield shared.tokens[index]
+                index += 1
+            if shared.done:
+                if shared.error is not None:
+                    raise shared.error
+                return
+            async with shared.changed:
+                if index >= len(shared.tokens) and not shared.done:
+                    await shared.changed.wait()
+
+    async def _pump(self, key, shared, factory):
+        # runs on its own so a subscriber that goes away does not cut the stream for the others
+        try:
+            async for token in factory():
+                await shared.publish(token)
+            await shared.publish(done=True)
+        except Exception as e:
+            await shared.publish(done=True, error=e)
+        finally:
+            if self._streams.get(key) is shared:
+                del self._streams[key]
+
+    def stats(self):
+        return {
+            "requests": self.requests,
+            "upstream_calls": self.upstream,
+            "saved_calls": self.requests - self.upstream,
+            "in_flight": len(self._calls) + len(self._streams),
+        }
+
+
+answers = SingleFlight("answers")
+intents = SingleFlight("intents")
+titles = SingleFlight("titles")
+
+
+def stats():
+    return {flight.name: flight.stats() for flight in (answers, intents, titles)}
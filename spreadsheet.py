@@ -0,0 +1,294 @@
+"""
+Streaming spreadsheet ingestion (.xlsx/.xlsm via openpyxl read-only mode, .csv via the csv module).
+
+Rows are read one at a time over every sheet, so a listing export with tens of thousands
+of rows never exists as a DataFrame or as one padded string. Two things come out:
+
+- row-group chunks ("<column>: <value> | ..." per row, headed by the sheet and row range)
+  that are indexed for retrieval, each readable without the header row;
+- a compact columnar summary (rows per sheet, column types, min/max of numeric and date
+  columns, price/area ranges called out, the values of low-cardinality columns) that is
+  stored as the document text and goes into the prompt instead of the rows.
+
+Legacy .xls cannot be streamed (openpyxl does not read BIFF); it is loaded with pandas
+and then goes through the same pipeline.
+"""
+import csv
+import os
+import queue
+from datetime import date, datetime, time as dt_time
+
+EXTENSIONS = ('.xlsx', '.xlsm', '.xls', '.csv')
+
+SPREADSHEET_CHUNK_ROWS = int(os.getenv("SPREADSHEET_CHUNK_ROWS", "20"))
+SPREADSHEET_CHUNK_MAX_CHARS = int(os.getenv("SPREADSHEET_CHUNK_MAX_CHARS", "1500"))
+# columns with at most this many distinct values are listed in the summary (e.g. neighbourhood)
+SPREADSHEET_DISTINCT_LIMIT = int(os.getenv("SPREADSHEET_DISTINCT_LIMIT", "15"))
+_CELL_MAX_CHARS = 200
+
+_PRICE_WORDS = ("سعر", "السعر", "الثمن", "ثمن", "القيمة", "price", "cost", "rent", "إيجار", "الإيجار")
+_AREA_WORDS = ("مساحة", "المساحة", "area", "size", "sqm", "m2", "م2", "متر")
+
+_TYPE_NAMES = {"number": "رقم", "date": "تاريخ", "text": "نص"}
+
+
+def is_spreadsheet(filename: str):
+    return (filename or "").lower().endswith(EXTENSIONS)
+
+
+def _number(value):
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return value
+    if isinstance(value, str) and len(value) <= 30:
+        try:
+            return float(value.replace(",", "").replace("٬", "").strip())
+        except ValueError:
+            return None
+    return None
+
+
+def _cell_text(value):
+    if value is None:
+        return ""
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    if isinstance(value, datetime):
+        return value.date().isoformat() if value.time() == dt_time() else value.isoformat(sep=" ")
+    if isinstance(value, date):
+        return value.isoformat()
+    text = " ".join(str(value).split())
+    return text[:_CELL_MAX_CHARS]
+
+
+def _format_number(value):
+    return f"{int(value):,}" if float(value).is_integer() else f"{value:,.2f}"
+
+
+class ColumnStats:
+    __slots__ = ("name", "filled", "types", "low", "high", "distinct", "role")
+
+    def __init__(self, name: str):
+        self.name = name
+        self.filled = 0
+        self.types = {}
+        self.low = self.high = None
+        self.distinct = set()   # dropped to None once past SPREADSHEET_DISTINCT_LIMIT
+        lowered = name.lower()
+        self.role = ("price" if any(w in lowered for w in _PRICE_WORDS)
+                     else "area" if any(w in lowered for w in _AREA_WORDS) else None)
+
+    def add(self, value, text: str):
+        self.filled += 1
+        number = _number(value)
+        if number is not None:
+            kind, key = "number", number
+        elif isinstance(value, (datetime, date)):
+            kind, key = "date", value if isinstance(value, datetime) else datetime.combine(value, dt_time())
+        else:
+            kind, key = "text", None
+        self.types[kind] = self.types.get(kind, 0) + 1
+        if key is not None:
+            # a column mixing numbers and dates keeps the range of whichever came first
+            try:
+                self.low = key if self.low is None or key < self.low else self.low
+                self.high = key if self.high is None or key > self.high else self.high
+            except TypeError:
+                pass
+        if self.distinct is not None:
+            self.distinct.add(text)
+            if len(self.distinct) > SPREADSHEET_DISTINCT_LIMIT:
+                self.distinct = None
+
+    def kind(self):
+        return max(self.types, key=self.types.get) if self.types else "text"
+
+    def describe(self):
+        kind = self.kind()
+        line = f"- {self.name} ({_TYPE_NAMES[kind]}، {self.filled} قيمة)"
+        if kind in ("number", "date") and self.low is not None:
+            fmt = _format_number if kind == "number" else _cell_text
+            line += f": الأدنى {fmt(self.low)}، الأعلى {fmt(self.high)}"
+        elif self.distinct:
+            line += ": " + "، ".join(sorted(self.distinct))
+        return line
+
+
+class SheetStats:
+
+    def __init__(self, name: str):
+        self.name = name
+        self.rows = 0
+        self.columns = []
+
+    def column(self, index: int, headers):
+        while len(self.columns) <= index:
+            self.columns.append(ColumnStats(headers[len(self.columns)]))
+        return self.columns[index]
+
+
+def _headers(row):
+    names, seen = [], {}
+    for i, value in enumerate(row):
+        name = _cell_text(value) or f"عمود {i + 1}"
+        if name in seen:
+            seen[name] += 1
+            name = f"{name} ({seen[name]})"
+        else:
+            seen[name] = 1
+        names.append(name)
+    return names
+
+#-------------------------------------------------------------------------------------------
+# Row sources: yield (sheet name, iterator of row tuples)
+
+def _xlsx_sheets(source):
+    from openpyxl import load_workbook
+    # read_only streams the sheet XML; data_only gives cached formula results instead of formulas
+    workbook = load_workbook(source, read_only=True, data_only=True)
+    try:
+        for sheet in workbook.worksheets:
+            yield sheet.title, sheet.iter_rows(values_only=True)
+    finally:
+        workbook.close()
+
+
+def _csv_sheets(source, filename):
+    name = os.path.splitext(os.path.basename(filename))[0]
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, encoding="utf-8-sig", errors="replace", newline="") as f:
+            yield name, csv.reader(f)
+    else:
+        import io
+        yield name, csv.reader(io.TextIOWrapper(source, encoding="utf-8-sig", errors="replace", newline=""))
+
+
+def _xls_sheets(source):
+    import pandas as pd
+    frames = pd.read_excel(source, sheet_name=None, header=None)
+    for name, df in frames.items():
+        yield str(name), (tuple(None if pd.isna(v) else v for v in row)
+                          for row in df.itertuples(index=False, name=None))
+
+
+def _sheets(source, filename):
+    name = filename.lower()
+    if name.endswith(".csv"):
+        return _csv_sheets(source, filename)
+    if name.endswith(".xls"):
+        return _xls_sheets(source)
+    return _xlsx_sheets(source)
+
+#-------------------------------------------------------------------------------------------
+
+class SpreadsheetReader:
+    """
+    reader = SpreadsheetReader(path_or_fileobj, filename)
+    for chunk in reader.chunks(): ...   # row groups, streamed
+    reader.summary()                    # after chunks() is exhausted
+    """
+
+    def __init__(self, source, filename: str):
+        self.source = source
+        self.filename = filename
+        self.sheets = []
+
+    def chunks(self):
+        for sheet_name, rows in _sheets(self.source, self.filename):
+            stats = SheetStats(sheet_name)
+            self.sheets.append(stats)
+            yield from self._sheet_chunks(stats, rows)
+
+    def _sheet_chunks(self, stats: SheetStats, rows):
+        headers = None
+        group, group_chars, first_row = [], 0, 0
+
+        def emit():
+            title = f"[{self.filename} | الورقة: {stats.name} | الصفوف {first_row}-{stats.rows}]"
+            return title + "\n" + "\n".join(group)
+
+        for row in rows:
+            texts = [_cell_text(v) for v in row]
+            if not any(texts):
+                continue
+            if headers is None:
+                # the first non-empty row names the columns
+                headers = _headers(row)
+                continue
+            while len(headers) < len(texts):
+                headers.append(f"عمود {len(headers) + 1}")
+
+            parts = []
+            for i, (value, text) in enumerate(zip(row, texts)):
+                if text:
+                    stats.column(i, headers).add(value, text)
+                    parts.append(f"{headers[i]}: {text}")
+            line = " | ".join(parts)
+
+            if group and (len(group) >= SPREADSHEET_CHUNK_ROWS or group_chars + len(line) > SPREADSHEET_CHUNK_MAX_CHARS):
+                yield emit()
+                group, group_chars = [], 0
+            stats.rows += 1
+            if not group:
+                first_row = stats.rows
+            group.append(line)
+            group_chars += len(line)
+
+        if headers is not None:
+            stats.column(len(headers) - 1, headers)
+        if group:
+            yield emit()
+
+    def summary(self):
+        lines = [f"ملخص جدول البيانات ({self.filename}):"]
+        for stats in self.sheets:
+            if not stats.rows:
+                continue
+            lines.append(f"الورقة \"{stats.name}\": {stats.rows} صفاً، {len(stats.columns)} عموداً.")
+            for label, role in (("نطاق السعر", "price"), ("نطاق المساحة", "area")):
+                for col in stats.columns:
+                    if col.role == role and col.kind() == "number" and col.low is not None:
+                        lines.append(f"{label} ({col.name}): من {_format_number(col.low)} إلى {_format_number(col.high)}")
+            lines.append("الأعمدة:")
+            lines.extend(col.describe() for col in stats.columns if col.filled)
+        if len(lines) == 1:
+            lines.append("لا توجد صفوف بيانات.")
+        else:
+            lines.append("(تفاصيل الصفوف متاحة كمقتطفات من الجدول عند الحاجة.)")
+        return "\n".join(lines)
+
+
+def batches(chunks, size: int):
+    """Groups the chunk stream into lists of `size`, so only one batch is held at a time."""
+    batch = []
+    for chunk in chunks:
+        batch.append(chunk)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _put(out, item, stop):
+    # the queue is bounded, so a slow indexer holds the reader back; stop ends the wait
+    while not stop.is_set():
+        try:
+            out.put(item, timeout=1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def read_batches(source, filename: str, size: int, out, stop):
+    """
+    Process-pool entry point: reads the sheet and puts ("rows", batch) for every `size` row
+    groups, then ("summary", text), on out (a managed queue). Returns early once stop is set.
+    """
+    reader = SpreadsheetReader(source, filename)
+    for batch in batches(reader.chunks(), size):
+        if not _put(out, ("rows", batch), stop):
+            return
+    _put(out, ("summary", reader.summary()), stop)
@@ -0,0 +1,146 @@
+"""
+Resumable Server-Sent-Events streams for chat answers.
+
+The answer is produced by a background task that writes tokens into a per-stream buffer;
+HTTP responses only read from it. A client that drops keeps the generation running, and
+can reconnect with `Last-Event-ID: <stream id>:<seq>` to receive the events it missed
+without a new model call. Finished streams stay readable for STREAM_TTL_SECONDS.
+
+Buffers live in process memory, so a resume has to reach the same worker (sticky
+sessions); otherwise the client falls back to the checkpointed message text in the DB.
+"""
+import asyncio
+import json
+import os
+import time
+import uuid
+from collections import deque
+
+import upstream
+
+STREAM_BUFFER_EVENTS = int(os.getenv("STREAM_BUFFER_EVENTS", "4096"))
+STREAM_TTL_SECONDS = int(os.getenv("STREAM_TTL_SECONDS", "300"))
+STREAM_HEARTBEAT_SECONDS = float(os.getenv("STREAM_HEARTBEAT_SECONDS", "15"))
+
+SSE_HEADERS = {
+    "X-Accel-Buffering": "no",
+    "Cache-Control": "no-cache",
+    "Connection": "keep-alive",
+}
+
+
+def sse_event(data: str, event: str = None, event_id: str = None):
+    lines = []
+    if event_id:
+        lines.append(f"id: {event_id}")
+    if event:
+        lines.append(f"event: {event}")
+    # multi-line payloads become several data: lines, which the client joins with "\n"
+    lines.extend(f"data: {line}" for line in data.split("\n"))
+    return "\n".join(lines) + "\n\n"
+
+
+class AnswerStream:
+
+    def __init__(self):
+        self.id = uuid.uuid4().hex
+        self.events = deque(maxlen=STREAM_BUFFER_EVENTS)   # (seq, event, data)
+        self.text = ""
+        self.last_seq = 0
+        self.done = False
+        self.finished_at = None
+        self._changed = asyncio.Condition()
+        self._task = None
+
+    async def push(self, data: str, event: str = "token"):
+        self.last_seq += 1
+        self.events.append((self.last_seq, event, data))
+        if event == "token":
+            self.text += data
+        async with self._changed:
+            self._changed.notify_all()
+
+    async def finish(self):
+        self.done = True
+        self.finished_at = time.monotonic()
+        async with self._changed:
+            self._changed.notify_all()
+
+    def _since(self, seq: int):
+        return [e for e in self.events if e[0] > seq]
+
+    async def read(self, after: int = 0):
+        """SSE frames for every event after seq `after`, then live ones until the stream ends."""
+        oldest = self.events[0][0] if self.events else self.last_seq + 1
+        if after + 1 < oldest:
+            # the ring buffer has moved past the client's position: resend the text as one snapshot
+            yield sse_event(self.text, "snapshot", f"{self.id}:{self.last_seq}")
+            after = self.last_seq
+
+        while True:
+            for seq, event, data in self._since(after):
+                yield sse_event(data, event, f"{self.id}:{seq}")
+                after = seq
+            if self.done and after >= self.last_seq:
+                return
+            async with self._changed:
+                if after >= self.last_seq and not self.done:
+                    try:
+                        await asyncio.wait_for(self._changed.wait(), STREAM_HEARTBEAT_SECONDS)
+                    except asyncio.TimeoutError:
+                        pass
+            if after >= self.last_seq and not self.done:
+                yield ": ping\n\n"
+
+#-------------------------------------------------------------------------------------------
+
+_streams = {}
+
+
+def _evict():
+    now = time.monotonic()
+    for stream_id in [k for k, s in _streams.items() if s.done and now - s.finished_at > STREAM_TTL_SECONDS]:
+        del _streams[stream_id]
+
+
+def start(tokens):
+    """Runs the async token iterator in the background and returns its AnswerStream."""
+    _evict()
+    stream = AnswerStream()
+
+    async def produce():
+        try:
+            async for token in tokens:
+                await stream.push(token)
+            await stream.push("", "done")
+        except upstream.Saturated as e:
+            # a distinct event so clients can show "busy" and offer a retry after e.retry_after seconds
+            await stream.push(json.dumps({"message": upstream.BUSY_MESSAGE, "retry_after": e.retry_after},
+                                         ensure_ascii=False), "busy")
+        except Exception as e:
+            print(f"Answer stream {stream.id} failed: {e}")
+            await stream.push("عذراً، حدث خطأ أثناء إنشاء الإجابة.", "error")
+        finally:
+            await stream.finish()
+
+    stream._task = asyncio.create_task(produce())
+    _streams[stream.id] = stream
+    return stream
+
+
+def parse_event_id(last_event_id: str):
+    """'<stream id>:<seq>' -> (stream, seq); stream is None when unknown or expired."""
+    _evict()
+    try:
+        stream_id, seq = last_event_id.rsplit(":", 1)
+        return _streams.get(stream_id), int(seq)
+    except (AttributeError, ValueError):
+        return None, 0
+
+
+def stats():
+    return {
+        "streams": len(_streams),
+        "active": sum(1 for s in _streams.values() if not s.done),
+        "buffered_events": sum(len(s.events) for s in _streams.values()),
+    }
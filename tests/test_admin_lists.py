@@ -0,0 +1,48 @@
+import os
+import tempfile
+
+# database.py reads the URL at import time
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'test.db')}"
+os.environ.setdefault("OPENAI_API_KEY", "test")
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+import database
+import migrations
+from models import Conversation
+from routers import admin
+
+
+@pytest.fixture(scope="module")
+def client():
+    migrations.run_migrations(database.engine)
+    with database.SessionLocal() as db:
+        conv = Conversation(title="test")
+        db.add(conv)
+        db.commit()
+        conv_id = conv.id
+    app = FastAPI()
+    app.include_router(admin.router)
+    with TestClient(app) as c:
+        c.conv_id = conv_id
+        yield c
+
+
+def test_list_knowledge_without_params(client):
+    response = client.get("/admin/knowledge/")
+    assert response.status_code == 200
+    assert response.json()["items"] == []
+
+
+def test_list_unanswered_without_params(client):
+    response = client.get("/admin/unanswered/")
+    assert response.status_code == 200
+    assert response.json()["items"] == []
+
+
+def test_list_conversation_documents_without_params(client):
+    response = client.get(f"/admin/conversations/{client.conv_id}/documents")
+    assert response.status_code == 200
+    assert response.json()["items"] == []
@@ -0,0 +1,26 @@
+import re
+import unicodedata
+
+# harakat, tanween, shadda, sukun, superscript alef, Quranic marks, tatweel
+_DIACRITICS_RE = re.compile(r"[\u0610-\u061A\u064B-\u065F\u0670\u06D6-\u06ED\u0640]")
+
+_FOLD = str.maketrans({
+    "أ": "ا", "إ": "ا", "آ": "ا", "ٱ": "ا",
+    "ة": "ه",
+    "ى": "ي", "ئ": "ي",
+    "ؤ": "و",
+    "ء": "",
+})
+
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def normalize_arabic(text: str):
+    """Folds alef/hamza/ta-marbuta/alef-maqsura variants, strips diacritics, lowercases Latin."""
+    text = unicodedata.normalize("NFKC", text or "")
+    text = _DIACRITICS_RE.sub("", text)
+    return text.translate(_FOLD).lower()
+
+
+def search_terms(text: str):
+    return _WORD_RE.findall(normalize_arabic(text))
@@ -0,0 +1,110 @@
+"""
+Content-addressed upload store: every file is kept once under its SHA-256, with a reference
+count per DocumentKnowledge row that points at it, and the text extracted from it cached on
+the same row so a repeat upload skips OCR/parsing entirely.
+"""
+import hashlib
+import os
+import tempfile
+
+from sqlalchemy import delete, select, update
+from sqlalchemy.exc import IntegrityError
+
+from models import StoredFile
+
+UPLOAD_DIR = "static/uploads"
+_CHUNK = 1024 * 1024
+
+
+def _stored_path(sha256: str, filename: str):
+    ext = os.path.splitext(filename)[1].lower()
+    return os.path.join(UPLOAD_DIR, sha256[:2], f"{sha256}{ext}").replace(os.sep, "/")
+
+
+def save_upload(db, fileobj, filename: str):
+    """Streams fileobj to disk while hashing it and takes a reference. Returns the StoredFile row."""
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
+    digest = hashlib.sha256()
+    size = 0
+    fd, tmp_path = tempfile.mkstemp(dir=UPLOAD_DIR, suffix=".part")
+    try:
+        with os.fdopen(fd, "wb") as out:
+            while True:
+                block = fileobj.read(_CHUNK)
+                if not block:
+                    break
+                digest.update(block)
+                out.write(block)
+                size += len(block)
+
+        sha256 = digest.hexdigest()
+        path = _stored_path(sha256, filename)
+        # take the reference first, then make sure the file is there: a concurrent discard()
+        # that already decided to delete it either sees this reference or runs before the check
+        stored = _acquire(db, sha256, path, size)
+        if os.path.exists(stored.path):
+            os.remove(tmp_path)
+        else:
+            os.makedirs(os.path.dirname(stored.path), exist_ok=True)
+            os.replace(tmp_path, stored.path)
+        return stored
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def _acquire(db, sha256: str, path: str, size: int):
+    bumped = db.execute(
+        update(StoredFile).where(StoredFile.sha256 == sha256).values(ref_count=StoredFile.ref_count + 1)
+    )
+    if not bumped.rowcount:
+        try:
+            db.add(StoredFile(sha256=sha256, path=path, size=size, ref_count=1))
+            db.flush()
+        except IntegrityError:
+            # another request stored the same file first
+            db.rollback()
+            db.execute(
+                update(StoredFile).where(StoredFile.sha256 == sha256).values(ref_count=StoredFile.ref_count + 1)
+            )
+    db.commit()
+    return db.get(StoredFile, sha256)
+
+
+def release(db, sha256: str):
+    """
+    Drops one reference and deletes the row once the count reaches zero, in the caller's
+    transaction. Returns the file path to pass to discard() AFTER the caller commits, or None.
+    """
+    path = db.scalar(select(StoredFile.path).where(StoredFile.sha256 == sha256))
+    db.execute(
+        update(StoredFile).where(StoredFile.sha256 == sha256).values(ref_count=StoredFile.ref_count - 1)
+    )
+    # re-checked by the statement itself, so a reference taken meanwhile keeps the row
+    gone = db.execute(delete(StoredFile).where(StoredFile.sha256 == sha256, StoredFile.ref_count <= 0))
+    return path if gone.rowcount else None
+
+
+def discard(db, sha256: str, path: str):
+    """Removes an unreferenced file. Call only after the release() transaction committed."""
+    if not path or not os.path.exists(path):
+        return
+    tombstone = f"{path}.deleting"
+    try:
+        # move it aside first: a save_upload racing with us re-creates it from its own copy
+        os.replace(path, tombstone)
+        if db.scalar(select(StoredFile.sha256).where(StoredFile.sha256 == sha256)) is not None:
+            # uploaded again between the commit and now
+            if not os.path.exists(path):
+                os.replace(tombstone, path)
+            else:
+                os.remove(tombstone)
+            return
+        os.remove(tombstone)
+    except OSError as e:
+        print(f"فشل حذف الملف {path}: {e}")
+
+
+def remember_text(db, sha256: str, text: str):
+    db.execute(update(StoredFile).where(StoredFile.sha256 == sha256).values(extracted_text=text))
@@ -0,0 +1,360 @@
+"""
+Admission control for every call to the model API (chat, embeddings, titles, summaries).
+
+One scheduler per process enforces a global concurrency limit and a tokens-per-minute
+budget (token bucket). A streamed answer holds its admission only until the stream is open
+(the request phase that upstream rate-limits); open streams are counted but not capped. Waiting calls are admitted strictly by priority class, so
+interactive answers go first, upload embeddings next and titles / summaries last. A 429
+from upstream pauses all admissions (Retry-After or exponential backoff). When a class's
+queue is full, or a call waits longer than its class allows, the call is shed with
+`Saturated`, which callers turn into a "busy, retry shortly" status instead of piling up.
+
+Works from the event loop (`slot`, `call`) and from worker threads (`run_sync`, used by the
+embedding function), since embeddings are computed in threads.
+"""
+import asyncio
+import contextvars
+import heapq
+import itertools
+import os
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+
+import metrics
+
+INTERACTIVE, EMBEDDING, BACKGROUND = 0, 1, 2
+PRIORITY_NAMES = {INTERACTIVE: "interactive", EMBEDDING: "embedding", BACKGROUND: "background"}
+
+UPSTREAM_MAX_CONCURRENCY = int(os.getenv("UPSTREAM_MAX_CONCURRENCY", "64"))
+UPSTREAM_TPM = int(os.getenv("UPSTREAM_TPM", "0"))   # 0 = no token budget
+UPSTREAM_MAX_WAIT = {
+    INTERACTIVE: float(os.getenv("UPSTREAM_MAX_WAIT_INTERACTIVE", "15")),
+    EMBEDDING: float(os.getenv("UPSTREAM_MAX_WAIT_EMBEDDING", "120")),
+    BACKGROUND: float(os.getenv("UPSTREAM_MAX_WAIT_BACKGROUND", "300")),
+}
+UPSTREAM_QUEUE_LIMIT = {
+    INTERACTIVE: int(os.getenv("UPSTREAM_QUEUE_LIMIT_INTERACTIVE", "1000")),
+    EMBEDDING: int(os.getenv("UPSTREAM_QUEUE_LIMIT_EMBEDDING", "2000")),
+    BACKGROUND: int(os.getenv("UPSTREAM_QUEUE_LIMIT_BACKGROUND", "500")),
+}
+UPSTREAM_RATE_LIMIT_RETRIES = int(os.getenv("UPSTREAM_RATE_LIMIT_RETRIES", "3"))
+_BACKOFF_BASE, _BACKOFF_MAX = 1.0, 30.0
+_POLL = 0.25
+
+# priority for calls that do not pass one explicitly (the shared embedding function);
+# get_ai_answer sets INTERACTIVE for its own request, asyncio.to_thread carries it over
+priority = contextvars.ContextVar("upstream_priority", default=EMBEDDING)
+
+
+class Saturated(Exception):
+    def __init__(self, priority_class: int, retry_after: float):
+        super().__init__(f"upstream saturated ({PRIORITY_NAMES[priority_class]})")
+        self.priority = priority_class
+        self.retry_after = retry_after
+
+
+def is_rate_limit(error: Exception):
+    return getattr(error, "status_code", None) == 429 or type(error).__name__ == "RateLimitError"
+
+
+def _retry_after(error: Exception):
+    response = getattr(error, "response", None)
+    try:
+        return float(response.headers.get("retry-after"))
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+
+class Ticket:
+    __slots__ = ("priority", "tokens", "seq", "granted", "cancelled", "signal", "enqueued", "actual_tokens")
+
+    def __init__(self, priority_class, tokens, seq, signal):
+        self.priority, self.tokens, self.seq, self.signal = priority_class, tokens, seq, signal
+        self.granted = self.cancelled = False
+        self.enqueued = time.monotonic()
+        self.actual_tokens = None
+
+    def __lt__(self, other):
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class Scheduler:
+
+    def __init__(self, max_concurrency=UPSTREAM_MAX_CONCURRENCY, tpm=UPSTREAM_TPM):
+        self.max_concurrency = max_concurrency
+        self.tpm = tpm
+        self._lock = threading.Lock()
+        self._heap = []
+        self._seq = itertools.count()
+        self._in_flight = 0
+        self._open_streams = 0
+        self._bucket = float(tpm)
+        self._refilled = time.monotonic()
+        self._backoff_until = 0.0
+        self._consecutive_429 = 0
+        self._waits = {p: deque(maxlen=500) for p in PRIORITY_NAMES}
+        self.shed = {p: 0 for p in PRIORITY_NAMES}
+        self.rate_limited = 0
+
+    # -------- core (call with the lock held)
+
+    def _refill(self, now):
+        if self.tpm:
+            self._bucket = min(self.tpm, self._bucket + (now - self._refilled) * self.tpm / 60)
+        self._refilled = now
+
+    def _grant(self):
+        now = time.monotonic()
+        self._refill(now)
+        while self._heap and self._in_flight < self.max_concurrency and now >= self._backoff_until:
+            head = self._heap[0]
+            if head.cancelled:
+                heapq.heappop(self._heap)
+                continue
+            need = min(head.tokens, self.tpm) if self.tpm else 0
+            if self.tpm and self._bucket < need:
+                break   # strict priority: nothing jumps a head that is waiting for budget
+            heapq.heappop(self._heap)
+            self._bucket -= need
+            self._in_flight += 1
+            head.granted = True
+            wait = now - head.enqueued
+            self._waits[head.priority].append(wait)
+            metrics.upstream_wait_seconds.observe(wait, priority=PRIORITY_NAMES[head.priority])
+            head.signal()
+
+    def _enqueue(self, priority_class, tokens, signal):
+        queued = sum(1 for t in self._heap if t.priority == priority_class and not t.cancelled)
+        if queued >= UPSTREAM_QUEUE_LIMIT[priority_class]:
+            self._shed(priority_class)
+        ticket = Ticket(priority_class, max(0, int(tokens)), next(self._seq), signal)
+        heapq.heappush(self._heap, ticket)
+        self._grant()
+        return ticket
+
+    def _shed(self, priority_class):
+        self.shed[priority_class] += 1
+        metrics.upstream_shed.inc(priority=PRIORITY_NAMES[priority_class])
+        raise Saturated(priority_class, self._suggested_retry())
+
+    def _suggested_retry(self):
+        return max(1.0, round(self._backoff_until - time.monotonic(), 1))
+
+    def _timed_out(self, ticket):
+        with self._lock:
+            if ticket.granted:
+                return False
+            ticket.cancelled = True
+            self._shed(ticket.priority)
+
+    # -------- acquire / release
+
+    def acquire_sync(self, priority_class, tokens):
+        event = threading.Event()
+        with self._lock:
+            ticket = self._enqueue(priority_class, tokens, event.set)
+        deadline = ticket.enqueued + UPSTREAM_MAX_WAIT[priority_class]
+        while not ticket.granted:
+            if time.monotonic() >= deadline and self._timed_out(ticket) is False:
+                break
+            event.wait(_POLL)
+            with self._lock:
+                self._grant()
+        return ticket
+
+    async def acquire(self, priority_class, tokens):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def signal():
+            loop.call_soon_threadsafe(lambda: future.done() or future.set_result(None))
+
+        with self._lock:
+            ticket = self._enqueue(priority_class, tokens, signal)
+        deadline = ticket.enqueued + UPSTREAM_MAX_WAIT[priority_class]
+        try:
+            while not ticket.granted:
+                if time.monotonic() >= deadline and self._timed_out(ticket) is False:
+                    break
+                try:
+                    await asyncio.wait_for(asyncio.shield(future), _POLL)
+                except asyncio.TimeoutError:
+                    with self._lock:
+                        self._grant()
+        except asyncio.CancelledError:
+            with self._lock:
+                if ticket.granted:
+                    self._release_locked(ticket)
+                else:
+                    ticket.cancelled = True
+            raise
+        return ticket
+
+    def release(self, ticket):
+        with self._lock:
+            self._release_locked(ticket)
+
+    def _release_locked(self, ticket):
+        self._in_flight -= 1
+        if ticket.actual_tokens is not None:
+            self._settle_locked(ticket, ticket.actual_tokens)
+        self._grant()
+
+    def _settle_locked(self, ticket, actual_tokens):
+        # settle the estimate against what upstream actually reported
+        if self.tpm:
+            self._bucket += min(ticket.tokens, self.tpm) - actual_tokens
+
+    def settle(self, ticket, actual_tokens):
+        """For streams, whose usage arrives after the admission was released."""
+        with self._lock:
+            self._settle_locked(ticket, actual_tokens)
+            self._grant()
+
+    def stream_opened(self):
+        with self._lock:
+            self._open_streams += 1
+
+    def stream_closed(self):
+        with self._lock:
+            self._open_streams -= 1
+
+    # -------- upstream feedback
+
+    def rate_limited_by(self, error):
+        with self._lock:
+            self.rate_limited += 1
+            self._consecutive_429 += 1
+            delay = _retry_after(error) or min(_BACKOFF_MAX, _BACKOFF_BASE * 2 ** (self._consecutive_429 - 1))
+            self._backoff_until = max(self._backoff_until, time.monotonic() + delay)
+        metrics.upstream_rate_limited.inc()
+
+    def succeeded(self):
+        if self._consecutive_429:
+            with self._lock:
+                self._consecutive_429 = 0
+
+    def stats(self):
+        with self._lock:
+            self._refill(time.monotonic())
+            queued = {PRIORITY_NAMES[p]: 0 for p in PRIORITY_NAMES}
+            for t in self._heap:
+                if not t.cancelled:
+                    queued[PRIORITY_NAMES[t.priority]] += 1
+            waits = {}
+            for p, samples in self._waits.items():
+                ordered = sorted(samples)
+                waits[PRIORITY_NAMES[p]] = {
+                    "p50_ms": round(ordered[len(ordered) // 2] * 1000, 1) if ordered else None,
+                    "p95_ms": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000, 1) if ordered else None,
+                }
+            return {
+                "in_flight": self._in_flight,
+                "open_streams": self._open_streams,
+                "max_concurrency": self.max_concurrency,
+                "queued": queued,
+                "wait": waits,
+                "tokens_available": round(self._bucket) if self.tpm else None,
+                "tpm": self.tpm or None,
+                "backoff_seconds": max(0.0, round(self._backoff_until - time.monotonic(), 1)),
+                "shed": {PRIORITY_NAMES[p]: n for p, n in self.shed.items()},
+                "rate_limited": self.rate_limited,
+            }
+
+    def saturated(self, priority_class):
+        """Retry-after seconds if a new call of this class would be shed right away, else None."""
+        with self._lock:
+            queued = sum(1 for t in self._heap if t.priority == priority_class and not t.cancelled)
+            if queued >= UPSTREAM_QUEUE_LIMIT[priority_class]:
+                return self._suggested_retry()
+        return None
+
+
+scheduler = Scheduler()
+metrics.upstream_queue.read = lambda: {(k,): v for k, v in scheduler.stats()["queued"].items()}
+metrics.upstream_in_flight.read = lambda: {(): scheduler.stats()["in_flight"]}
+metrics.upstream_open_streams.read = lambda: {(): scheduler.stats()["open_streams"]}
+
+#-------------------------------------------------------------------------------------------
+# Call helpers
+
+BUSY_MESSAGE = "الخدمة مشغولة حالياً بسبب كثرة الطلبات، يرجى المحاولة بعد قليل."
+
+@asynccontextmanager
+async def slot(priority_class: int, tokens: int):
+    """Holds one admission for the whole block (e.g. a streamed answer). Set ticket.actual_tokens if known."""
+    ticket = await scheduler.acquire(priority_class, tokens)
+    try:
+        yield ticket
+    finally:
+        scheduler.release(ticket)
+
+
+async def call(priority_class: int, tokens: int, fn):
+    """Awaits fn() under admission control, retrying after upstream 429s."""
+    for attempt in range(UPSTREAM_RATE_LIMIT_RETRIES + 1):
+        async with slot(priority_class, tokens) as ticket:
+            try:
+                result = await fn()
+            except Exception as e:
+                if not is_rate_limit(e) or attempt == UPSTREAM_RATE_LIMIT_RETRIES:
+                    raise
+                scheduler.rate_limited_by(e)
+                continue
+            scheduler.succeeded()
+            usage = getattr(result, "usage", None)
+            if usage is not None:
+                ticket.actual_tokens = usage.total_tokens
+            return result
+
+
+async def stream(priority_class: int, tokens: int, open_stream):
+    """
+    Yields the chunks of await open_stream(). The admission covers opening the stream only,
+    so long answers do not hold concurrency slots while tokens trickle in.
+    """
+    for attempt in range(UPSTREAM_RATE_LIMIT_RETRIES + 1):
+        async with slot(priority_class, tokens) as ticket:
+            try:
+                response = await open_stream()
+            except Exception as e:
+                if not is_rate_limit(e) or attempt == UPSTREAM_RATE_LIMIT_RETRIES:
+                    raise
+                scheduler.rate_limited_by(e)
+                continue
+        scheduler.succeeded()
+        break
+
+    scheduler.stream_opened()
+    try:
+        async for chunk in response:
+            usage = getattr(chunk, "usage", None)
+            if usage is not None:
+                scheduler.settle(ticket, usage.total_tokens)
+            yield chunk
+    finally:
+        scheduler.stream_closed()
+
+
+def run_sync(priority_class: int, tokens: int, fn):
+    """Blocking variant of call() for worker threads (embeddings)."""
+    for attempt in range(UPSTREAM_RATE_LIMIT_RETRIES + 1):
+        ticket = scheduler.acquire_sync(priority_class, tokens)
+        try:
+            result = fn()
+        except Exception as e:
+            if not is_rate_limit(e) or attempt == UPSTREAM_RATE_LIMIT_RETRIES:
+                raise
+            scheduler.rate_limited_by(e)
+            continue
+        finally:
+            scheduler.release(ticket)
+        scheduler.succeeded()
+        return result
+
+
+def estimate_tokens(*texts):
+    # ~3 characters per token for the Arabic/English mix we send; only used for budgeting
+    return sum(len(t or "") for t in texts) // 3 + 1
@@ -1,42 +1,319 @@
 import uuid
-import chromadb
-from chromadb.utils import embedding_functions
+import time
+import threading
 import os
 
+import upstream
+from embedding_cache import CachedEmbeddingFunction
+from chunker import chunk_text
+from bm25_index import BM25Index, reciprocal_rank_fusion
+
 CHROMA_DATA_PATH = "chroma_data"
-client = chromadb.PersistentClient(path=CHROMA_DATA_PATH)
+EMBEDDING_MODEL = "text-embedding-3-small"
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "128"))
+
+# chromadb (and the OpenAI client inside its embedding function) are heavy to import and the
+# persistent client opens the store on disk, so all of it is created on first use.
+_chroma = {}
+_chroma_lock = threading.Lock()
+
+def _openai_ef():
+    with _chroma_lock:
+        if "ef" not in _chroma:
+            from chromadb.utils import embedding_functions
+            _chroma["ef"] = embedding_functions.OpenAIEmbeddingFunction(
+                api_key=os.getenv("OPENAI_API_KEY"),
+                model_name=EMBEDDING_MODEL
+            )
+        return _chroma["ef"]
+
+def get_collection(collection_type):
+    name = "user_documents" if collection_type == "docs" else "site_knowledge"
+    collection = _chroma.get(name)
+    if collection is not None:
+        return collection
+    ef = _openai_ef()
+    with _chroma_lock:
+        if "client" not in _chroma:
+            import chromadb
+            _chroma["client"] = chromadb.PersistentClient(path=CHROMA_DATA_PATH)
+        if name not in _chroma:
+            # collections keep openai_ef as their configured function; we always pass embeddings
+            _chroma[name] = _chroma["client"].get_or_create_collection(name=name, embedding_function=ef)
+        return _chroma[name]
+
+def warm_up():
+    """Opens the store and both collections now instead of on the first request."""
+    get_collection("site")
+    get_collection("docs")
+
+def _embed_upstream(texts):
+    # cache misses only; uploads run at EMBEDDING priority, a chat request sets INTERACTIVE
+    return upstream.run_sync(upstream.priority.get(), upstream.estimate_tokens(*texts), lambda: _openai_ef()(texts))
+
+# every add/query embeds through the cache; the OpenAI function behind it is built on the first miss
+cached_ef = CachedEmbeddingFunction(_embed_upstream, EMBEDDING_MODEL)
+
+# ----------- Hybrid retrieval settings
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "hybrid")    # hybrid | dense | lexical
+RRF_K = int(os.getenv("RRF_K", "60"))
+# how many candidates each path contributes before fusion, as a multiple of n_results
+CANDIDATE_FACTOR = int(os.getenv("RETRIEVAL_CANDIDATE_FACTOR", "4"))
+RRF_WEIGHTS = {
+    "site": {"dense": float(os.getenv("RRF_SITE_DENSE_WEIGHT", "1.0")),
+             "lexical": float(os.getenv("RRF_SITE_LEXICAL_WEIGHT", "1.0"))},
+    "docs": {"dense": float(os.getenv("RRF_DOCS_DENSE_WEIGHT", "1.0")),
+             "lexical": float(os.getenv("RRF_DOCS_LEXICAL_WEIGHT", "1.0"))},
+}
+# other workers write to the same chroma store; recheck the collection size this often
+LEXICAL_REFRESH_SECONDS = int(os.getenv("LEXICAL_REFRESH_SECONDS", "60"))
+_LEXICAL_LOAD_PAGE = 1000
+
+#-------------------------------------------------------------------------------------------
+# Lexical (BM25) side: built from the collection on first use, then kept in step by
+# every add/delete that goes through this module. Writes from other workers show up as a
+# changed collection size; the index is then rebuilt in a background thread and swapped in,
+# so queries keep using the current one meanwhile.
+
+_lexical = {"site": BM25Index(), "docs": BM25Index()}
+# pending: writes made while a (re)build is loading, replayed on the new index before the swap
+_lexical_state = {"site": {"loaded": False, "checked": 0.0, "pending": None},
+                  "docs": {"loaded": False, "checked": 0.0, "pending": None}}
+_lexical_lock = threading.Lock()
+_lexical_load_lock = threading.Lock()
+
+def _rebuild_lexical(collection_type):
+    state = _lexical_state[collection_type]
+    try:
+        collection = get_collection(collection_type)
+        count = collection.count()
+        if state["loaded"] and count == len(_lexical[collection_type]):
+            return
+        index = BM25Index()
+        for offset in range(0, count, _LEXICAL_LOAD_PAGE):
+            page = collection.get(limit=_LEXICAL_LOAD_PAGE, offset=offset, include=["documents", "metadatas"])
+            index.add(page["ids"], page["documents"], page["metadatas"])
+        with _lexical_lock:
+            for op, args in state["pending"]:
+                getattr(index, op)(*args)
+            _lexical[collection_type] = index
+            state["loaded"] = True
+    finally:
+        with _lexical_lock:
+            state["pending"] = None
+
+def _refresh_lexical(collection_type):
+    try:
+        _rebuild_lexical(collection_type)
+    except Exception as e:
+        print(f"Lexical index refresh failed ({collection_type}): {e}")
+
+def _lexical_index(collection_type):
+    state = _lexical_state[collection_type]
+    if not state["loaded"]:
+        # first use: nothing to serve yet, so load it here
+        with _lexical_load_lock:
+            if not state["loaded"]:
+                with _lexical_lock:
+                    state["pending"] = []
+                    state["checked"] = time.time()
+                _rebuild_lexical(collection_type)
+        return _lexical[collection_type]
+
+    now = time.time()
+    if now - state["checked"] >= LEXICAL_REFRESH_SECONDS:
+        with _lexical_lock:
+            if state["pending"] is None and now - state["checked"] >= LEXICAL_REFRESH_SECONDS:
+                state["checked"] = now
+                state["pending"] = []
+                threading.Thread(target=_refresh_lexical, args=(collection_type,), daemon=True).start()
+    return _lexical[collection_type]
+
+def _lexical_write(collection_type, op, *args):
+    state = _lexical_state[collection_type]
+    with _lexical_lock:
+        if state["pending"] is not None:
+            state["pending"].append((op, args))
+        if state["loaded"]:
+            getattr(_lexical[collection_type], op)(*args)
+
+def _lexical_add(collection_type, ids, documents, metadatas):
+    # copies: the caller reuses its batch lists
+    _lexical_write(collection_type, "add", list(ids), list(documents), list(metadatas))
+
+def _delete(collection_type, ids=None, where=None):
+    get_collection(collection_type).delete(ids=ids, where=where)
+    if ids:
+        _lexical_write(collection_type, "remove", list(ids))
+    if where:
+        _lexical_write(collection_type, "remove_where", where)
+
+def delete_vectors(ids, collection_type="site"):
+    _delete(collection_type, ids=ids)
+
+def add_to_vector_db(text: str, metadata: dict, collection_type="docs", id_prefix: str = None):
+    add_many_to_vector_db([(text, metadata, id_prefix)], collection_type)
+
+def add_many_to_vector_db(items, collection_type="docs", prechunked: bool = False):
+    """
+    items: iterable of (text, metadata, id_prefix). Chunks from all texts are pooled and
+    embedded / written EMBED_BATCH_SIZE at a time, so N texts cost ceil(chunks / batch) calls.
+    prechunked: each text is already one chunk (spreadsheet row groups) and is not split again.
+    """
+    collection = get_collection(collection_type)
+
+    documents, metadatas, ids = [], [], []
 
-openai_ef = embedding_functions.OpenAIEmbeddingFunction(
-    api_key=os.getenv("OPENAI_API_KEY"),
-    model_name="text-embedding-3-small" 
-)
+    def flush():
+        if documents:
+            collection.upsert(
+                documents=documents,
+                embeddings=cached_ef(documents),
+                metadatas=metadatas,
+                ids=ids
+            )
+            _lexical_add(collection_type, ids, documents, metadatas)
+            documents.clear(); metadatas.clear(); ids.clear()
 
-site_collection = client.get_or_create_collection(name="site_knowledge", embedding_function=openai_ef)
-docs_collection = client.get_or_create_collection(name="user_documents", embedding_function=openai_ef)
+    for text, metadata, id_prefix in items:
+        for i, chunk in enumerate([text] if prechunked else chunk_text(text)):
+            # deterministic ids make re-indexing the same source an upsert instead of a duplicate
+            documents.append(chunk)
+            metadatas.append({**metadata, "chunk_index": i})
+            ids.append(f"{id_prefix}-{i}" if id_prefix else str(uuid.uuid4()))
+            if len(documents) >= EMBED_BATCH_SIZE:
+                flush()
+    flush()
 
-def add_to_vector_db(text: str, metadata: dict, collection_type="docs"):
-    collection = docs_collection if collection_type == "docs" else site_collection
+def _dense_search(query, where, collection_type, n_results):
+    results = get_collection(collection_type).query(
+        query_embeddings=cached_ef([query]),
+        n_results=n_results,
+        where=where
+    )
+    if not results['ids']:
+        return []
+    return [
+        (doc_id, text, meta or {})
+        for doc_id, text, meta in zip(results['ids'][0], results['documents'][0], results['metadatas'][0])
+    ]
+
+def query_vector_db(query: str, where: dict = None, collection_type="docs", n_results: int = 3, mode: str = None):
+    """
+    mode "dense" = chroma only, "lexical" = BM25 only, "hybrid" = both fused with
+    reciprocal-rank fusion (RRF_K and the per-collection RRF_WEIGHTS).
+    """
+    mode = mode or RETRIEVAL_MODE
+
+    if mode == "dense":
+        hits = _dense_search(query, where, collection_type, n_results)
+        return [{"text": text, "metadata": meta} for _, text, meta in hits]
 
-    chunks = [text[i:i+500] for i in range(0, len(text), 500)]
-    ids = [str(uuid.uuid4()) for _ in chunks]
+    index = _lexical_index(collection_type)
+    if mode == "lexical":
+        ranked = index.search(query, n_results, where)
+        return [{"text": index.get(i)[0], "metadata": index.get(i)[1]} for i, _ in ranked]
 
-    collection.add(
-        documents=chunks,
-        metadatas=[metadata for _ in chunks],
-        ids=ids
+    candidates = n_results * CANDIDATE_FACTOR
+    dense = _dense_search(query, where, collection_type, candidates)
+    lexical = index.search(query, candidates, where)
+
+    found = {doc_id: (text, meta) for doc_id, text, meta in dense}
+    for doc_id, _ in lexical:
+        if doc_id not in found:
+            found[doc_id] = index.get(doc_id)
+
+    weights = RRF_WEIGHTS[collection_type]
+    fused = reciprocal_rank_fusion(
+        [[d[0] for d in dense], [d[0] for d in lexical]],
+        [weights["dense"], weights["lexical"]],
+        k=RRF_K,
     )
+    return [{"text": found[i][0], "metadata": found[i][1]} for i in fused[:n_results] if found[i][0]]
 
-def search_vector_db(query: str, conversation_id: int = None, collection_type="docs"):
-    collection = docs_collection if collection_type == "docs" else site_collection
-    
+def search_vector_db(query: str, conversation_id: int = None, collection_type="docs", n_results: int = 3):
     where_filter = None
     if conversation_id and collection_type == "docs":
         where_filter = {"conversation_id": conversation_id}
-    
-    results = collection.query(
-        query_texts=[query],
-        n_results=3,
-        where=where_filter
+
+    hits = query_vector_db(query, where_filter, collection_type, n_results)
+    return "\n".join(h["text"] for h in hits)
+
+#-------------------------------------------------------------------------------------------
+# Site knowledge: chunk ids are "site-<row id>-<n>" and every chunk carries the row's content_hash
+
+def index_site_knowledge(rows):
+    """rows: iterable of (id, section_name, content, content_hash); replaces any existing chunks."""
+    rows = list(rows)
+    if not rows:
+        return
+    _delete("site", where={"id": {"$in": [r[0] for r in rows]}})
+    add_many_to_vector_db(
+        [
+            (content, {"section_name": section_name, "id": row_id, "content_hash": content_hash}, f"site-{row_id}")
+            for row_id, section_name, content, content_hash in rows
+        ],
+        collection_type="site",
     )
-    
-    return "\n".join(results['documents'][0]) if results['documents'] else ""
\ No newline at end of file
+
+#-------------------------------------------------------------------------------------------
+# Uploaded documents: one chunk set per DocumentKnowledge row, filtered by conversation_id
+
+_indexed_documents = set()
+
+def index_document(doc_id: int, conversation_id: int, file_name: str, text: str):
+    delete_document_vectors(doc_id)
+    index_document_part(doc_id, conversation_id, file_name, text)
+    _indexed_documents.add(doc_id)
+
+def index_document_part(doc_id: int, conversation_id: int, file_name: str, text: str, part: int = 0):
+    # streaming ingestion indexes a document as consecutive parts; ids stay unique per part
+    add_to_vector_db(
+        text,
+        metadata={"conversation_id": conversation_id, "document_id": doc_id, "file_name": file_name or ""},
+        collection_type="docs",
+        id_prefix=f"doc-{doc_id}" if part == 0 else f"doc-{doc_id}-p{part}"
+    )
+
+def index_document_rows(doc_id: int, conversation_id: int, file_name: str, chunks, start: int = 0):
+    """
+    Spreadsheet row groups (see spreadsheet.py), one vector each. Streamed in batches:
+    start is the number of groups already indexed; the first batch replaces earlier vectors.
+    """
+    if start == 0:
+        delete_document_vectors(doc_id)
+    metadata = {"conversation_id": conversation_id, "document_id": doc_id, "file_name": file_name or ""}
+    add_many_to_vector_db(
+        ((chunk, metadata, f"doc-{doc_id}-g{n}") for n, chunk in enumerate(chunks, start)),
+        collection_type="docs",
+        prechunked=True,
+    )
+
+def delete_document_vectors(doc_id: int):
+    _delete("docs", where={"document_id": doc_id})
+    _indexed_documents.discard(doc_id)
+
+def mark_document_indexed(doc_id: int):
+    _indexed_documents.add(doc_id)
+
+def ensure_document_indexed(doc_id: int, conversation_id: int, file_name: str, text: str):
+    # backfill for documents uploaded before chunk indexing existed
+    if doc_id in _indexed_documents:
+        return
+    existing = get_collection("docs").get(where={"document_id": doc_id}, limit=1, include=[])
+    if existing["ids"]:
+        _indexed_documents.add(doc_id)
+    else:
+        index_document(doc_id, conversation_id, file_name, text)
+
+def search_document_chunks(query: str, conversation_id: int, document_ids: list, n_results: int = 6):
+    where = {"conversation_id": conversation_id}
+    if document_ids:
+        where = {"$and": [where, {"document_id": {"$in": list(document_ids)}}]}
+    return query_vector_db(query, where, "docs", n_results)
+
+def delete_conversation_vectors(conversation_id: int):
+    _delete("docs", where={"conversation_id": conversation_id})
+
+def embedding_cache_stats():
+    return cached_ef.stats()